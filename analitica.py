@@ -0,0 +1,230 @@
+"""
+analitica.py - Consultas analíticas con DuckDB sobre la base de anuncios
+
+Medianas, cuartiles, límites IQR, histogramas y series de tiempo por
+(modelo, año) se calculan en SQL vectorizado, sin pasar los precios por
+listas de Python.
+
+Fuente de datos (ver `conectar`):
+- el snapshot Parquet de exportar_parquet.py, si existe y está al día con la base;
+- si no, la base SQLite adjunta en solo lectura (extensión sqlite de DuckDB).
+  DuckDB descarga esa extensión la primera vez que se usa: sin red (ni la
+  extensión ya instalada) `conectar` retorna None.
+
+Los cuartiles replican `statistics.quantiles(n=4)` (método 'exclusive') y el
+filtro de outliers replica `filtrar_outliers`, así `precios_referencia`
+retorna lo mismo que `get_precio_referencia` para cada (modelo, año).
+
+duckdb es opcional (requirements-dashboard.txt): sin él, DUCKDB_DISPONIBLE es
+False y `conectar` retorna None.
+"""
+
+import os
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import duckdb
+    DUCKDB_DISPONIBLE = True
+except ImportError:
+    DUCKDB_DISPONIBLE = False
+
+logger = logging.getLogger(__name__)
+
+# Factor del rango intercuartil que usa filtrar_outliers
+FACTOR_IQR = 2.0
+
+# Cuartil i (1..3) de una lista ordenada `v`, igual que statistics.quantiles(v, n=4)[i-1]:
+# posición (n+1)*i/4 acotada a [1, n-1] e interpolación lineal. Las listas de DuckDB son base 1.
+MACROS = """
+    CREATE OR REPLACE MACRO _pos_cuartil(n, i) AS least(greatest((i * (n + 1)) // 4, 1), n - 1);
+    CREATE OR REPLACE MACRO _delta_cuartil(n, i) AS i * (n + 1) - 4 * _pos_cuartil(n, i);
+    CREATE OR REPLACE MACRO cuartil(v, i) AS (
+        v[_pos_cuartil(len(v), i)] * (4 - _delta_cuartil(len(v), i))
+        + v[_pos_cuartil(len(v), i) + 1] * _delta_cuartil(len(v), i)
+    ) / 4;
+    CREATE OR REPLACE MACRO mediana_lista(v) AS CASE
+        WHEN len(v) = 0 THEN NULL
+        WHEN len(v) % 2 = 1 THEN v[len(v) // 2 + 1]
+        ELSE (v[len(v) // 2] + v[len(v) // 2 + 1]) / 2
+    END;
+    CREATE OR REPLACE MACRO sin_outliers(v) AS CASE
+        WHEN len(v) < 4 THEN v
+        WHEN len(list_filter(v, lambda x: x BETWEEN
+                cuartil(v, 1) - {f} * (cuartil(v, 3) - cuartil(v, 1))
+                AND cuartil(v, 3) + {f} * (cuartil(v, 3) - cuartil(v, 1)))) < 2 THEN v
+        ELSE list_filter(v, lambda x: x BETWEEN
+                cuartil(v, 1) - {f} * (cuartil(v, 3) - cuartil(v, 1))
+                AND cuartil(v, 3) + {f} * (cuartil(v, 3) - cuartil(v, 1)))
+    END;
+""".format(f=FACTOR_IQR)
+
+def _literal(texto: str) -> str:
+    """Literal SQL para rutas (ATTACH y CREATE VIEW no aceptan parámetros)"""
+    return "'" + texto.replace("'", "''") + "'"
+
+def _fuente_parquet(db_path: str) -> Optional[str]:
+    """Glob del snapshot Parquet si está al día con la base"""
+    from exportar_parquet import directorio_snapshot, snapshot_al_dia
+    destino = directorio_snapshot(db_path)
+    if not snapshot_al_dia(db_path, destino):
+        return None
+    return os.path.join(destino, "anuncios", "*", "*", "*.parquet")
+
+def conectar(db_path: Optional[str] = None, usar_snapshot: bool = True) -> Optional["duckdb.DuckDBPyConnection"]:
+    """
+    Conexión DuckDB en memoria con una vista `anuncios` sobre el snapshot
+    Parquet o sobre la base SQLite. Retorna None si no hay duckdb o fuente.
+    Adjuntar la base SQLite instala en tiempo de ejecución la extensión sqlite
+    de DuckDB (se descarga una vez a ~/.duckdb/extensions).
+    """
+    if not DUCKDB_DISPONIBLE:
+        return None
+    if db_path is None:
+        import utils_analisis
+        db_path = utils_analisis.DB_PATH
+    db_path = os.path.abspath(db_path)
+    if not os.path.exists(db_path):
+        return None
+
+    conn = duckdb.connect()
+    try:
+        patron = _fuente_parquet(db_path) if usar_snapshot else None
+        if patron:
+            conn.execute(
+                f"CREATE VIEW anuncios AS SELECT * EXCLUDE (mes) FROM read_parquet({_literal(patron)}, hive_partitioning = true)"
+            )
+        else:
+            conn.execute(f"ATTACH {_literal(db_path)} AS base (TYPE sqlite, READ_ONLY)")
+            conn.execute("CREATE VIEW anuncios AS SELECT * FROM base.anuncios")
+        conn.execute(MACROS)
+    except Exception as e:
+        logger.warning(f"⚠️ DuckDB no pudo abrir {db_path}: {e}")
+        conn.close()
+        return None
+    return conn
+
+def estadisticas_precio(conn: "duckdb.DuckDBPyConnection", modelo: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Por (modelo, año): muestra, mediana, cuartiles, límites IQR y precios extremos"""
+    filas = conn.execute(f"""
+        WITH grupos AS (
+            SELECT modelo, anio, list_sort(list(precio)) AS v
+            FROM anuncios
+            WHERE precio > 0 AND anio IS NOT NULL {"AND modelo = ?" if modelo else ""}
+            GROUP BY modelo, anio
+        )
+        SELECT modelo, anio, len(v) AS muestra,
+               mediana_lista(v) AS mediana,
+               CASE WHEN len(v) >= 2 THEN cuartil(v, 1) END AS q1,
+               CASE WHEN len(v) >= 2 THEN cuartil(v, 3) END AS q3,
+               v[1] AS minimo, v[len(v)] AS maximo,
+               len(sin_outliers(v)) AS muestra_filtrada,
+               mediana_lista(sin_outliers(v)) AS mediana_filtrada
+        FROM grupos
+        ORDER BY modelo, anio
+    """, [modelo] if modelo else []).fetchall()
+
+    columnas = ("modelo", "anio", "muestra", "mediana", "q1", "q3", "minimo", "maximo",
+                "muestra_filtrada", "mediana_filtrada")
+    resultado = []
+    for fila in filas:
+        datos = dict(zip(columnas, fila))
+        if datos["q1"] is not None:
+            iqr = datos["q3"] - datos["q1"]
+            datos["lim_inf"] = datos["q1"] - FACTOR_IQR * iqr
+            datos["lim_sup"] = datos["q3"] + FACTOR_IQR * iqr
+        else:
+            datos["lim_inf"] = datos["lim_sup"] = None
+        resultado.append(datos)
+    return resultado
+
+def precios_referencia(
+    conn: "duckdb.DuckDBPyConnection",
+    pares: Iterable[Tuple[str, int]],
+    tolerancia: Optional[int] = None
+) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """
+    Precio de referencia para muchos (modelo, año) en una sola consulta, con el
+    mismo resultado que llamar a get_precio_referencia para cada par.
+    """
+    from utils_analisis import (
+        TOLERANCIA_PRECIO_REF, MUESTRA_MINIMA_CONFIABLE, MUESTRA_MINIMA_MEDIA, PRECIOS_POR_DEFECTO
+    )
+    pares = list(dict.fromkeys(pares))
+    if not pares:
+        return {}
+    tolerancia = tolerancia or TOLERANCIA_PRECIO_REF
+
+    filas = conn.execute("""
+        WITH pedidos AS (
+            SELECT unnest(?::VARCHAR[]) AS modelo, unnest(?::INTEGER[]) AS anio
+        ),
+        grupos AS (
+            SELECT p.modelo, p.anio,
+                   list_sort(list(a.precio) FILTER (WHERE a.precio IS NOT NULL)) AS v
+            FROM pedidos p
+            LEFT JOIN anuncios a
+              ON a.modelo = p.modelo AND a.anio BETWEEN p.anio - ? AND p.anio + ? AND a.precio > 0
+            GROUP BY p.modelo, p.anio
+        ),
+        filtrados AS (
+            SELECT modelo, anio, v, sin_outliers(v) AS f FROM grupos
+        )
+        SELECT modelo, anio, len(v), mediana_lista(v), v[1], v[len(v)],
+               len(f), mediana_lista(f), f[1], f[len(f)]
+        FROM filtrados
+    """, [[m for m, _ in pares], [a for _, a in pares], tolerancia, tolerancia]).fetchall()
+
+    referencias = {}
+    for modelo, anio, n, mediana, minimo, maximo, n_f, mediana_f, minimo_f, maximo_f in filas:
+        n = n or 0  # sin precios en el rango la lista es NULL
+        if n >= MUESTRA_MINIMA_CONFIABLE:
+            ref = {"precio": int(mediana_f), "confianza": "alta", "muestra": n_f, "rango": f"{minimo_f}-{maximo_f}"}
+        elif n >= MUESTRA_MINIMA_MEDIA:
+            ref = {"precio": int(mediana), "confianza": "media", "muestra": n, "rango": f"{minimo}-{maximo}"}
+        else:
+            ref = {"precio": PRECIOS_POR_DEFECTO.get(modelo, 50000), "confianza": "baja", "muestra": 0, "rango": "default"}
+        referencias[(modelo, anio)] = ref
+    return referencias
+
+def histograma_precios(
+    conn: "duckdb.DuckDBPyConnection", modelo: str, anio: int, bins: int = 10
+) -> List[Tuple[float, float, int]]:
+    """Histograma de ancho fijo entre el precio mínimo y el máximo: (desde, hasta, cantidad)"""
+    filas = conn.execute("""
+        WITH p AS (SELECT precio FROM anuncios WHERE modelo = ? AND anio = ? AND precio > 0),
+        r AS (SELECT min(precio) AS mn, greatest(max(precio) - min(precio), 1) / ? AS ancho FROM p)
+        SELECT least(floor((precio - mn) / ancho), ? - 1)::INTEGER AS bin, any_value(mn), any_value(ancho), count(*)
+        FROM p, r GROUP BY bin ORDER BY bin
+    """, [modelo, anio, bins, bins]).fetchall()
+    if not filas:
+        return []
+
+    _, mn, ancho, _ = filas[0]
+    conteos = {fila[0]: fila[3] for fila in filas}
+    return [(mn + i * ancho, mn + (i + 1) * ancho, conteos.get(i, 0)) for i in range(bins)]
+
+def serie_precios(
+    conn: "duckdb.DuckDBPyConnection", modelo: str, anio: int, periodo: str = "day"
+) -> List[Tuple[Any, float, float, float, int]]:
+    """Por día/semana/mes: (fecha, mediana, promedio de precio, ROI promedio, cantidad)"""
+    if periodo not in ("day", "week", "month"):
+        raise ValueError(f"Periodo inválido: {periodo}")
+    return conn.execute(f"""
+        SELECT CAST(date_trunc('{periodo}', CAST(fecha_scrape AS DATE)) AS DATE) AS fecha,
+               median(precio), avg(precio), avg(roi), count(*)
+        FROM anuncios
+        WHERE modelo = ? AND anio = ? AND precio > 0 AND fecha_scrape IS NOT NULL
+        GROUP BY fecha ORDER BY fecha
+    """, [modelo, anio]).fetchall()
+
+def rendimiento_modelos(conn: "duckdb.DuckDBPyConnection", dias: int = 7) -> Dict[str, float]:
+    """Como get_rendimiento_modelos: proporción de anuncios con score ≥ SCORE_MIN_DB"""
+    from utils_analisis import SCORE_MIN_DB
+    filas = conn.execute("""
+        SELECT modelo, avg(CASE WHEN score >= ? THEN 1 ELSE 0 END)
+        FROM anuncios
+        WHERE CAST(fecha_scrape AS DATE) >= current_date - CAST(? AS INTEGER)
+        GROUP BY modelo
+    """, [SCORE_MIN_DB, dias]).fetchall()
+    return {modelo: round(r or 0.0, 3) for modelo, r in filas}
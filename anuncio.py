@@ -0,0 +1,344 @@
+"""
+anuncio.py - Tipos de datos compartidos por el scraper, el análisis y el bot
+
+TextoAnuncio: texto de un anuncio con sus vistas normalizadas (sin emojis
+numéricos, en minúsculas, sin acentos...) calculadas una sola vez y solo
+cuando se piden.
+
+TokenNumerico: cada número del texto con su posición, moneda, formato y
+palabras cercanas, obtenidos en un solo recorrido (ver tokenizar_numeros).
+
+ResolucionAño: año de un anuncio junto con su procedencia (corrección, patrón,
+contexto del modelo, palabra clave, precio histórico...), confianza y candidatos.
+
+Anuncio: registro compacto de un anuncio analizado, que viaja igual entre el
+scraper, el análisis, la base de datos y el bot.
+
+ResultadoScraping: lo que el scraper entrega al bot, el Anuncio más qué pasó
+con él en la base (nuevo, actualizado, repetido o reutilizado de caché).
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple, Union
+from correcciones import hash_texto
+
+# Los dígitos emoji "keycap" son dígito + U+FE0F + U+20E3: basta con borrar los
+# modificadores. Los dígitos en círculo se mapean directamente.
+_TABLA_EMOJIS_NUMERICOS = str.maketrans({
+    '\ufe0f': None, '\u20e3': None,
+    '⓪': '0', '①': '1', '②': '2', '③': '3', '④': '4',
+    '⑤': '5', '⑥': '6', '⑦': '7', '⑧': '8', '⑨': '9'
+})
+
+_PATRON_FORMATO_ANO = re.compile(r'\b(19|20)[,\.](\d{2})\b')
+
+def limpiar_emojis_numericos(texto: str) -> str:
+    return texto.translate(_TABLA_EMOJIS_NUMERICOS)
+
+def normalizar_formatos_ano(texto: str) -> str:
+    return _PATRON_FORMATO_ANO.sub(r'\1\2', texto)
+
+# Moneda opcional ("Q", "Q.", "$"; la q no puede ser final de palabra), el número
+# con sus separadores y el sufijo "quetzales"
+_PATRON_TOKEN_NUMERICO = re.compile(
+    r"(?:(?P<moneda>(?<![^\W\d_])q\.?|\$)\s?)?"
+    r"(?P<numero>\d+(?:[.,]\d+)*)"
+    r"(?P<quetzales>\s*quetzal(?:es)?\b)?",
+    flags=re.IGNORECASE
+)
+_PATRON_MILES = re.compile(r"\d{1,3}(?P<sep>[.,])\d{3}(?:(?P=sep)\d{3})*(?:(?!(?P=sep))[.,]\d{1,2})?")
+
+# Categoría → palabras que, cerca de un número, indican qué representa
+PALABRAS_CONTEXTO_NUMERICO = {
+    "precio": ["precio", "negociable", "enganche", "cuota", "cuotas", "pago", "ganga", "vendo en"],
+    "kilometraje": ["km", "kms", "kilometros", "kilómetros", "kilometraje", "millas", "recorrido"],
+    "telefono": ["tel", "cel", "telefono", "teléfono", "celular", "whatsapp", "wa", "llamar", "contacto"],
+    "motor": ["cc", "motor", "cilindros", "litros", "turbo"],
+    "anio": ["modelo", "año", "m/", "del", "versión"],
+}
+_PALABRA_A_CONTEXTO = {p: c for c, palabras in PALABRAS_CONTEXTO_NUMERICO.items() for p in palabras}
+_PATRON_CONTEXTO_NUMERICO = re.compile(
+    r"(?<![^\W\d_])(" + "|".join(
+        re.escape(p) for p in sorted(_PALABRA_A_CONTEXTO, key=len, reverse=True)
+    ) + r")(?![^\W\d_])",
+    flags=re.IGNORECASE
+)
+VENTANA_CONTEXTO_NUMERICO = 15
+
+@dataclass(frozen=True, slots=True)
+class TokenNumerico:
+    """Número encontrado en el texto"""
+    raw: str                      # Tal como aparece ("35,000", "1.6", "2015")
+    valor: int                    # Parte entera ya sin separadores de miles
+    inicio: int                   # Posición del primer dígito
+    fin: int                      # Posición después del último dígito
+    moneda: Optional[str]         # "Q", "$", "quetzales" o None
+    separador: Optional[str]      # "," o "." si el número usa separadores
+    decimal: bool                 # Tiene parte decimal ("1.6", "35,000.00")
+    pegado: bool                  # Unido a letras ("b16", "1600cc", "2.0l")
+    contexto: FrozenSet[str]      # Categorías de PALABRAS_CONTEXTO_NUMERICO cercanas
+
+    @property
+    def digitos(self) -> int:
+        return len(str(self.valor))
+
+def _valor_numerico(raw: str) -> Tuple[int, Optional[str], bool]:
+    """(parte entera, separador, tiene decimales) de un número con separadores"""
+    if raw.isdigit():
+        return int(raw), None, False
+    if _PATRON_MILES.fullmatch(raw):
+        sep = raw[len(raw.split(".")[0].split(",")[0])]
+        entero, _, decimales = raw.rpartition("," if sep == "." else ".")
+        if not entero or len(decimales) == 3:
+            entero = raw
+        return int(re.sub(r"\D", "", entero)), sep, entero != raw
+    entero = re.split(r"[.,]", raw)[0]
+    return int(entero), raw[len(entero)], True
+
+def tokenizar_numeros(texto: str) -> List[TokenNumerico]:
+    """Recorre el texto una vez y retorna todos los números con su contexto"""
+    palabras = [(m.start(), m.end(), _PALABRA_A_CONTEXTO[m.group(1).lower()])
+                for m in _PATRON_CONTEXTO_NUMERICO.finditer(texto)]
+    tokens = []
+    for m in _PATRON_TOKEN_NUMERICO.finditer(texto):
+        raw = m.group("numero")
+        inicio, fin = m.span("numero")
+        valor, separador, decimal = _valor_numerico(raw)
+
+        moneda = None
+        if m.group("quetzales"):
+            moneda = "quetzales"
+        elif m.group("moneda"):
+            moneda = "$" if m.group("moneda") == "$" else "Q"
+
+        antes = texto[inicio - 1] if inicio > 0 else " "
+        despues = texto[fin] if fin < len(texto) else " "
+        pegado = (antes.isalpha() and not moneda) or despues.isalpha()
+
+        contexto = frozenset(
+            categoria for p_inicio, p_fin, categoria in palabras
+            if p_fin >= inicio - VENTANA_CONTEXTO_NUMERICO and p_inicio <= fin + VENTANA_CONTEXTO_NUMERICO
+        )
+        tokens.append(TokenNumerico(raw, valor, inicio, fin, moneda, separador, decimal, pegado, contexto))
+    return tokens
+
+class TextoAnuncio:
+    """
+    Texto inmutable de un anuncio. Cada vista derivada se calcula en el primer
+    acceso y se reutiliza en todas las funciones de análisis.
+    """
+    __slots__ = ("original", "_limpio", "_lower", "_ascii", "_primera_linea", "_hash", "_tokens")
+
+    def __init__(self, texto: str):
+        object.__setattr__(self, "original", texto or "")
+        for slot in self.__slots__[1:]:
+            object.__setattr__(self, slot, None)
+
+    @classmethod
+    def de(cls, texto: Union[str, "TextoAnuncio", None]) -> "TextoAnuncio":
+        """Envuelve un str; si ya es TextoAnuncio lo retorna tal cual"""
+        if isinstance(texto, cls):
+            return texto
+        return cls(texto or "")
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError("TextoAnuncio es inmutable")
+
+    def _memorizar(self, slot: str, valor: str) -> str:
+        object.__setattr__(self, slot, valor)
+        return valor
+
+    @property
+    def limpio(self) -> str:
+        """Sin emojis numéricos y con años tipo '2,007' normalizados"""
+        if self._limpio is None:
+            return self._memorizar("_limpio", normalizar_formatos_ano(limpiar_emojis_numericos(self.original)))
+        return self._limpio
+
+    @property
+    def lower(self) -> str:
+        """Vista limpia en minúsculas"""
+        if self._lower is None:
+            return self._memorizar("_lower", self.limpio.lower())
+        return self._lower
+
+    @property
+    def ascii(self) -> str:
+        """Vista en minúsculas sin acentos ni caracteres no ASCII"""
+        if self._ascii is None:
+            plano = unicodedata.normalize("NFKD", self.lower).encode("ascii", "ignore").decode("ascii")
+            return self._memorizar("_ascii", plano)
+        return self._ascii
+
+    @property
+    def primera_linea(self) -> str:
+        """Primera línea (o primeros 150 caracteres) de la vista en minúsculas"""
+        if self._primera_linea is None:
+            texto = self.lower
+            return self._memorizar("_primera_linea", texto.split('\n')[0] if '\n' in texto else texto[:150])
+        return self._primera_linea
+
+    @property
+    def tokens(self) -> List[TokenNumerico]:
+        """Números de la vista en minúsculas, tokenizados una sola vez"""
+        if self._tokens is None:
+            return self._memorizar("_tokens", tokenizar_numeros(self.lower))
+        return self._tokens
+
+    def token_en(self, posicion: int) -> Optional[TokenNumerico]:
+        """Token de la vista en minúsculas que contiene la posición dada"""
+        for token in self.tokens:
+            if token.inicio <= posicion < token.fin:
+                return token
+            if token.inicio > posicion:
+                break
+        return None
+
+    @property
+    def hash(self) -> str:
+        """Hash del texto original, usado como clave de caché"""
+        if self._hash is None:
+            return self._memorizar("_hash", hash_texto(self.original))
+        return self._hash
+
+    def __str__(self) -> str:
+        return self.original
+
+    def __repr__(self) -> str:
+        return f"TextoAnuncio({self.original[:40]!r})"
+
+    def __len__(self) -> int:
+        return len(self.original)
+
+    def __eq__(self, otro) -> bool:
+        if isinstance(otro, TextoAnuncio):
+            return self.original == otro.original
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.original)
+
+# Las funciones de análisis aceptan tanto str como TextoAnuncio
+Texto = Union[str, TextoAnuncio]
+
+# Procedencias posibles de un año. Las dos últimas no salen del texto: se infieren
+# de los precios históricos del modelo
+FUENTES_AÑO_TEXTO = ("correccion", "patron", "modelo", "keyword", "titulo", "general")
+FUENTES_AÑO_INFERIDO = ("precio_historico", "mas_comun")
+
+@dataclass(frozen=True, slots=True)
+class ResolucionAño:
+    """Resultado único de resolver el año de un anuncio"""
+    anio: Optional[int] = None
+    fuente: Optional[str] = None      # Una de FUENTES_AÑO_TEXTO / FUENTES_AÑO_INFERIDO
+    confianza: str = "baja"           # "alta", "media" o "baja"
+    candidatos: Tuple[Tuple[int, int, str], ...] = ()  # (año, prioridad, fuente) encontrados en el texto
+
+    @property
+    def inferido(self) -> bool:
+        """True si el año no estaba en el texto y se asignó con datos históricos"""
+        return self.fuente in FUENTES_AÑO_INFERIDO
+
+    def __bool__(self) -> bool:
+        return self.anio is not None
+
+# Columnas de `anuncios` que se leen/escriben desde un Anuncio, en orden
+COLUMNAS_DB = (
+    "link", "modelo", "anio", "precio", "km", "roi", "score", "relevante",
+    "confianza_precio", "muestra_precio", "año_asignado_inteligente"
+)
+
+# Campos que no son columnas de la DB pero se conservan al serializar
+_CAMPOS_EXTRA = ("roi_data", "fuente_anio")
+
+@dataclass(slots=True)
+class Anuncio:
+    """Anuncio analizado. Los campos derivados se calculan al pedirlos."""
+    link: str = ""
+    modelo: str = ""
+    anio: Optional[int] = None
+    precio: int = 0
+    km: str = ""
+    roi: float = 0.0
+    score: int = 0
+    relevante: bool = False
+    confianza_precio: str = "baja"
+    muestra_precio: int = 0
+    año_asignado_inteligente: bool = False
+    fuente_anio: Optional[str] = field(default=None, compare=False)
+    texto: Optional[TextoAnuncio] = field(default=None, repr=False, compare=False)
+    roi_data: Optional[Dict[str, Any]] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def desde_fila(cls, fila: Sequence[Any], columnas: Sequence[str] = COLUMNAS_DB) -> "Anuncio":
+        """Construye el anuncio desde una fila de `anuncios` con las columnas indicadas"""
+        return cls(**{col: valor for col, valor in zip(columnas, fila) if valor is not None})
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any]) -> "Anuncio":
+        """Acepta tanto las claves de la DB como las heredadas ('año', 'url')"""
+        datos = dict(datos)
+        if "año" in datos:
+            datos.setdefault("anio", datos.pop("año"))
+        if "url" in datos:
+            datos.setdefault("link", datos.pop("url"))
+        texto = datos.pop("texto", None)
+        permitidos = {k: v for k, v in datos.items() if k in COLUMNAS_DB or k in _CAMPOS_EXTRA}
+        return cls(texto=TextoAnuncio.de(texto) if texto else None, **permitidos)
+
+    def a_parametros_db(self) -> tuple:
+        """Valores en el orden de COLUMNAS_DB, listos para un INSERT"""
+        return tuple(getattr(self, col) for col in COLUMNAS_DB)
+
+    def a_dict(self) -> Dict[str, Any]:
+        """Representación serializable (JSON) sin el texto"""
+        datos = {col: getattr(self, col) for col in COLUMNAS_DB}
+        for campo in _CAMPOS_EXTRA:
+            if getattr(self, campo) is not None:
+                datos[campo] = getattr(self, campo)
+        return datos
+
+    @property
+    def mensaje_telegram(self) -> str:
+        """Mensaje Markdown del anuncio; se arma en cada acceso porque roi/score/relevante se asignan después"""
+        return (
+            f"🚘 *{self.modelo.title()}*\n"
+            f"• Año: {self.anio}\n"
+            f"• Precio: Q{self.precio:,}\n"
+            f"• ROI: {self.roi:.1f}%\n"
+            f"• Score: {self.score}/10\n"
+            f"🔗 {self.link}"
+        )
+
+    def diferente_de(self, otro: Optional["Anuncio"]) -> bool:
+        """True si cambió algún campo crítico o el ROI/score se movió lo suficiente"""
+        if otro is None:
+            return True
+
+        for campo in ("modelo", "anio", "precio"):
+            if str(getattr(self, campo) or "") != str(getattr(otro, campo) or ""):
+                return True
+
+        if abs((self.roi or 0) - (otro.roi or 0)) > 5:
+            return True
+
+        if abs((self.score or 0) - (otro.score or 0)) > 10:
+            return True
+
+        return False
+
+# Estados que el scraper asigna al persistir; solo los primeros dos ameritan aviso
+ESTADOS_CON_CAMBIOS = ("nuevo", "actualizado")
+
+@dataclass(slots=True)
+class ResultadoScraping:
+    """Anuncio analizado por el scraper junto con lo que ocurrió al guardarlo"""
+    anuncio: Anuncio
+    estado: str  # nuevo | actualizado | repetido | cache
+
+    @property
+    def con_cambios(self) -> bool:
+        """True si el anuncio es nuevo o cambió desde la última vez que se guardó"""
+        return self.estado in ESTADOS_CON_CAMBIOS
@@ -0,0 +1,170 @@
+"""
+archivo.py - Anuncios activos (base caliente) y archivados (base fría)
+
+- `anuncios.ultimo_visto` es la última fecha en que el anuncio apareció en una
+  búsqueda (ver CorridaMarketplace.descubrir_ordenamiento y marcar_vistos).
+- `archivar_inactivos` mueve los anuncios no vistos en ARCHIVO_DIAS días a
+  archivo.db (una base adjunta con la misma tabla). Al salir de `anuncios`
+  dejan de contar en los precios de referencia, la asignación de años, los
+  resúmenes y el dashboard, que así reflejan el mercado actual.
+- `con_archivo()` adjunta el archivo y expone la vista temporal
+  `anuncios_historicos` (activos + archivados) para consultas sobre todo el historial.
+- `mantenimiento_programado()` archiva, corre ANALYZE y VACUUM cuando les toca
+  según las fechas guardadas en la tabla `meta`.
+
+Uso:
+    python archivo.py [--dias N] [--forzar]
+"""
+
+import os
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional
+
+import utils_analisis
+from cuantiles import consolidar_sketches
+
+ARCHIVO_DIAS = int(os.environ.get("ARCHIVO_DIAS", "90"))  # días sin ver un anuncio antes de archivarlo
+# Cada cuántos días corre cada tarea de mantenimiento
+INTERVALOS_MANTENIMIENTO = {"archivar": 1, "analyze": 1, "vacuum": 7}
+
+def ruta_archivo(db_path: Optional[str] = None) -> str:
+    """Por defecto archivo.db vive junto a la base (ARCHIVO_DB la reemplaza)"""
+    if os.environ.get("ARCHIVO_DB"):
+        return os.path.abspath(os.environ["ARCHIVO_DB"])
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or utils_analisis.DB_PATH)), "archivo.db")
+
+def _adjuntar(conn: sqlite3.Connection, archivo_path: str):
+    conn.execute("ATTACH DATABASE ? AS archivo", (archivo_path,))
+
+def _preparar_tabla_archivo(conn: sqlite3.Connection) -> List[str]:
+    """Crea archivo.anuncios con las columnas de anuncios y agrega las que falten"""
+    columnas = conn.execute("PRAGMA main.table_info(anuncios)").fetchall()
+    conn.execute("CREATE TABLE IF NOT EXISTS archivo.anuncios (link TEXT PRIMARY KEY)")
+    existentes = {c[1] for c in conn.execute("PRAGMA archivo.table_info(anuncios)")}
+    for _, nombre, tipo, *_ in columnas:
+        if nombre not in existentes:
+            conn.execute(f'ALTER TABLE archivo.anuncios ADD COLUMN "{nombre}" {tipo}')
+    if "archivado_at" not in existentes:
+        conn.execute("ALTER TABLE archivo.anuncios ADD COLUMN archivado_at TEXT")
+    return [c[1] for c in columnas]
+
+def archivar_inactivos(
+    dias: Optional[int] = None,
+    db_path: Optional[str] = None,
+    archivo_path: Optional[str] = None
+) -> int:
+    """
+    Mueve a archivo.db los anuncios no vistos (ni scrapeados) en `dias` días,
+    en una sola transacción. Retorna cuántos se archivaron.
+    """
+    dias = ARCHIVO_DIAS if dias is None else dias
+    db_path = db_path or utils_analisis.DB_PATH
+    archivo_path = archivo_path or ruta_archivo(db_path)
+    limite = (date.today() - timedelta(days=dias)).isoformat()
+    # Anuncios guardados antes de existir ultimo_visto: cuenta la fecha del último scrape
+    condicion = "COALESCE(ultimo_visto, fecha_scrape) < ?"
+
+    conn = sqlite3.connect(db_path)
+    try:
+        _adjuntar(conn, archivo_path)
+        columnas = ", ".join(f'"{c}"' for c in _preparar_tabla_archivo(conn))
+        with conn:
+            conn.execute(f"""
+                INSERT OR REPLACE INTO archivo.anuncios ({columnas}, archivado_at)
+                SELECT {columnas}, DATE('now') FROM main.anuncios WHERE {condicion}
+            """, (limite,))
+            # El DELETE dispara los triggers de resúmenes y de sincronización
+            archivados = conn.execute(f"DELETE FROM main.anuncios WHERE {condicion}", (limite,)).rowcount
+        if archivados:
+            # Cada baja dejó un pendiente; sin esto, cada lectura los aplicaría de nuevo
+            consolidar_sketches(conn)
+    finally:
+        conn.close()
+
+    if archivados:
+        print(f"🧊 {archivados} anuncios sin ver desde {limite} movidos a {archivo_path}")
+    return archivados
+
+@contextmanager
+def con_archivo(db_path: Optional[str] = None, archivo_path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """Conexión con el archivo adjunto y la vista temporal `anuncios_historicos`"""
+    db_path = db_path or utils_analisis.DB_PATH
+    archivo_path = archivo_path or ruta_archivo(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        if os.path.exists(archivo_path):
+            _adjuntar(conn, archivo_path)
+            columnas = ", ".join(f'"{c}"' for c in _preparar_tabla_archivo(conn))
+            conn.execute(f"""
+                CREATE TEMP VIEW anuncios_historicos AS
+                SELECT {columnas} FROM main.anuncios
+                UNION ALL
+                SELECT {columnas} FROM archivo.anuncios
+                WHERE link NOT IN (SELECT link FROM main.anuncios)
+            """)
+        else:
+            conn.execute("CREATE TEMP VIEW anuncios_historicos AS SELECT * FROM main.anuncios")
+        yield conn
+    finally:
+        conn.close()
+
+def _toca(conn: sqlite3.Connection, tarea: str, hoy: date) -> bool:
+    fila = conn.execute("SELECT valor FROM meta WHERE clave = ?", (f"mantenimiento_{tarea}",)).fetchone()
+    return not fila or date.fromisoformat(fila[0]) + timedelta(days=INTERVALOS_MANTENIMIENTO[tarea]) <= hoy
+
+def _registrar(conn: sqlite3.Connection, tarea: str, hoy: date):
+    conn.execute(
+        "INSERT INTO meta (clave, valor) VALUES (?, ?) ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+        (f"mantenimiento_{tarea}", hoy.isoformat())
+    )
+    conn.commit()
+
+def mantenimiento_programado(
+    db_path: Optional[str] = None,
+    forzar: bool = False,
+    dias: Optional[int] = None
+) -> Dict[str, bool]:
+    """
+    Archiva, analiza y compacta la base si pasó su intervalo (ver
+    INTERVALOS_MANTENIMIENTO). Retorna qué tareas corrieron.
+    """
+    db_path = db_path or utils_analisis.DB_PATH
+    hoy = date.today()
+    hechas = {tarea: False for tarea in INTERVALOS_MANTENIMIENTO}
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+
+        if forzar or _toca(conn, "archivar", hoy):
+            archivar_inactivos(dias, db_path=db_path)
+            _registrar(conn, "archivar", hoy)
+            hechas["archivar"] = True
+
+        if forzar or _toca(conn, "analyze", hoy):
+            conn.execute("ANALYZE")
+            _registrar(conn, "analyze", hoy)
+            hechas["analyze"] = True
+
+        if forzar or _toca(conn, "vacuum", hoy):
+            conn.execute("VACUUM")
+            _registrar(conn, "vacuum", hoy)
+            hechas["vacuum"] = True
+    finally:
+        conn.close()
+
+    corridas = [t for t, hecha in hechas.items() if hecha]
+    if corridas:
+        print(f"🧹 Mantenimiento de la base: {', '.join(corridas)}")
+    return hechas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiva anuncios inactivos y mantiene la base")
+    parser.add_argument("--db", help="Ruta de la base (por defecto la del sistema)")
+    parser.add_argument("--dias", type=int, help=f"Días sin ver un anuncio para archivarlo (por defecto {ARCHIVO_DIAS})")
+    parser.add_argument("--forzar", action="store_true", help="Correr todas las tareas aunque no les toque")
+    args = parser.parse_args()
+    mantenimiento_programado(args.db, args.forzar, args.dias)
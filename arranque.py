@@ -0,0 +1,101 @@
+"""
+arranque.py - Inicialización perezosa y medición del tiempo de arranque
+
+- `perezoso(nombre)`: decora una función constructora para que el artefacto
+  (regex gigantes, detectores, etc.) se construya en el primer uso y quede
+  registrado cuánto tardó.
+- Ejecutado como script, reporta el tiempo de importación de cada punto de
+  entrada usando `python -X importtime`.
+"""
+
+import os
+import re
+import sys
+import time
+import functools
+import subprocess
+from typing import Callable, Dict, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Nombre del artefacto → segundos que tomó construirlo
+_tiempos_inicializacion: Dict[str, float] = {}
+
+# Punto de entrada → módulos que importa al arrancar
+PUNTOS_ENTRADA = {
+    "bot": "bot_telegram_marketplace",
+    "scraper": "scraper_marketplace",
+    "analisis": "utils_analisis",
+    "dashboard": "streamlit, pandas",
+}
+
+# Valores ficticios para poder importar el bot sin credenciales reales
+ENTORNO_MEDICION = {"BOT_TOKEN": "0:medicion", "CHAT_ID": "0"}
+
+_PATRON_IMPORTTIME = re.compile(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+def perezoso(nombre: str) -> Callable[[Callable[[], T]], Callable[[], T]]:
+    """Construye el artefacto en el primer acceso, lo memoriza y mide su costo"""
+    def decorador(constructor: Callable[[], T]) -> Callable[[], T]:
+        @functools.lru_cache(maxsize=None)
+        @functools.wraps(constructor)
+        def accesor() -> T:
+            inicio = time.perf_counter()
+            artefacto = constructor()
+            _tiempos_inicializacion[nombre] = time.perf_counter() - inicio
+            return artefacto
+        return accesor
+    return decorador
+
+def registrar_tiempo(nombre: str, segundos: float):
+    """Registra el costo de una inicialización que no usa @perezoso"""
+    _tiempos_inicializacion[nombre] = segundos
+
+def tiempos_inicializacion() -> Dict[str, float]:
+    """Artefactos construidos hasta ahora y sus tiempos en segundos"""
+    return dict(_tiempos_inicializacion)
+
+def medir_importacion(modulos: str) -> Tuple[float, List[Tuple[float, str]]]:
+    """
+    Importa los módulos en un proceso limpio con -X importtime.
+    Retorna (segundos totales, [(segundos propios, módulo)] de mayor a menor).
+    """
+    entorno = {**ENTORNO_MEDICION, **os.environ}
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulos}"],
+        capture_output=True, text=True, env=entorno,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if proceso.returncode != 0:
+        ultima_linea = proceso.stderr.strip().splitlines()[-1:] or ["error desconocido"]
+        raise RuntimeError(ultima_linea[0])
+
+    total = 0.0
+    por_modulo = []
+    for linea in proceso.stderr.splitlines():
+        m = _PATRON_IMPORTTIME.match(linea)
+        if not m:
+            continue
+        por_modulo.append((int(m.group(1)) / 1e6, m.group(4)))
+        if len(m.group(3)) <= 1:  # Módulo de primer nivel: su acumulado cuenta en el total
+            total += int(m.group(2)) / 1e6
+
+    return total, sorted(por_modulo, reverse=True)
+
+def reporte_arranque(top: int = 8):
+    """Imprime el tiempo de importación de cada punto de entrada"""
+    print("⏱️ TIEMPO DE ARRANQUE POR PUNTO DE ENTRADA")
+    print("=" * 50)
+    for nombre, modulos in PUNTOS_ENTRADA.items():
+        try:
+            total, detalle = medir_importacion(modulos)
+        except RuntimeError as e:
+            print(f"\n❌ {nombre}: no se pudo importar ({e})")
+            continue
+
+        print(f"\n🚀 {nombre} ({modulos}): {total * 1000:.1f} ms")
+        for segundos, modulo in detalle[:top]:
+            print(f"   {segundos * 1000:8.1f} ms  {modulo}")
+
+if __name__ == "__main__":
+    reporte_arranque()
@@ -6,16 +6,12 @@ import sqlite3
 import logging
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from telegram import Bot
 from typing import Tuple
-from scraper_marketplace import buscar_autos_marketplace
-from telegram.helpers import escape_markdown
 from utils_analisis import (
-    inicializar_tabla_anuncios, analizar_mensaje, limpiar_link, es_extranjero,
-    SCORE_MIN_DB, SCORE_MIN_TELEGRAM, ROI_MINIMO,
-    modelos_bajo_rendimiento, MODELOS_INTERES, escapar_multilinea,
-    validar_precio_coherente, existe_en_db, obtener_anuncio_db, anuncio_diferente
+    inicializar_tabla_anuncios, SCORE_MIN_DB, ROI_MINIMO,
+    modelos_bajo_rendimiento, limpiar_cache_rendimiento, MODELOS_INTERES, escapar_multilinea
 )
+from historial_precios import ahora_sql, bajadas_precio
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,142 +19,139 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S"
 )
 logger = logging.getLogger(__name__)
-inicializar_tabla_anuncios()
 
 BOT_TOKEN = os.environ["BOT_TOKEN"].strip()
 CHAT_ID = int(os.environ["CHAT_ID"].strip())
 DB_PATH = os.environ.get("DB_PATH", "upload-artifact/anuncios.db")
+# Porcentaje mínimo de bajada de precio para avisar (ver historial_precios.py)
+BAJADA_MINIMA_ALERTA = float(os.environ.get("BAJADA_MINIMA_ALERTA", "5"))
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-bot = Bot(token=BOT_TOKEN)
+
+_bot = None
+_envio = None
+
+def get_bot():
+    """Crea el cliente de Telegram en el primer envío"""
+    global _bot
+    if _bot is None:
+        from telegram import Bot
+        from envio_telegram import TELEGRAM_API_URL
+        if TELEGRAM_API_URL:
+            _bot = Bot(token=BOT_TOKEN, base_url=TELEGRAM_API_URL)
+        else:
+            _bot = Bot(token=BOT_TOKEN)
+    return _bot
+
+def get_envio():
+    """Cola de envío con límites de tasa de Telegram (ver envio_telegram.py)"""
+    global _envio
+    if _envio is None:
+        from envio_telegram import EnvioTelegram
+        _envio = EnvioTelegram(get_bot)
+    return _envio
 
 async def safe_send(text: str, parse_mode="MarkdownV2"):
-    for _ in range(3):
-        try:
-            return await bot.send_message(
-                chat_id=CHAT_ID,
-                text=escapar_multilinea(text),
-                parse_mode=parse_mode,
-                disable_web_page_preview=True
-            )
-        except Exception as e:
-            logger.warning(f"Error enviando a Telegram (reintento): {e}")
-            await asyncio.sleep(1)
+    """Envía y espera la entrega; retorna None si Telegram no lo aceptó"""
+    return await get_envio().enviar(CHAT_ID, escapar_multilinea(text), parse_mode)
+
+def encolar_envio(text: str, parse_mode="MarkdownV2"):
+    """Como safe_send, pero sin esperar: el mensaje sale cuando el límite lo permita"""
+    get_envio().encolar(CHAT_ID, escapar_multilinea(text), parse_mode)
 
 def dividir_y_enviar(titulo: str, items: list[str]) -> list[str]:
-    if not items:
-        return []
-    texto = titulo + "\n\n" + "\n\n".join(items)
-    bloques = [texto[i:i+3000] for i in range(0, len(texto), 3000)]
-    return bloques
+    """Agrupa anuncios completos en mensajes que respetan el límite de 4096 caracteres"""
+    from envio_telegram import empaquetar_mensajes
+    return empaquetar_mensajes(titulo, items)
 
 async def enviar_ofertas():
     logger.info("📡 Iniciando bot de Telegram")
     now_local = datetime.now(ZoneInfo("America/Guatemala"))
+    inicializar_tabla_anuncios()
+    with sqlite3.connect(DB_PATH) as conn:
+        inicio_corrida = ahora_sql(conn)
 
+    # Rendimiento calculado una vez por corrida; el scraper reutiliza este
+    limpiar_cache_rendimiento()
     bajos = modelos_bajo_rendimiento()
     activos = [m for m in MODELOS_INTERES if m not in bajos]
     logger.info(f"✅ Modelos activos: {activos}")
 
+    # Las ofertas relevantes nuevas o con cambios se envían apenas el scraper
+    # las guarda, sin esperar a que termine la corrida completa
+    enviados_en_vivo = set()
+
+    async def enviar_en_vivo(resultado):
+        anuncio = resultado.anuncio
+        if not anuncio.relevante or not resultado.con_cambios:
+            return
+        # Se encola sin esperar, para no frenar el pipeline del scraper
+        encolar_envio(f"⚡ *Nueva oferta:*\n\n{anuncio.mensaje_telegram}")
+        enviados_en_vivo.add(anuncio.link)
+
+    # Descartes del análisis del scraper (extranjeros, negativos, precio-año
+    # incoherente, ...): esos anuncios no llegan a `resultados`
+    motivos = {}
+
     try:
-        brutos, pendientes, _ = await buscar_autos_marketplace(modelos_override=activos)
+        # El stack de scraping (Playwright) solo se importa cuando se va a usar
+        from scraper_marketplace import buscar_autos_marketplace, es_potencial, SesionInvalida
+        resultados = await buscar_autos_marketplace(
+            modelos_override=activos, al_notificar=enviar_en_vivo, descartados=motivos
+        )
+    except SesionInvalida as e:
+        await safe_send(str(e))
+        return
     except Exception as e:
         logger.error(f"❌ Error en scraper: {e}")
         await safe_send("❌ Error ejecutando scraper, revisa logs.")
         return
 
-    buenos, potenciales = [], []
+    buenos, potenciales, pendientes = [], [], []
     resumen_relevantes, resumen_potenciales = [], []
-    motivos = {
-        "incompleto": 0,
-        "extranjero": 0,
-        "modelo no detectado": 0,
-        "año fuera de rango": 0,
-        "precio fuera de rango": 0,
-        "precio-año incoherente": 0,
-        "roi bajo": 0
-    }
-
-    for texto in brutos:
-        res = analizar_mensaje(texto)
-        if not res:
-            motivos["incompleto"] += 1
-            continue
-
-        logger.info(f"\n📝 TEXTO CRUDO:\n{texto[:500]}")
-
-        url, modelo, anio, precio, roi, score, relevante = (
-            res["url"], res["modelo"], res["año"], res["precio"],
-            res["roi"], res["score"], res["relevante"]
-        )
+    # Analizados pero no relevantes
+    motivos.update({"roi bajo": 0, "score bajo": 0})
 
-        logger.info(f"📅 Año detectado: {anio}")
-        logger.info(f"💰 Precio detectado: Q{precio:,}")
+    for resultado in resultados:
+        anuncio = resultado.anuncio
+        modelo, url, roi, score = anuncio.modelo, anuncio.link, anuncio.roi, anuncio.score
 
-        if not validar_precio_coherente(precio, modelo, anio):
-            motivos["precio-año incoherente"] += 1
-            continue
+        if es_potencial(anuncio):
+            pendientes.append(anuncio.mensaje_telegram)
 
-        mensaje = (
-            f"🚘 *{modelo.title()}*\n"
-            f"• Año: {anio}\n"
-            f"• Precio: Q{precio:,}\n"
-            f"• ROI: {roi:.1f}%\n"
-            f"• Score: {score}/10\n"
-            f"🔗 {url}"
-        )
-
-        motivo = None
-        if not relevante:
-            if es_extranjero(texto):
-                motivo = "extranjero"
-            elif roi < ROI_MINIMO:
-                motivo = "roi bajo"
+        if not anuncio.relevante:
+            if roi < ROI_MINIMO:
+                motivos["roi bajo"] += 1
             elif score < SCORE_MIN_DB:
-                motivo = "score bajo"
-            else:
-                motivo = "modelo no detectado"
-            motivos[motivo] += 1
-
-        # Verificar si el anuncio ya fue enviado sin cambios
-        enviar = False
-        if not existe_en_db(url):
-            enviar = True
-        else:
-            previo = obtener_anuncio_db(url)
-            nuevo = {
-                "modelo": modelo,
-                "anio": anio,
-                "precio": precio,
-                "km": "",
-                "roi": roi,
-                "score": score
-            }
-            if anuncio_diferente(nuevo, previo):
-                enviar = True
-
-        if enviar or (relevante and anuncio_diferente(nuevo, previo)):
-            if relevante:
-                buenos.append(mensaje)
-                resumen_relevantes.append((modelo, url, roi, score))
-            elif score >= SCORE_MIN_DB and roi >= ROI_MINIMO:
-                potenciales.append(mensaje)
-                resumen_potenciales.append((modelo, url, roi, score))
-        else:
+                motivos["score bajo"] += 1
+
+        if not resultado.con_cambios:
             logger.info(f"⏩ No enviado: {modelo.title()} ({url}) — sin cambios respecto al anterior")
+        elif anuncio.relevante:
+            resumen_relevantes.append((modelo, url, roi, score))
+            if url not in enviados_en_vivo:
+                buenos.append(anuncio.mensaje_telegram)
+        elif score >= SCORE_MIN_DB and roi >= ROI_MINIMO:
+            potenciales.append(anuncio.mensaje_telegram)
+            resumen_potenciales.append((modelo, url, roi, score))
 
         logger.info(
-            f"🔍 {modelo} | Año {anio} | Precio Q{precio:,} | ROI {roi:.1f}% | Score {score}/10 | Relevante: {relevante}"
+            f"🔍 {modelo} | Año {anuncio.anio} ({anuncio.fuente_anio or 'desconocida'}) | Precio Q{anuncio.precio:,} "
+            f"| ROI {roi:.1f}% | Score {score}/10 | Relevante: {anuncio.relevante} | {resultado.estado}"
         )
 
-    total = len(brutos)
-    await safe_send(f"📊 Procesados: {total} | Relevantes: {len(buenos)} | Potenciales: {len(potenciales)}")
+    total = len(resultados)
+    await safe_send(
+        f"📊 Procesados: {total} | Relevantes: {len(resumen_relevantes)} | Potenciales: {len(potenciales)}"
+    )
 
     desc_total = sum(motivos.values())
     if desc_total:
         detalles = "\n".join(f"• {k}: {v}" for k, v in motivos.items() if v)
         await safe_send(f"📉 Descartados:\n{detalles}")
 
-    if not buenos and not potenciales:
+    await enviar_bajadas(inicio_corrida)
+
+    if not resumen_relevantes and not potenciales:
         if now_local.hour == 18:
             await safe_send(f"📡 Ejecución a las {now_local.strftime('%H:%M')}, sin ofertas.")
         return
@@ -179,7 +172,7 @@ async def enviar_ofertas():
         await safe_send(f"📦 Total acumulado en base: {total_db} anuncios")
 
     logger.info("\n📋 Resumen final del scraping (para revisión manual):")
-    logger.info(f"Guardados totales: {len(buenos) + len(potenciales)}")
+    logger.info(f"Guardados totales: {len(resumen_relevantes) + len(resumen_potenciales)}")
     logger.info(f"Relevantes: {len(resumen_relevantes)}")
     logger.info(f"Potenciales: {len(resumen_potenciales)}")
 
@@ -191,5 +184,43 @@ async def enviar_ofertas():
     for modelo, url, roi, score in resumen_potenciales:
         logger.info(f"• {modelo.title()} | ROI: {roi:.1f}% | Score: {score}/10 → {url}")
 
+async def enviar_bajadas(desde: str):
+    """Avisa de los anuncios que bajaron de precio durante la corrida"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        bajadas = bajadas_precio(conn, desde, porcentaje_minimo=BAJADA_MINIMA_ALERTA)
+    finally:
+        conn.close()
+    if not bajadas:
+        return
+
+    items = [
+        f"🚘 *{b['modelo'].title()} {b['anio']}*: Q{b['precio_anterior']:,} → Q{b['precio']:,} "
+        f"(-{b['porcentaje']}%)\n🔗 {b['link']}"
+        for b in bajadas
+    ]
+    logger.info(f"📉 {len(bajadas)} anuncios bajaron de precio en esta corrida")
+    for bloque in dividir_y_enviar("📉 *Bajadas de precio:*", items):
+        await safe_send(bloque)
+
+async def mantenimiento_final():
+    """Archiva anuncios inactivos y corre ANALYZE/VACUUM cuando les toca (ver archivo.py)"""
+    from archivo import mantenimiento_programado
+    from ejecutores import en_db
+    try:
+        await en_db(mantenimiento_programado, DB_PATH)
+    except Exception as e:
+        logger.error(f"❌ Error en mantenimiento de la base: {e}")
+
+async def main():
+    try:
+        await enviar_ofertas()
+        await mantenimiento_final()
+    finally:
+        if _envio is not None:
+            await _envio.cerrar()
+        from ejecutores import cerrar_ejecutores
+        cerrar_ejecutores()
+
 if __name__ == "__main__":
-    asyncio.run(enviar_ofertas())
+    asyncio.run(main())
@@ -8,8 +8,13 @@ manteniendo compatibilidad total pero añadiendo inteligencia de patrones.
 import json
 import os
 import re
-from typing import Optional, Dict, List
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any, Hashable, Tuple
 from datetime import datetime
+from arranque import registrar_tiempo
 
 # Importar el detector inteligente
 try:
@@ -20,15 +25,106 @@ except ImportError:
     print("⚠️ Detector inteligente no disponible, usando sistema básico")
 
 CORRECCIONES_FILE = "correcciones.json"
+MAX_CACHE_CORRECCIONES = 4096
 
-# Instancia global del detector inteligente
+# Instancia global del detector inteligente (se crea en el primer uso)
 _detector_global = None
 
+# Versión de las correcciones: cambia cada vez que se agrega o limpia una corrección
+_version_correcciones = 0
+# (versión, hash de correcciones.json) de la última huella calculada
+_huella_correcciones: Optional[Tuple[int, str]] = None
+
+SIN_VALOR = object()
+
+class CacheLRU:
+    """
+    Caché LRU acotada con contadores de aciertos y fallos. Es segura entre
+    hilos: el scraper analiza anuncios en un pool de hilos (ver ejecutores.py).
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._datos: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave: Hashable) -> Any:
+        """Retorna el valor guardado o SIN_VALOR si la clave no está en caché"""
+        with self._lock:
+            try:
+                valor = self._datos[clave]
+            except KeyError:
+                self.fallos += 1
+                return SIN_VALOR
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave: Hashable, valor: Any) -> None:
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            if len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tamaño": len(self._datos),
+            "max_items": self.max_items,
+            "tasa_aciertos": round(self.aciertos / consultas * 100, 1) if consultas else 0.0
+        }
+
+_cache_correcciones = CacheLRU(MAX_CACHE_CORRECCIONES)
+
+def hash_texto(texto: str) -> str:
+    """Hash corto y estable de un texto, usado como clave de caché"""
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=16).hexdigest()
+
+def version_correcciones() -> int:
+    """Versión actual de las correcciones, para invalidar cachés que dependen de ellas"""
+    return _version_correcciones
+
+def huella_correcciones() -> str:
+    """
+    Hash del contenido de correcciones.json. A diferencia de la versión, no
+    vuelve a cero en cada proceso: sirve para cachés que persisten entre corridas.
+    """
+    global _huella_correcciones
+    if _huella_correcciones is None or _huella_correcciones[0] != _version_correcciones:
+        try:
+            with open(CORRECCIONES_FILE, "rb") as f:
+                contenido = f.read()
+        except OSError:
+            contenido = b""
+        _huella_correcciones = (_version_correcciones, hashlib.blake2b(contenido, digest_size=8).hexdigest())
+    return _huella_correcciones[1]
+
+def _invalidar_cache_correcciones():
+    """Invalida las búsquedas memorizadas tras modificar las correcciones"""
+    global _version_correcciones
+    _version_correcciones += 1
+    _cache_correcciones.limpiar()
+
+def estadisticas_cache_correcciones() -> Dict[str, Any]:
+    """Aciertos/fallos de la caché de búsquedas de correcciones"""
+    return {**_cache_correcciones.estadisticas(), "version": _version_correcciones}
+
 def _get_detector():
     """Obtiene instancia del detector inteligente (singleton)"""
     global _detector_global
     if _detector_global is None and DETECTOR_DISPONIBLE:
-        _detector_global = DetectorAñoInteligente(CORRECCIONES_FILE)
+        inicio = time.perf_counter()
+        _detector_global = DetectorAñoInteligente(CORRECCIONES_FILE, verbose=False)
+        registrar_tiempo("detector_correcciones", time.perf_counter() - inicio)
     return _detector_global
 
 def cargar_correcciones():
@@ -79,6 +175,8 @@ def guardar_correccion(texto: str, año: int):
         except Exception as e:
             print(f"❌ Error al guardar corrección: {e}")
 
+    _invalidar_cache_correcciones()
+
 def obtener_correccion(texto: str, debug: bool = False) -> Optional[int]:
     """
     🚀 FUNCIÓN PRINCIPAL: Busca corrección usando sistema inteligente
@@ -87,6 +185,9 @@ def obtener_correccion(texto: str, debug: bool = False) -> Optional[int]:
     1. Coincidencias exactas
     2. Patrones aprendidos automáticamente  
     3. Búsqueda parcial mejorada
+
+    Los resultados se memorizan en una caché LRU por hash del texto normalizado
+    y versión de las correcciones (se omite en modo debug).
     
     Args:
         texto: Texto a analizar
@@ -95,27 +196,46 @@ def obtener_correccion(texto: str, debug: bool = False) -> Optional[int]:
     Returns:
         Año detectado o None si no se encuentra
     """
+    return obtener_correccion_con_fuente(texto, debug)[0]
+
+def obtener_correccion_con_fuente(texto: str, debug: bool = False) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Como obtener_correccion, pero retorna (año, fuente) donde fuente es
+    "exacta", "patron" o "parcial" según cómo se encontró la corrección.
+    """
+    if debug:
+        return _obtener_correccion_sin_cache(texto, debug)
+
+    clave = (_version_correcciones, hash_texto(normalizar_texto_correccion(texto)))
+    resultado = _cache_correcciones.obtener(clave)
+    if resultado is SIN_VALOR:
+        resultado = _obtener_correccion_sin_cache(texto)
+        _cache_correcciones.guardar(clave, resultado)
+    return resultado
+
+def _obtener_correccion_sin_cache(texto: str, debug: bool = False) -> Tuple[Optional[int], Optional[str]]:
+    """Búsqueda de corrección sin memorizar"""
     detector = _get_detector()
     
     if detector:
         # 🧠 USAR SISTEMA INTELIGENTE
-        resultado = detector.detectar_año_inteligente(texto, debug)
+        resultado, fuente = detector.detectar_año_con_fuente(texto, debug)
         
         if debug and resultado:
             print(f"🎯 Sistema inteligente detectó: {resultado}")
         
-        return resultado
+        return resultado, fuente
     else:
         # 📋 FALLBACK: Sistema original básico
         return _obtener_correccion_basico(texto, debug)
 
-def _obtener_correccion_basico(texto: str, debug: bool = False) -> Optional[int]:
+def _obtener_correccion_basico(texto: str, debug: bool = False) -> Tuple[Optional[int], Optional[str]]:
     """
     Sistema básico original como fallback
     """
     correcciones = cargar_correcciones()
     if not correcciones:
-        return None
+        return None, None
     
     texto_normalizado = normalizar_texto_correccion(texto)
     
@@ -123,7 +243,7 @@ def _obtener_correccion_basico(texto: str, debug: bool = False) -> Optional[int]
     if texto_normalizado in correcciones:
         if debug:
             print(f"✅ Coincidencia exacta: {correcciones[texto_normalizado]}")
-        return correcciones[texto_normalizado]
+        return correcciones[texto_normalizado], "exacta"
     
     # 2. Búsqueda parcial básica
     texto_palabras = set(texto_normalizado.split())
@@ -148,7 +268,7 @@ def _obtener_correccion_basico(texto: str, debug: bool = False) -> Optional[int]
     if debug and mejor_coincidencia:
         print(f"🔍 Búsqueda parcial encontró: {mejor_coincidencia} (score: {mejor_score:.2f})")
     
-    return mejor_coincidencia
+    return mejor_coincidencia, ("parcial" if mejor_coincidencia else None)
 
 def listar_correcciones() -> Dict[str, int]:
     """
@@ -257,6 +377,7 @@ def limpiar_correcciones_duplicadas():
     try:
         with open(CORRECCIONES_FILE, "w", encoding="utf-8") as f:
             json.dump(correcciones_limpias, f, indent=2, ensure_ascii=False)
+        _invalidar_cache_correcciones()
         
         print(f"🧹 Limpieza completada:")
         print(f"  - Antes: {original_count} correcciones")
@@ -0,0 +1,366 @@
+"""
+cuantiles.py - Sketches de cuantiles de precio por (modelo, año)
+
+Cada (modelo, año) guarda en `sketch_precios` un resumen acotado de sus
+precios al estilo t-digest: centroides (precio, peso) ordenados. Con él se
+responden la mediana, Q1/Q3 y los límites IQR sin leer los precios.
+
+- Mientras haya hasta LIMITE_CENTROIDES precios distintos el sketch es exacto:
+  cada centroide es un precio con su cantidad de repeticiones, y la mediana,
+  los cuartiles (statistics.quantiles, método 'exclusive') y el filtro de
+  filtrar_outliers dan lo mismo que sobre la lista completa. Al pasar el
+  límite se comprime (centroides más pesados en el centro que en las colas)
+  y pasa a ser aproximado.
+- Los sketches se fusionan: la ventana de TOLERANCIA_PRECIO_REF años es la
+  fusión de los sketches de cada año.
+- Triggers sobre `anuncios` anotan cada alta, baja y cambio de precio en
+  `sketch_pendientes`. Las lecturas aplican en memoria los pendientes de sus
+  claves, sin escribir; `consolidar_sketches` los integra a la tabla. Lo llaman
+  los que escriben: al inicializar la base, al final de cada corrida del
+  scraper, al archivar y al re-analizar.
+  Quitar un precio de un sketch ya comprimido no es posible: esa clave se
+  reconstruye desde `anuncios`.
+
+Uso:
+    python cuantiles.py [--db RUTA]    # reconstruye todos los sketches
+"""
+
+import json
+import math
+import sqlite3
+import argparse
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# Compresión del t-digest: más alto, más centroides y más precisión
+COMPRESION = 200
+# Hasta este número de centroides no se comprime (y el sketch sigue exacto)
+LIMITE_CENTROIDES = 2 * COMPRESION
+FACTOR_IQR = 2.0  # el mismo de filtrar_outliers
+
+Clave = Tuple[str, int]
+
+class SketchPrecios:
+    """Centroides [precio, peso] ordenados por precio; exacto mientras no se comprima"""
+    __slots__ = ("centroides", "exacto", "minimo", "maximo", "n")
+
+    def __init__(self, centroides: Optional[List[List[float]]] = None, exacto: bool = True,
+                 minimo: Optional[float] = None, maximo: Optional[float] = None):
+        self.centroides = centroides or []
+        self.exacto = exacto
+        # Exacto, los extremos son el primer y el último centroide; comprimido, se guardan aparte
+        if exacto or minimo is None:
+            minimo = self.centroides[0][0] if self.centroides else None
+        if exacto or maximo is None:
+            maximo = self.centroides[-1][0] if self.centroides else None
+        self.minimo, self.maximo = minimo, maximo
+        self.n = int(sum(peso for _, peso in self.centroides))
+
+    def agregar(self, precio: int, peso: int = 1):
+        medias = [c[0] for c in self.centroides]
+        i = bisect_left(medias, precio)
+        if i < len(medias) and medias[i] == precio:
+            self.centroides[i][1] += peso
+        else:
+            self.centroides.insert(i, [precio, peso])
+        self.n += peso
+        self.minimo = precio if self.minimo is None else min(self.minimo, precio)
+        self.maximo = precio if self.maximo is None else max(self.maximo, precio)
+        if len(self.centroides) > LIMITE_CENTROIDES:
+            self.comprimir()
+
+    def quitar(self, precio: int) -> bool:
+        """Quita un precio; False si el sketch está comprimido y no se puede"""
+        if not self.exacto:
+            return False
+        medias = [c[0] for c in self.centroides]
+        i = bisect_left(medias, precio)
+        if i == len(medias) or medias[i] != precio:
+            return False
+        self.centroides[i][1] -= 1
+        self.n -= 1
+        if self.centroides[i][1] <= 0:
+            del self.centroides[i]
+        self.minimo = self.centroides[0][0] if self.centroides else None
+        self.maximo = self.centroides[-1][0] if self.centroides else None
+        return True
+
+    def fusionar(self, otro: "SketchPrecios", comprimir: bool = True) -> "SketchPrecios":
+        """Sketch con los precios de ambos (sin modificar ninguno de los dos)"""
+        return fusionar_sketches([self, otro], comprimir)
+
+    def comprimir(self):
+        """
+        Fusiona centroides vecinos mientras el peso quede bajo 2π·n·√(q·(1-q))/COMPRESION
+        (escala arcoseno del t-digest, unos COMPRESION/2 centroides): en las colas
+        (q cerca de 0 o 1) los centroides quedan chicos y precisos.
+        """
+        total = self.n
+        resultado: List[List[float]] = []
+        antes = 0.0  # peso acumulado antes del último centroide de `resultado`
+        for media, peso in self.centroides:
+            if resultado:
+                media_prev, peso_prev = resultado[-1]
+                q = (antes + (peso_prev + peso) / 2) / total
+                if peso_prev + peso <= max(1.0, 2 * math.pi * total * math.sqrt(q * (1 - q)) / COMPRESION):
+                    resultado[-1] = [(media_prev * peso_prev + media * peso) / (peso_prev + peso), peso_prev + peso]
+                    self.exacto = False
+                    continue
+                antes += peso_prev
+            resultado.append([media, peso])
+        self.centroides = resultado
+
+    def _valor(self, i: int) -> float:
+        """El i-ésimo precio (base 0) en orden; interpolado entre centroides si es aproximado"""
+        acumulado = 0.0
+        if self.exacto:
+            for media, peso in self.centroides:
+                acumulado += peso
+                if i < acumulado:
+                    return media
+            return self.centroides[-1][0]
+
+        # Cada centroide se centra en la mitad de los rangos que cubre
+        anterior = (-0.5, self.minimo)
+        for media, peso in self.centroides:
+            centro = acumulado + peso / 2 - 0.5
+            if i <= centro:
+                x0, y0 = anterior
+                return y0 + (media - y0) * (i - x0) / (centro - x0) if centro > x0 else media
+            anterior = (centro, media)
+            acumulado += peso
+        x0, y0 = anterior
+        return y0 + (self.maximo - y0) * (i - x0) / (acumulado - 0.5 - x0) if acumulado - 0.5 > x0 else self.maximo
+
+    def cuartiles(self) -> Tuple[float, float]:
+        """Q1 y Q3 como statistics.quantiles(n=4) (requiere al menos 2 precios)"""
+        n = self.n
+        resultado = []
+        for i in (1, 3):
+            j = min(max(i * (n + 1) // 4, 1), n - 1)
+            delta = i * (n + 1) - j * 4
+            resultado.append((self._valor(j - 1) * (4 - delta) + self._valor(j) * delta) / 4)
+        return resultado[0], resultado[1]
+
+    def mediana(self) -> float:
+        n = self.n
+        if n % 2:
+            return self._valor(n // 2)
+        return (self._valor(n // 2 - 1) + self._valor(n // 2)) / 2
+
+    def media(self) -> float:
+        return sum(m * p for m, p in self.centroides) / self.n
+
+    def filtrado(self) -> "SketchPrecios":
+        """Sin outliers, como filtrar_outliers: fuera de [Q1 - 2·IQR, Q3 + 2·IQR]"""
+        if self.n < 4:
+            return self
+        q1, q3 = self.cuartiles()
+        iqr = q3 - q1
+        lim_inf, lim_sup = q1 - FACTOR_IQR * iqr, q3 + FACTOR_IQR * iqr
+        dentro = [[m, p] for m, p in self.centroides if lim_inf <= m <= lim_sup]
+        filtrado = SketchPrecios(dentro, self.exacto)
+        return filtrado if filtrado.n >= 2 else self
+
+    def referencia(self, modelo: str) -> Dict:
+        """Lo mismo que referencia_desde_precios sobre los precios del sketch"""
+        from utils_analisis import MUESTRA_MINIMA_CONFIABLE, MUESTRA_MINIMA_MEDIA, PRECIOS_POR_DEFECTO
+        n = self.n
+        if n >= MUESTRA_MINIMA_CONFIABLE:
+            base, confianza = self.filtrado(), "alta"
+        elif n >= MUESTRA_MINIMA_MEDIA:
+            base, confianza = self, "media"
+        else:
+            return {"precio": PRECIOS_POR_DEFECTO.get(modelo, 50000), "confianza": "baja", "muestra": 0, "rango": "default"}
+        return {
+            "precio": int(base.mediana()), "confianza": confianza, "muestra": base.n,
+            "rango": f"{int(base.minimo)}-{int(base.maximo)}"
+        }
+
+    def a_json(self) -> str:
+        return json.dumps(self.centroides)
+
+def fusionar_sketches(sketches: List[SketchPrecios], comprimir: bool = True) -> SketchPrecios:
+    """Un solo sketch con los precios de todos, en una pasada"""
+    combinados: Dict[float, float] = {}
+    for sketch in sketches:
+        for media, peso in sketch.centroides:
+            combinados[media] = combinados.get(media, 0) + peso
+    minimos = [s.minimo for s in sketches if s.minimo is not None]
+    maximos = [s.maximo for s in sketches if s.maximo is not None]
+    resultado = SketchPrecios(
+        [[m, p] for m, p in sorted(combinados.items())], all(s.exacto for s in sketches),
+        min(minimos) if minimos else None, max(maximos) if maximos else None
+    )
+    if comprimir and len(resultado.centroides) > LIMITE_CENTROIDES:
+        resultado.comprimir()
+    return resultado
+
+def crear_sketches(conn: sqlite3.Connection):
+    """Tablas y triggers de los sketches; la primera vez los construye desde `anuncios`"""
+    existia = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sketch_precios'"
+    ).fetchone() is not None
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sketch_precios (
+            modelo TEXT NOT NULL,
+            anio INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            exacto INTEGER NOT NULL,
+            minimo REAL,
+            maximo REAL,
+            centroides TEXT NOT NULL,
+            PRIMARY KEY (modelo, anio)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sketch_pendientes (
+            id INTEGER PRIMARY KEY,
+            modelo TEXT NOT NULL,
+            anio INTEGER NOT NULL,
+            precio INTEGER NOT NULL,
+            signo INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sketch_pendientes ON sketch_pendientes(modelo, anio)")
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_sketch_insert AFTER INSERT ON anuncios
+        WHEN NEW.precio > 0 AND NEW.anio IS NOT NULL AND NEW.modelo IS NOT NULL
+        BEGIN
+            INSERT INTO sketch_pendientes (modelo, anio, precio, signo) VALUES (NEW.modelo, NEW.anio, NEW.precio, 1);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_sketch_delete AFTER DELETE ON anuncios
+        WHEN OLD.precio > 0 AND OLD.anio IS NOT NULL AND OLD.modelo IS NOT NULL
+        BEGIN
+            INSERT INTO sketch_pendientes (modelo, anio, precio, signo) VALUES (OLD.modelo, OLD.anio, OLD.precio, -1);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_sketch_update AFTER UPDATE OF modelo, anio, precio ON anuncios
+        WHEN NEW.modelo IS NOT OLD.modelo OR NEW.anio IS NOT OLD.anio OR NEW.precio IS NOT OLD.precio
+        BEGIN
+            INSERT INTO sketch_pendientes (modelo, anio, precio, signo)
+            SELECT OLD.modelo, OLD.anio, OLD.precio, -1
+            WHERE OLD.precio > 0 AND OLD.anio IS NOT NULL AND OLD.modelo IS NOT NULL;
+            INSERT INTO sketch_pendientes (modelo, anio, precio, signo)
+            SELECT NEW.modelo, NEW.anio, NEW.precio, 1
+            WHERE NEW.precio > 0 AND NEW.anio IS NOT NULL AND NEW.modelo IS NOT NULL;
+        END
+    """)
+
+    if not existia:
+        reconstruir_sketches(conn)
+    else:
+        consolidar_sketches(conn)
+
+def _construir(conn: sqlite3.Connection, modelo: str, anio: int) -> SketchPrecios:
+    """Sketch de una clave leído directamente de `anuncios`"""
+    sketch = SketchPrecios()
+    for precio, cantidad in conn.execute("""
+        SELECT precio, COUNT(*) FROM anuncios
+        WHERE modelo = ? AND anio = ? AND precio > 0
+        GROUP BY precio ORDER BY precio
+    """, (modelo, anio)):
+        sketch.agregar(precio, cantidad)
+    return sketch
+
+def _guardar(conn: sqlite3.Connection, clave: Clave, sketch: SketchPrecios):
+    if not sketch.n:
+        conn.execute("DELETE FROM sketch_precios WHERE modelo = ? AND anio = ?", clave)
+        return
+    conn.execute("""
+        INSERT OR REPLACE INTO sketch_precios (modelo, anio, n, exacto, minimo, maximo, centroides)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (*clave, sketch.n, int(sketch.exacto), sketch.minimo, sketch.maximo, sketch.a_json()))
+
+def _leer(conn: sqlite3.Connection, condicion: str, params: tuple) -> Dict[Clave, SketchPrecios]:
+    """Sketches guardados más sus pendientes, para las claves que cumplen `condicion`"""
+    sketches = {
+        (modelo, anio): SketchPrecios(json.loads(centroides), bool(exacto), minimo, maximo)
+        for modelo, anio, exacto, minimo, maximo, centroides in conn.execute(
+            f"SELECT modelo, anio, exacto, minimo, maximo, centroides FROM sketch_precios WHERE {condicion}", params
+        )
+    }
+    pendientes = conn.execute(
+        f"SELECT modelo, anio, precio, signo FROM sketch_pendientes WHERE {condicion} ORDER BY id", params
+    ).fetchall()
+
+    a_reconstruir = set()
+    for modelo, anio, precio, signo in pendientes:
+        clave = (modelo, anio)
+        if clave in a_reconstruir:
+            continue
+        sketch = sketches.setdefault(clave, SketchPrecios())
+        if signo > 0:
+            sketch.agregar(precio)
+        elif not sketch.quitar(precio):
+            a_reconstruir.add(clave)
+    for clave in a_reconstruir:
+        sketches[clave] = _construir(conn, *clave)
+    return sketches
+
+def sketch_ventana(conn: sqlite3.Connection, modelo: str, desde: int, hasta: int) -> SketchPrecios:
+    """Fusión de los sketches de `modelo` para los años desde..hasta"""
+    sketches = _leer(conn, "modelo = ? AND anio BETWEEN ? AND ?", (modelo, desde, hasta))
+    return fusionar_sketches(list(sketches.values()), comprimir=False)
+
+def sketches_modelo(conn: sqlite3.Connection, modelo: str) -> Dict[int, SketchPrecios]:
+    """Sketch de cada año de `modelo`, ordenados por año"""
+    sketches = _leer(conn, "modelo = ?", (modelo,))
+    return {anio: sketches[(m, anio)] for m, anio in sorted(sketches) if sketches[(m, anio)].n}
+
+def consolidar_sketches(conn: sqlite3.Connection) -> int:
+    """Integra los pendientes a `sketch_precios` y los borra; retorna cuántos había"""
+    # BEGIN IMMEDIATE: ningún pendiente nuevo entra entre la lectura y el borrado
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        claves = conn.execute("SELECT DISTINCT modelo, anio FROM sketch_pendientes").fetchall()
+        for clave in claves:
+            sketch = _leer(conn, "modelo = ? AND anio = ?", clave).get(clave, SketchPrecios())
+            _guardar(conn, clave, sketch)
+        cantidad = conn.execute("DELETE FROM sketch_pendientes").rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cantidad
+
+def reconstruir_sketches(conn: sqlite3.Connection) -> int:
+    """Reconstruye todos los sketches desde `anuncios`; retorna cuántas claves quedaron"""
+    with conn:
+        conn.execute("DELETE FROM sketch_precios")
+        conn.execute("DELETE FROM sketch_pendientes")
+        actual: Optional[Clave] = None
+        sketch = SketchPrecios()
+        claves = 0
+        for modelo, anio, precio, cantidad in conn.execute("""
+            SELECT modelo, anio, precio, COUNT(*) FROM anuncios
+            WHERE precio > 0 AND anio IS NOT NULL AND modelo IS NOT NULL
+            GROUP BY modelo, anio, precio ORDER BY modelo, anio, precio
+        """).fetchall():
+            if (modelo, anio) != actual:
+                if actual is not None:
+                    _guardar(conn, actual, sketch)
+                    claves += 1
+                actual, sketch = (modelo, anio), SketchPrecios()
+            sketch.agregar(precio, cantidad)
+        if actual is not None:
+            _guardar(conn, actual, sketch)
+            claves += 1
+    return claves
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruye los sketches de precios por modelo y año")
+    parser.add_argument("--db", help="Ruta de la base (por defecto la del sistema)")
+    args = parser.parse_args()
+
+    import utils_analisis
+    conn = sqlite3.connect(args.db or utils_analisis.DB_PATH)
+    try:
+        print(f"📐 {reconstruir_sketches(conn)} sketches de precios reconstruidos")
+    finally:
+        conn.close()
@@ -1,9 +1,10 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
-import matplotlib.pyplot as plt
-import numpy as np
 import os
+from typing import Dict, Optional
+from exportar_parquet import PYARROW_DISPONIBLE, directorio_snapshot, leer_anuncios, snapshot_al_dia
+from analitica import conectar, serie_precios, histograma_precios
 
 st.set_page_config(page_title="Análisis de Autos", layout="centered")
 
@@ -14,30 +15,105 @@ st.write("Selecciona un modelo y año para analizar su comportamiento en el merc
 DB_PATH = os.path.abspath("upload-artifact/anuncios.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
-# Cargar datos desde la base de datos
-conn = sqlite3.connect(DB_PATH)
-df = pd.read_sql_query("SELECT * FROM anuncios", conn)
-conn.close()
-
-if df.empty:
+def version_db() -> float:
+    """Última modificación de la base (y su WAL): cambia cuando cambian los datos"""
+    return max(
+        (os.path.getmtime(ruta) for ruta in (DB_PATH, DB_PATH + "-wal") if os.path.exists(ruta)),
+        default=0.0
+    )
+
+def consultar(sql: str, params: tuple = ()) -> pd.DataFrame:
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+# Las funciones cacheadas reciben la versión de la base: al cambiar los datos,
+# la clave cambia y se vuelve a consultar; si no, cada rerun es instantáneo.
+@st.cache_data(ttl=600, show_spinner=False)
+def cargar_modelos_anios(version: float) -> pd.DataFrame:
+    """Pares (modelo, año) con su cantidad de anuncios, sin leer la tabla completa"""
+    try:
+        return consultar("""
+            SELECT modelo, anio, total FROM resumen_modelo_anio
+            WHERE anio != 0 ORDER BY modelo, anio
+        """)
+    except Exception:
+        # Base sin tablas resumen: el índice (modelo, anio, precio) cubre la consulta
+        return consultar("""
+            SELECT modelo, anio, COUNT(*) AS total FROM anuncios
+            WHERE modelo IS NOT NULL AND anio IS NOT NULL
+            GROUP BY modelo, anio ORDER BY modelo, anio
+        """)
+
+def snapshot_vigente() -> bool:
+    """El snapshot Parquet sirve si se exportó de los mismos datos que tiene la base"""
+    return PYARROW_DISPONIBLE and snapshot_al_dia(DB_PATH)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cargar_anuncios(modelo: str, anio: int, version: float) -> pd.DataFrame:
+    """Solo los anuncios del modelo y año seleccionados"""
+    if snapshot_vigente():
+        # Lectura columnar con memory mapping: solo se abre la partición del modelo
+        tabla = leer_anuncios(
+            [("modelo", "=", modelo), ("anio", "=", anio)], destino=directorio_snapshot(DB_PATH)
+        )
+        df = tabla.drop_columns(["mes"]).to_pandas()
+    else:
+        df = consultar("SELECT * FROM anuncios WHERE modelo = ? AND anio = ?", (modelo, anio))
+    df["fecha_scrape"] = pd.to_datetime(df["fecha_scrape"])
+    return df
+
+NUM_BINS = 10
+
+@st.cache_resource(max_entries=1)
+def conexion_analitica(version: float):
+    """Conexión DuckDB (o None si no está instalado) sobre el snapshot o la base"""
+    return conectar(DB_PATH)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cargar_graficos(modelo: str, anio: int, version: float) -> Optional[Dict[str, pd.DataFrame]]:
+    """Serie diaria e histograma calculados en DuckDB; None si no hay DuckDB"""
+    conn = conexion_analitica(version)
+    if conn is None:
+        return None
+    # Un cursor por llamada: Streamlit atiende cada sesión en su propio hilo
+    cursor = conn.cursor()
+    try:
+        serie = pd.DataFrame(
+            serie_precios(cursor, modelo, anio),
+            columns=["fecha", "mediana", "promedio", "roi", "cantidad"]
+        )
+        histograma = pd.DataFrame(
+            histograma_precios(cursor, modelo, anio, NUM_BINS),
+            columns=["desde", "hasta", "cantidad"]
+        )
+    finally:
+        cursor.close()
+    return {"serie": serie, "histograma": histograma}
+
+if not os.path.exists(DB_PATH):
     st.warning("La base de datos está vacía. Ejecuta el scraper primero.")
     st.stop()
 
-# Convertir fechas a datetime
-df["fecha_scrape"] = pd.to_datetime(df["fecha_scrape"])
+version = version_db()
+modelos_anios = cargar_modelos_anios(version)
+
+if modelos_anios.empty:
+    st.warning("La base de datos está vacía. Ejecuta el scraper primero.")
+    st.stop()
 
 # Selección de modelo
-modelos = sorted(df["modelo"].unique())
+modelos = sorted(modelos_anios["modelo"].unique())
 modelo_seleccionado = st.selectbox("📌 Filtrar por modelo", modelos)
 
-# Filtrar por modelo
-df_modelo = df[df["modelo"] == modelo_seleccionado].copy()
-
 # Filtrado adicional por año
-años_disponibles = sorted(df_modelo["anio"].unique())
+años_disponibles = sorted(modelos_anios.loc[modelos_anios["modelo"] == modelo_seleccionado, "anio"])
 año_seleccionado = st.selectbox("📅 Año del modelo", años_disponibles)
 
-df_modelo = df_modelo[df_modelo["anio"] == año_seleccionado]
+df_modelo = cargar_anuncios(modelo_seleccionado, int(año_seleccionado), version)
+graficos = cargar_graficos(modelo_seleccionado, int(año_seleccionado), version)
 
 # Calcular métricas
 precio_min = df_modelo["precio"].min()
@@ -52,7 +128,10 @@ col3.metric("💰 ROI promedio", f"{roi_prom}%")
 # Gráfica de precios en el tiempo
 st.subheader("📆 Tendencia de Precios")
 df_modelo = df_modelo.sort_values("fecha_scrape")
-st.line_chart(df_modelo.set_index("fecha_scrape")["precio"])
+if graficos is not None:
+    st.line_chart(graficos["serie"].set_index("fecha")[["mediana", "promedio"]])
+else:
+    st.line_chart(df_modelo.set_index("fecha_scrape")["precio"])
 
 # Gráfica de ROI
 if len(df_modelo) >= 5:
@@ -63,12 +142,17 @@ else:
 
 # Histograma de precios
 st.subheader("📊 Distribución de Precios por Rangos")
-num_bins = 10
 precios = df_modelo["precio"].dropna()
 
-if not precios.empty:
+if graficos is not None and not graficos["histograma"].empty:
+    # Índice numérico (inicio del rango) para que las barras queden en orden
+    st.bar_chart(graficos["histograma"].set_index("desde")["cantidad"])
+elif not precios.empty:
+    # matplotlib solo se carga cuando hay algo que graficar
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
-    n, bins, patches = ax.hist(precios, bins=num_bins, color="skyblue", edgecolor="black")
+    n, bins, patches = ax.hist(precios, bins=NUM_BINS, color="skyblue", edgecolor="black")
 
     ax.set_xlabel("Rango de precios (Q)")
     ax.set_ylabel("Cantidad de anuncios")
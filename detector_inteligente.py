@@ -9,8 +9,9 @@ class DetectorAñoInteligente:
     Sistema inteligente que aprende patrones automáticamente de las correcciones manuales
     """
     
-    def __init__(self, archivo_correcciones: str = "correcciones.json"):
+    def __init__(self, archivo_correcciones: str = "correcciones.json", verbose: bool = True):
         self.archivo_correcciones = archivo_correcciones
+        self.verbose = verbose  # Si imprimir el resumen de aprendizaje
         self.correcciones = {}  # Correcciones exactas originales
         self.patrones_aprendidos = {}  # Patrones extraídos automáticamente
         self.cargar_y_aprender()
@@ -39,7 +40,8 @@ class DetectorAñoInteligente:
         if not self.correcciones:
             return
             
-        print(f"🧠 Analizando {len(self.correcciones)} correcciones para extraer patrones...")
+        if self.verbose:
+            print(f"🧠 Analizando {len(self.correcciones)} correcciones para extraer patrones...")
         
         # Estructura: {modelo: {tipo_patron: [ejemplos]}}
         patrones_por_modelo = {}
@@ -82,7 +84,8 @@ class DetectorAñoInteligente:
                             'años_ejemplo': [e['año'] for e in ejemplos[:3]]
                         }
         
-        self._mostrar_patrones_aprendidos()
+        if self.verbose:
+            self._mostrar_patrones_aprendidos()
     
     def _identificar_modelos(self, texto: str) -> List[str]:
         """Identifica todos los modelos de auto presentes en el texto"""
@@ -203,6 +206,13 @@ class DetectorAñoInteligente:
         """
         🚀 DETECCIÓN INTELIGENTE: Combina correcciones exactas + patrones aprendidos
         """
+        return self.detectar_año_con_fuente(texto, debug)[0]
+
+    def detectar_año_con_fuente(self, texto: str, debug: bool = False) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Igual que detectar_año_inteligente, pero indica cómo se encontró el año:
+        "exacta", "patron" o "parcial" (None si no se detectó)
+        """
         texto_normalizado = self._normalizar_texto(texto)
         
         if debug:
@@ -213,7 +223,7 @@ class DetectorAñoInteligente:
             resultado = self.correcciones[texto_normalizado]
             if debug:
                 print(f"✅ Coincidencia exacta: {resultado}")
-            return resultado
+            return resultado, "exacta"
         
         # 2. 🧠 BÚSQUEDA POR PATRONES APRENDIDOS
         modelos_detectados = self._identificar_modelos(texto)
@@ -224,18 +234,18 @@ class DetectorAñoInteligente:
                 if año_detectado:
                     if debug:
                         print(f"🎯 Detectado por patrón ({modelo}): {año_detectado}")
-                    return año_detectado
+                    return año_detectado, "patron"
         
         # 3. Búsqueda parcial mejorada (fallback)
         año_parcial = self._busqueda_parcial_mejorada(texto_normalizado, debug)
         if año_parcial:
             if debug:
                 print(f"🔍 Detectado por búsqueda parcial: {año_parcial}")
-            return año_parcial
+            return año_parcial, "parcial"
         
         if debug:
             print("❌ No se detectó año")
-        return None
+        return None, None
     
     def _aplicar_patrones_modelo(self, texto: str, modelo: str, debug: bool = False) -> Optional[int]:
         """Aplica todos los patrones aprendidos para un modelo específico"""
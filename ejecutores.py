@@ -0,0 +1,58 @@
+"""
+ejecutores.py - Trabajo bloqueante fuera del event loop
+
+El análisis (regex, puntuación) y las consultas a SQLite son síncronos: si
+corren dentro del loop de Playwright, la navegación se detiene mientras tanto.
+
+- `en_analisis(fn, *args)`: corre `fn` en un pool de hilos de análisis.
+- `en_db(fn, *args)`: corre `fn` en un único hilo dedicado a SQLite, así las
+  escrituras quedan serializadas y la conexión compartida nunca se usa desde
+  dos hilos a la vez.
+
+Los ejecutores se crean en el primer uso y se liberan con `cerrar_ejecutores()`.
+"""
+
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+HILOS_ANALISIS = int(os.environ.get("HILOS_ANALISIS", "2"))
+
+_ejecutor_analisis: Optional[ThreadPoolExecutor] = None
+_ejecutor_db: Optional[ThreadPoolExecutor] = None
+
+def ejecutor_analisis() -> ThreadPoolExecutor:
+    global _ejecutor_analisis
+    if _ejecutor_analisis is None:
+        _ejecutor_analisis = ThreadPoolExecutor(max_workers=HILOS_ANALISIS, thread_name_prefix="analisis")
+    return _ejecutor_analisis
+
+def ejecutor_db() -> ThreadPoolExecutor:
+    global _ejecutor_db
+    if _ejecutor_db is None:
+        _ejecutor_db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+    return _ejecutor_db
+
+async def _ejecutar(ejecutor: ThreadPoolExecutor, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ejecutor, functools.partial(fn, *args, **kwargs))
+
+async def en_analisis(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Corre una función de análisis (CPU) sin bloquear el event loop"""
+    return await _ejecutar(ejecutor_analisis(), fn, *args, **kwargs)
+
+async def en_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Corre una operación SQLite en el hilo dedicado a la base"""
+    return await _ejecutar(ejecutor_db(), fn, *args, **kwargs)
+
+def cerrar_ejecutores(esperar: bool = True):
+    """Libera los hilos; los ejecutores se recrean si se vuelven a usar"""
+    global _ejecutor_analisis, _ejecutor_db
+    for ejecutor in (_ejecutor_analisis, _ejecutor_db):
+        if ejecutor is not None:
+            ejecutor.shutdown(wait=esperar)
+    _ejecutor_analisis = _ejecutor_db = None
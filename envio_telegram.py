@@ -0,0 +1,212 @@
+"""
+envio_telegram.py - Entrega de mensajes a Telegram respetando sus límites
+
+- Una cola y un worker por chat: los mensajes de un chat llegan en orden y
+  los de chats distintos se envían en paralelo.
+- Token bucket global (30 msg/s) y por chat (1 msg/s), los límites de la Bot API.
+- RetryAfter: se pausa el envío global el tiempo que indica Telegram y se reintenta.
+- `empaquetar_mensajes` junta anuncios completos en mensajes de hasta 4096
+  caracteres ya escapados, sin cortar un anuncio ni una entidad Markdown.
+- TELEGRAM_API_URL apunta el bot a otro servidor Bot API (p. ej. uno local de
+  pruebas: http://localhost:8081/bot).
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from utils_analisis import escapar_multilinea
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "").strip() or None
+LIMITE_GLOBAL = float(os.environ.get("TELEGRAM_LIMITE_GLOBAL", "30"))  # mensajes/s del bot
+LIMITE_POR_CHAT = float(os.environ.get("TELEGRAM_LIMITE_POR_CHAT", "1"))  # mensajes/s por chat
+LIMITE_MENSAJE = 4096  # caracteres, después del escapado
+MAX_REINTENTOS = 5
+SEPARADOR_ITEMS = "\n\n"
+
+class LimitadorTokens:
+    """Token bucket: hasta `capacidad` envíos seguidos y luego `tasa` por segundo"""
+
+    def __init__(self, tasa: float, capacidad: Optional[float] = None):
+        self.tasa = tasa
+        self.capacidad = capacidad or max(1.0, tasa)
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._pausado_hasta = 0.0
+        self._lock = asyncio.Lock()
+
+    async def adquirir(self):
+        async with self._lock:
+            while True:
+                ahora = time.monotonic()
+                if ahora < self._pausado_hasta:
+                    await asyncio.sleep(self._pausado_hasta - ahora)
+                    continue
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.tasa)
+
+    def pausar(self, segundos: float):
+        """Nadie adquiere tokens durante `segundos` (p. ej. tras un RetryAfter)"""
+        self._pausado_hasta = max(self._pausado_hasta, time.monotonic() + segundos)
+
+def _partir_item(item: str, limite: int, escapar: Callable[[str], str]) -> List[str]:
+    """Parte un item demasiado largo por líneas y, si hace falta, por caracteres"""
+    if len(escapar(item)) <= limite:
+        return [item]
+
+    piezas, actual = [], ""
+    for linea in item.split("\n"):
+        candidato = f"{actual}\n{linea}" if actual else linea
+        if len(escapar(candidato)) <= limite:
+            actual = candidato
+            continue
+        if actual:
+            piezas.append(actual)
+        actual = ""
+        # Línea que sola excede el límite: se corta carácter a carácter
+        for caracter in linea:
+            if len(escapar(actual + caracter)) > limite:
+                piezas.append(actual)
+                actual = ""
+            actual += caracter
+    if actual:
+        piezas.append(actual)
+    return piezas
+
+def empaquetar_mensajes(
+    titulo: str,
+    items: List[str],
+    limite: int = LIMITE_MENSAJE,
+    escapar: Callable[[str], str] = escapar_multilinea
+) -> List[str]:
+    """
+    Agrupa `items` completos (el título va al inicio del primero) en la menor
+    cantidad de mensajes cuyo largo escapado no supera `limite`. Los textos se
+    retornan sin escapar.
+    """
+    if not items:
+        return []
+
+    largo_sep = len(escapar(SEPARADOR_ITEMS))
+    mensajes: List[str] = []
+    actual, largo = titulo, len(escapar(titulo))
+    for item in items:
+        for pieza in _partir_item(item, limite, escapar):
+            largo_pieza = len(escapar(pieza))
+            if not actual:
+                actual, largo = pieza, largo_pieza
+            elif largo + largo_sep + largo_pieza <= limite:
+                actual = f"{actual}{SEPARADOR_ITEMS}{pieza}"
+                largo += largo_sep + largo_pieza
+            else:
+                mensajes.append(actual)
+                actual, largo = pieza, largo_pieza
+    if actual:
+        mensajes.append(actual)
+    return mensajes
+
+def _segundos(retry_after: Any) -> float:
+    """RetryAfter.retry_after es int o timedelta según la versión de python-telegram-bot"""
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+@dataclass
+class _Mensaje:
+    texto: str
+    parse_mode: Optional[str]
+    futuro: asyncio.Future
+
+class EnvioTelegram:
+    """Cola de envío con límites de tasa; `obtener_bot` crea el cliente en el primer envío"""
+
+    def __init__(
+        self,
+        obtener_bot: Callable[[], Any],
+        limite_global: float = LIMITE_GLOBAL,
+        limite_por_chat: float = LIMITE_POR_CHAT,
+        max_reintentos: int = MAX_REINTENTOS
+    ):
+        self.obtener_bot = obtener_bot
+        self.limite_por_chat = limite_por_chat
+        self.max_reintentos = max_reintentos
+        self.limitador_global = LimitadorTokens(limite_global)
+        self._limitadores: Dict[Any, LimitadorTokens] = {}
+        self._colas: Dict[Any, asyncio.Queue] = {}
+        self._workers: Dict[Any, asyncio.Task] = {}
+        self.enviados = 0
+        self.fallidos = 0
+
+    def encolar(self, chat_id: Any, texto: str, parse_mode: Optional[str] = "MarkdownV2") -> asyncio.Future:
+        """Agrega el mensaje a la cola del chat sin esperar; el futuro resuelve al Message o None"""
+        if chat_id not in self._colas:
+            self._colas[chat_id] = asyncio.Queue()
+            self._limitadores[chat_id] = LimitadorTokens(self.limite_por_chat, capacidad=1)
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+        futuro = asyncio.get_running_loop().create_future()
+        self._colas[chat_id].put_nowait(_Mensaje(texto, parse_mode, futuro))
+        return futuro
+
+    async def enviar(self, chat_id: Any, texto: str, parse_mode: Optional[str] = "MarkdownV2"):
+        """Encola el mensaje y espera a que se entregue"""
+        return await self.encolar(chat_id, texto, parse_mode)
+
+    async def cerrar(self):
+        """Espera a que se vacíen todas las colas y detiene los workers"""
+        for cola in self._colas.values():
+            cola.put_nowait(None)
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._colas.clear()
+        self._workers.clear()
+        if self.enviados or self.fallidos:
+            logger.info(f"📨 Telegram: {self.enviados} enviados, {self.fallidos} fallidos")
+
+    async def _worker(self, chat_id: Any):
+        cola = self._colas[chat_id]
+        while True:
+            mensaje = await cola.get()
+            if mensaje is None:
+                return
+            resultado = await self._entregar(chat_id, mensaje)
+            if not mensaje.futuro.done():
+                mensaje.futuro.set_result(resultado)
+
+    async def _entregar(self, chat_id: Any, mensaje: _Mensaje):
+        from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest, Forbidden
+
+        for intento in range(1, self.max_reintentos + 1):
+            await self._limitadores[chat_id].adquirir()
+            await self.limitador_global.adquirir()
+            try:
+                resultado = await self.obtener_bot().send_message(
+                    chat_id=chat_id,
+                    text=mensaje.texto,
+                    parse_mode=mensaje.parse_mode,
+                    disable_web_page_preview=True
+                )
+                self.enviados += 1
+                return resultado
+            except RetryAfter as e:
+                espera = _segundos(e.retry_after)
+                logger.warning(f"⏳ Telegram pide esperar {espera:.0f}s (intento {intento})")
+                self.limitador_global.pausar(espera)
+            except (BadRequest, Forbidden) as e:
+                # Contenido o permisos (Markdown inválido, mensaje largo, bot bloqueado):
+                # reintentar no ayuda. Va antes que NetworkError, del que hereda BadRequest
+                logger.error(f"❌ Telegram rechazó el mensaje: {e}")
+                break
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Error de red con Telegram (intento {intento}): {e}")
+                await asyncio.sleep(min(2 ** intento, 30))
+            except Exception as e:
+                logger.error(f"❌ Error enviando a Telegram: {e}")
+                break
+
+        self.fallidos += 1
+        return None
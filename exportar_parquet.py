@@ -0,0 +1,271 @@
+"""
+exportar_parquet.py - Snapshot columnar (Parquet) de la base para análisis
+
+- `anuncios` se escribe particionado por modelo y mes de fecha_scrape, en
+  formato Hive: parquet/anuncios/modelo=<modelo>/mes=<AAAA-MM>/datos.parquet
+- La exportación es incremental: cada partición guarda en el manifiesto una
+  huella calculada en SQLite (conteo, sumas y la última escritura, MAX(updated_at),
+  de la partición). Solo se reescriben las particiones cuya huella cambió; las
+  que ya no existen se borran.
+- Las tablas chicas (resúmenes e historial de precios, si existen) se reescriben
+  completas en parquet/<tabla>.parquet.
+- Los archivos se escriben a un temporal y se renombran: un lector nunca ve un
+  archivo a medio escribir.
+- El manifiesto guarda la versión de los datos exportados (`version_datos`:
+  conteo y MAX(updated_at) de anuncios). `snapshot_al_dia` la compara con la
+  base; el mtime del archivo no sirve, cambia con escrituras que no tocan los
+  datos (la marca de sincronización, ANALYZE, VACUUM).
+
+pyarrow es opcional: sin él, `exportar_snapshot` avisa y no hace nada.
+
+Uso (el workflow lo corre después de `sincronizacion.py exportar`):
+    python exportar_parquet.py [--db RUTA] [--destino DIR] [--completo]
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime
+from urllib.parse import quote
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+    PYARROW_DISPONIBLE = True
+except ImportError:
+    PYARROW_DISPONIBLE = False
+
+VERSION_SNAPSHOT = 1
+MANIFIESTO = "manifest.json"
+# Tablas que se exportan completas si existen en la base
+TABLAS_COMPLETAS = ("precio_historial", "resumen_modelo", "resumen_modelo_anio", "resumen_diario")
+# Columnas cuyo tipo declarado no refleja lo que guardan (el workflow crea
+# confianza_precio como INTEGER, pero contiene 'alta'/'media'/'baja')
+TIPOS_FORZADOS = {"confianza_precio": "TEXT", "km": "TEXT", "fecha_scrape": "TEXT"}
+# modelo va en la ruta de la partición. ultimo_visto cambia en casi todos los
+# anuncios de cada corrida sin tocar updated_at: exportarlo obligaría a
+# reescribir todas las particiones
+EXCLUIDAS = ("modelo", "ultimo_visto")
+
+# Huella por partición: cambia si se agrega, borra o modifica un anuncio de la partición
+SQL_HUELLAS = """
+    SELECT modelo, strftime('%Y-%m', fecha_scrape) AS mes,
+           COUNT(*), TOTAL(precio), TOTAL(roi), TOTAL(score), TOTAL(anio),
+           TOTAL(length(link)), MAX(fecha_scrape), {extra}
+    FROM anuncios
+    WHERE modelo IS NOT NULL
+    GROUP BY modelo, mes
+"""
+
+def version_datos(conn: sqlite3.Connection) -> List[Any]:
+    """Cambia si se agrega, borra o modifica un anuncio; el índice de updated_at la hace barata"""
+    columnas = {c[1] for c in conn.execute("PRAGMA table_info(anuncios)")}
+    ultima = "MAX(updated_at)" if "updated_at" in columnas else "TOTAL(precio) + TOTAL(roi)"
+    return list(conn.execute(f"SELECT COUNT(*), {ultima} FROM anuncios").fetchone())
+
+def directorio_snapshot(db_path: Optional[str] = None) -> str:
+    """Por defecto el snapshot vive junto a la base: <dir de la base>/parquet"""
+    import utils_analisis
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or utils_analisis.DB_PATH)), "parquet")
+
+def _tipo_arrow(declarado: str) -> "pa.DataType":
+    """Tipo Arrow según la afinidad de tipo que SQLite le da a la columna declarada"""
+    declarado = (declarado or "").upper()
+    if "INT" in declarado or "BOOL" in declarado:
+        return pa.int64()
+    if any(t in declarado for t in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    return pa.string()
+
+def _convertir(valor: Any, tipo: "pa.DataType") -> Any:
+    """SQLite no impone tipos: un valor que no encaja en la columna se exporta como nulo"""
+    if valor is None:
+        return None
+    try:
+        if pa.types.is_int64(tipo):
+            return int(valor)
+        if pa.types.is_float64(tipo):
+            return float(valor)
+    except (TypeError, ValueError):
+        return None
+    return valor if isinstance(valor, str) else str(valor)
+
+def _esquema(conn: sqlite3.Connection, tabla: str, excluir: Tuple[str, ...] = ()) -> "pa.Schema":
+    columnas = conn.execute(f"PRAGMA table_info({tabla})").fetchall()
+    return pa.schema([
+        (c[1], _tipo_arrow(TIPOS_FORZADOS.get(c[1], c[2]))) for c in columnas if c[1] not in excluir
+    ])
+
+def _columnas_sql(esquema: "pa.Schema") -> str:
+    return ", ".join(f'"{c}"' for c in esquema.names)
+
+def _tabla_arrow(cursor: sqlite3.Cursor, esquema: "pa.Schema") -> "pa.Table":
+    filas = cursor.fetchall()
+    columnas = []
+    for i, campo in enumerate(esquema):
+        columnas.append(pa.array([_convertir(f[i], campo.type) for f in filas], type=campo.type))
+    return pa.Table.from_arrays(columnas, schema=esquema)
+
+def _escribir(tabla: "pa.Table", ruta: str):
+    """Escribe a un temporal y renombra, para que la escritura sea atómica"""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + ".tmp"
+    pq.write_table(tabla, temporal, compression="zstd")
+    os.replace(temporal, ruta)
+
+def _ruta_particion(modelo: str, mes: Optional[str]) -> str:
+    return os.path.join("anuncios", f"modelo={quote(modelo, safe='')}", f"mes={mes or 'sin_fecha'}")
+
+def _leer_manifiesto(destino: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(destino, MANIFIESTO), "r", encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        if manifiesto.get("version") == VERSION_SNAPSHOT:
+            return manifiesto
+    except (OSError, ValueError):
+        pass
+    return {"version": VERSION_SNAPSHOT, "particiones": {}, "tablas": {}}
+
+def _guardar_manifiesto(destino: str, manifiesto: Dict[str, Any]):
+    ruta = os.path.join(destino, MANIFIESTO)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2)
+    os.replace(ruta + ".tmp", ruta)
+
+def snapshot_al_dia(db_path: Optional[str] = None, destino: Optional[str] = None) -> bool:
+    """True si el snapshot se exportó de los mismos datos que tiene hoy la base"""
+    import utils_analisis
+    db_path = os.path.abspath(db_path or utils_analisis.DB_PATH)
+    destino = destino or directorio_snapshot(db_path)
+    if not os.path.exists(os.path.join(destino, MANIFIESTO)) or not os.path.exists(db_path):
+        return False
+    exportada = _leer_manifiesto(destino).get("version_datos")
+    if exportada is None:
+        return False
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return version_datos(conn) == exportada
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+def exportar_snapshot(
+    db_path: Optional[str] = None,
+    destino: Optional[str] = None,
+    completo: bool = False
+) -> Dict[str, int]:
+    """
+    Exporta la base a Parquet y retorna cuántas particiones se escribieron,
+    se omitieron (sin cambios) y se borraron. `completo` reescribe todo.
+    """
+    totales = {"escritas": 0, "sin_cambios": 0, "borradas": 0, "tablas": 0}
+    if not PYARROW_DISPONIBLE:
+        print("⚠️ pyarrow no está instalado, se omite el snapshot Parquet")
+        return totales
+
+    import utils_analisis
+    db_path = os.path.abspath(db_path or utils_analisis.DB_PATH)
+    destino = destino or directorio_snapshot(db_path)
+    manifiesto = _leer_manifiesto(destino)
+    if completo:
+        manifiesto["particiones"] = {}
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        # Una sola transacción de lectura: la versión corresponde a lo exportado
+        # aunque el bot escriba mientras tanto
+        conn.execute("BEGIN")
+        version = version_datos(conn)
+        esquema = _esquema(conn, "anuncios", excluir=EXCLUIDAS)
+        columnas = _columnas_sql(esquema)
+        # updated_at (ver sincronizacion.py) cambia con cualquier escritura de datos,
+        # también de columnas que las sumas no ven (km, relevante, ...).
+        # Cada columna entra en la huella solo si existe
+        extra = ", ".join([
+            "MAX(updated_at)" if "updated_at" in esquema.names else "NULL",
+            "TOTAL(length(texto))" if "texto" in esquema.names else "0",
+        ])
+
+        anteriores: Dict[str, Any] = manifiesto["particiones"]
+        actuales: Dict[str, Any] = {}
+        for modelo, mes, *huella in conn.execute(SQL_HUELLAS.format(extra=extra)).fetchall():
+            ruta = _ruta_particion(modelo, mes)
+            actuales[ruta] = {"modelo": modelo, "mes": mes, "filas": huella[0], "huella": huella}
+            previa = anteriores.get(ruta)
+            if previa and previa["huella"] == huella and os.path.exists(os.path.join(destino, ruta, "datos.parquet")):
+                totales["sin_cambios"] += 1
+                continue
+
+            cursor = conn.execute(
+                f"SELECT {columnas} FROM anuncios WHERE modelo = ? AND strftime('%Y-%m', fecha_scrape) IS ? "
+                "ORDER BY fecha_scrape",
+                (modelo, mes)
+            )
+            _escribir(_tabla_arrow(cursor, esquema), os.path.join(destino, ruta, "datos.parquet"))
+            totales["escritas"] += 1
+
+        for ruta in set(anteriores) - set(actuales):
+            shutil.rmtree(os.path.join(destino, ruta), ignore_errors=True)
+            totales["borradas"] += 1
+
+        existentes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        manifiesto["tablas"] = {}
+        for tabla in TABLAS_COMPLETAS:
+            if tabla not in existentes:
+                continue
+            esquema_tabla = _esquema(conn, tabla)
+            cursor = conn.execute(f"SELECT {_columnas_sql(esquema_tabla)} FROM {tabla}")
+            arrow = _tabla_arrow(cursor, esquema_tabla)
+            _escribir(arrow, os.path.join(destino, f"{tabla}.parquet"))
+            manifiesto["tablas"][tabla] = {"archivo": f"{tabla}.parquet", "filas": arrow.num_rows}
+            totales["tablas"] += 1
+    finally:
+        conn.close()
+
+    manifiesto["particiones"] = actuales
+    manifiesto["generado"] = datetime.now().isoformat(timespec="seconds")
+    manifiesto["version_datos"] = version
+    manifiesto["filas"] = sum(p["filas"] for p in actuales.values())
+    _guardar_manifiesto(destino, manifiesto)
+
+    print(f"🗂️ Snapshot Parquet en {destino}: {totales['escritas']} particiones escritas, "
+          f"{totales['sin_cambios']} sin cambios, {totales['borradas']} borradas, {totales['tablas']} tablas")
+    return totales
+
+def leer_anuncios(
+    filtros: Optional[List[Tuple[str, str, Any]]] = None,
+    columnas: Optional[List[str]] = None,
+    destino: Optional[str] = None
+) -> Optional["pa.Table"]:
+    """
+    Lee anuncios del snapshot con memory mapping. `filtros` usa la sintaxis de
+    pyarrow, p. ej. [("modelo", "=", "yaris"), ("anio", "=", 2015)]; los filtros
+    sobre modelo y mes descartan particiones sin abrirlas. Retorna None si no
+    hay snapshot o falta pyarrow.
+    """
+    destino = destino or directorio_snapshot()
+    raiz = os.path.join(destino, "anuncios")
+    if not PYARROW_DISPONIBLE or not os.path.isdir(raiz):
+        return None
+
+    particionado = pa.schema([("modelo", pa.string()), ("mes", pa.string())])
+    return pq.read_table(
+        raiz,
+        columns=columnas,
+        filters=filtros,
+        memory_map=True,
+        partitioning=ds.partitioning(particionado, flavor="hive"),
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta la base de anuncios a Parquet particionado")
+    parser.add_argument("--db", help="Ruta de la base (por defecto la del sistema)")
+    parser.add_argument("--destino", help="Directorio del snapshot (por defecto <dir de la base>/parquet)")
+    parser.add_argument("--completo", action="store_true", help="Reescribir todas las particiones")
+    args = parser.parse_args()
+    exportar_snapshot(args.db, args.destino, args.completo)
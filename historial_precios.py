@@ -0,0 +1,189 @@
+"""
+historial_precios.py - Historial de precios por anuncio (solo se agrega)
+
+`precio_historial` guarda una fila cada vez que un anuncio aparece con precio
+o su precio cambia; los triggers sobre `anuncios` la mantienen, así ningún
+camino de escritura (scraper, re-análisis, importación de deltas) la salta.
+
+- fecha: la del cambio. Si la fila trae su propio updated_at (importación de
+  un delta) se usa ese, así reconstruir la base no inventa fechas nuevas.
+- fuente: 'alta' (primer precio), 'cambio' (precio nuevo) o 'reanalisis'
+  (corrección del parser, ver reanalizar.py; no es un movimiento del mercado).
+
+Índices: (link, fecha) para el precio anterior de un anuncio, (modelo, anio,
+fecha) para ventanas por modelo/año y (fecha) para "cambios desde T".
+"""
+
+import sqlite3
+import statistics
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+AHORA_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def crear_historial(conn: sqlite3.Connection):
+    """Tabla, índices y triggers del historial; la primera vez carga los precios actuales"""
+    existia = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'precio_historial'"
+    ).fetchone() is not None
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS precio_historial (
+            id INTEGER PRIMARY KEY,
+            link TEXT NOT NULL,
+            modelo TEXT,
+            anio INTEGER,
+            precio INTEGER NOT NULL,
+            fecha TEXT NOT NULL,
+            fuente TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_precio_historial_link ON precio_historial(link, fecha)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_precio_historial_modelo ON precio_historial(modelo, anio, fecha)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_precio_historial_fecha ON precio_historial(fecha)")
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_historial_insert AFTER INSERT ON anuncios
+        WHEN NEW.precio > 0
+        BEGIN
+            INSERT INTO precio_historial (link, modelo, anio, precio, fecha, fuente)
+            VALUES (NEW.link, NEW.modelo, NEW.anio, NEW.precio, COALESCE(NEW.updated_at, {AHORA_SQL}), 'alta');
+        END
+    """)
+    # updated_at sin cambios: escritura local (el trigger de sincronización lo
+    # actualiza después). Distinto: viene de un delta con la fecha original.
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_historial_update AFTER UPDATE OF precio ON anuncios
+        WHEN NEW.precio > 0 AND NEW.precio IS NOT OLD.precio
+        BEGIN
+            INSERT INTO precio_historial (link, modelo, anio, precio, fecha, fuente)
+            VALUES (
+                NEW.link, NEW.modelo, NEW.anio, NEW.precio,
+                CASE WHEN NEW.updated_at IS OLD.updated_at OR NEW.updated_at IS NULL
+                     THEN {AHORA_SQL} ELSE NEW.updated_at END,
+                'cambio'
+            );
+        END
+    """)
+
+    if not existia:
+        conn.execute("""
+            INSERT INTO precio_historial (link, modelo, anio, precio, fecha, fuente)
+            SELECT link, modelo, anio, precio, COALESCE(updated_at, fecha_scrape), 'alta'
+            FROM anuncios WHERE precio > 0 AND COALESCE(updated_at, fecha_scrape) IS NOT NULL
+        """)
+
+def marcar_reanalisis(conn: sqlite3.Connection, links: List[str], desde: str):
+    """Las filas que generó un re-análisis desde `desde` son correcciones, no cambios de precio"""
+    conn.executemany(
+        "UPDATE precio_historial SET fuente = 'reanalisis' WHERE link = ? AND fecha >= ? AND fuente = 'cambio'",
+        [(link, desde) for link in links]
+    )
+
+def ahora_sql(conn: sqlite3.Connection) -> str:
+    """Marca de tiempo en el formato de `fecha`, para usar como `desde` más tarde"""
+    return conn.execute(f"SELECT {AHORA_SQL}").fetchone()[0]
+
+def bajadas_precio(
+    conn: sqlite3.Connection,
+    desde: str,
+    modelo: Optional[str] = None,
+    porcentaje_minimo: float = 0.0
+) -> List[Dict[str, Any]]:
+    """
+    Anuncios cuyo precio bajó desde `desde` (fecha o marca de tiempo), con el
+    precio anterior, el actual y el porcentaje. Un anuncio con varias bajadas
+    aparece una vez: del primer precio previo a la ventana al último.
+    """
+    filtro_modelo = "AND h.modelo = ?" if modelo else ""
+    filas = conn.execute(f"""
+        WITH cambios AS (
+            SELECT h.link, h.modelo, h.anio, h.precio, h.fecha,
+                   ROW_NUMBER() OVER (PARTITION BY h.link ORDER BY h.fecha DESC, h.id DESC) AS orden
+            FROM precio_historial h
+            WHERE h.fecha >= ? AND h.fuente = 'cambio' {filtro_modelo}
+        )
+        SELECT c.link, c.modelo, c.anio, c.precio, c.fecha,
+               (SELECT p.precio FROM precio_historial p
+                WHERE p.link = c.link AND p.fecha < ?
+                ORDER BY p.fecha DESC, p.id DESC LIMIT 1) AS anterior
+        FROM cambios c
+        WHERE c.orden = 1
+    """, (desde, modelo, desde) if modelo else (desde, desde)).fetchall()
+
+    bajadas = []
+    for link, modelo_fila, anio, precio, fecha, anterior in filas:
+        if not anterior or precio >= anterior:
+            continue
+        porcentaje = (anterior - precio) / anterior * 100
+        if porcentaje >= porcentaje_minimo:
+            bajadas.append({
+                "link": link, "modelo": modelo_fila, "anio": anio, "precio_anterior": anterior,
+                "precio": precio, "porcentaje": round(porcentaje, 1), "fecha": fecha
+            })
+    return sorted(bajadas, key=lambda b: b["porcentaje"], reverse=True)
+
+def _a_fecha(valor: str) -> datetime:
+    return datetime.fromisoformat(valor[:19]) if len(valor) > 10 else datetime.fromisoformat(valor)
+
+def _mediana_ponderada(pares: List[Tuple[int, float]]) -> Optional[float]:
+    """Mediana de precios ponderados por el tiempo que estuvieron vigentes"""
+    pares = sorted(p for p in pares if p[1] > 0)
+    total = sum(peso for _, peso in pares)
+    if not total:
+        return None
+    acumulado = 0.0
+    for precio, peso in pares:
+        acumulado += peso
+        if acumulado >= total / 2:
+            return float(precio)
+    return float(pares[-1][0])
+
+def mediana_ventana(
+    conn: sqlite3.Connection,
+    modelo: str,
+    anio: int,
+    dias: int = 30,
+    tolerancia: int = 0,
+    hasta: Optional[date] = None,
+    ponderada: bool = True
+) -> Dict[str, Any]:
+    """
+    Mediana de precios de (modelo, anio ± tolerancia) en los últimos `dias`.
+    Ponderada, cada precio pesa el tiempo que estuvo vigente dentro de la
+    ventana (un anuncio que bajó de precio a mitad de mes cuenta ambos precios
+    por partes iguales); si no, cada precio vigente en la ventana cuenta una vez.
+    """
+    fin = datetime.combine(hasta or date.today(), datetime.min.time()) + timedelta(days=1)
+    inicio = fin - timedelta(days=dias)
+
+    # (modelo, anio, fecha): solo las filas del modelo/año hasta el fin de la ventana
+    filas = conn.execute("""
+        SELECT h.link, h.precio, h.fecha, COALESCE(a.ultimo_visto, a.fecha_scrape, h.fecha)
+        FROM precio_historial h
+        LEFT JOIN anuncios a ON a.link = h.link
+        WHERE h.modelo = ? AND h.anio BETWEEN ? AND ? AND h.fecha < ?
+        ORDER BY h.link, h.fecha, h.id
+    """, (modelo, anio - tolerancia, anio + tolerancia, fin.isoformat(sep=" "))).fetchall()
+
+    por_link: Dict[str, List[Tuple[datetime, int]]] = {}
+    ultimo_visto: Dict[str, str] = {}
+    for link, precio, fecha, visto in filas:
+        por_link.setdefault(link, []).append((_a_fecha(fecha), precio))
+        ultimo_visto[link] = visto
+
+    pares: List[Tuple[int, float]] = []
+    for link, cambios in por_link.items():
+        # Un anuncio deja de contar el día después de la última vez que se vio
+        # (archivado: el día después de su último cambio de precio)
+        limite = min(fin, _a_fecha(ultimo_visto[link]) + timedelta(days=1))
+        for i, (fecha, precio) in enumerate(cambios):
+            desde = max(fecha, inicio)
+            hasta_tramo = min(cambios[i + 1][0] if i + 1 < len(cambios) else limite, limite)
+            if hasta_tramo > desde:
+                pares.append((precio, (hasta_tramo - desde).total_seconds() if ponderada else 1.0))
+
+    if not pares:
+        return {"mediana": None, "muestra": 0, "anuncios": 0}
+    mediana = _mediana_ponderada(pares) if ponderada else float(statistics.median(p for p, _ in pares))
+    return {"mediana": mediana, "muestra": len(pares), "anuncios": len(por_link)}
@@ -0,0 +1,151 @@
+"""
+pipeline.py - Etapas asíncronas conectadas por colas acotadas
+
+Cada etapa tiene su propia concurrencia (número de workers) y una cola de
+entrada con capacidad fija. Si una etapa se atrasa, las anteriores quedan
+bloqueadas al encolar (backpressure), así la memoria no crece con el largo
+de la corrida. Al vencer el tiempo límite se detiene la fuente y las etapas
+terminan lo que ya tenían en cola (drenado ordenado).
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Marca de fin de flujo: cada worker termina al recibir una
+_FIN = object()
+
+@dataclass
+class Etapa:
+    """
+    Paso del pipeline. `procesar(item, worker)` retorna el item para la
+    siguiente etapa o None para descartarlo; `worker` es el índice del worker
+    (0..concurrencia-1) para etapas que mantienen un recurso propio por worker.
+    """
+    nombre: str
+    procesar: Callable[[Any, int], Awaitable[Any]]
+    concurrencia: int = 1
+    capacidad: int = 16
+
+@dataclass
+class EstadisticasEtapa:
+    entradas: int = 0
+    salidas: int = 0
+    errores: int = 0
+    segundos: float = 0.0
+    max_en_cola: int = 0
+
+class Pipeline:
+    """Ejecuta una fuente asíncrona a través de una secuencia de etapas"""
+
+    def __init__(self, etapas: List[Etapa]):
+        if not etapas:
+            raise ValueError("El pipeline necesita al menos una etapa")
+        self.etapas = etapas
+        self.estadisticas: Dict[str, EstadisticasEtapa] = {e.nombre: EstadisticasEtapa() for e in etapas}
+        self.interrumpido = False
+
+    async def _alimentar(self, fuente: AsyncIterator[Any], cola: asyncio.Queue):
+        """Pasa los items de la fuente a la primera cola (bloquea si está llena)"""
+        estadisticas = self.estadisticas[self.etapas[0].nombre]
+        async for item in fuente:
+            await cola.put(item)
+            estadisticas.max_en_cola = max(estadisticas.max_en_cola, cola.qsize())
+
+    async def _worker(self, posicion: int, indice: int, entrada: asyncio.Queue, salida: Optional[asyncio.Queue]):
+        etapa = self.etapas[posicion]
+        estadisticas = self.estadisticas[etapa.nombre]
+        siguiente = self.estadisticas[self.etapas[posicion + 1].nombre] if salida is not None else None
+
+        while True:
+            item = await entrada.get()
+            if item is _FIN:
+                return
+
+            estadisticas.entradas += 1
+            inicio = time.perf_counter()
+            try:
+                resultado = await etapa.procesar(item, indice)
+            except Exception as e:
+                estadisticas.errores += 1
+                logger.error(f"❌ Etapa {etapa.nombre}: {e}")
+                continue
+            finally:
+                estadisticas.segundos += time.perf_counter() - inicio
+
+            if resultado is None:
+                continue
+            estadisticas.salidas += 1
+            if salida is not None:
+                await salida.put(resultado)
+                siguiente.max_en_cola = max(siguiente.max_en_cola, salida.qsize())
+
+    async def ejecutar(
+        self,
+        fuente: AsyncIterator[Any],
+        timeout: Optional[float] = None,
+        timeout_drenado: float = 120
+    ) -> Dict[str, EstadisticasEtapa]:
+        """
+        Consume la fuente hasta agotarla o hasta `timeout` segundos. Después
+        cierra las etapas en orden, dando `timeout_drenado` segundos para
+        vaciar las colas antes de cancelar lo que quede.
+        """
+        self.interrumpido = False
+        colas = [asyncio.Queue(maxsize=e.capacidad) for e in self.etapas]
+        workers = []
+        for i, etapa in enumerate(self.etapas):
+            salida = colas[i + 1] if i + 1 < len(colas) else None
+            workers.append([
+                asyncio.create_task(self._worker(i, n, colas[i], salida))
+                for n in range(max(1, etapa.concurrencia))
+            ])
+
+        productor = asyncio.create_task(self._alimentar(fuente, colas[0]))
+        try:
+            await asyncio.wait_for(asyncio.shield(productor), timeout)
+        except asyncio.TimeoutError:
+            self.interrumpido = True
+            logger.warning(f"⏳ Tiempo límite de {timeout:.0f}s: se detiene el descubrimiento y se drenan las colas")
+            productor.cancel()
+            try:
+                await productor
+            except asyncio.CancelledError:
+                pass
+        except Exception as e:
+            self.interrumpido = True
+            logger.error(f"❌ Error en la fuente del pipeline: {e}")
+
+        async def drenar():
+            for i, grupo in enumerate(workers):
+                for _ in grupo:
+                    await colas[i].put(_FIN)
+                await asyncio.gather(*grupo)
+
+        try:
+            await asyncio.wait_for(drenar(), timeout_drenado)
+        except asyncio.TimeoutError:
+            self.interrumpido = True
+            pendientes = sum(c.qsize() for c in colas)
+            logger.warning(f"⏳ Drenado incompleto: se cancelan los workers con {pendientes} items en cola")
+            for grupo in workers:
+                for tarea in grupo:
+                    tarea.cancel()
+            await asyncio.gather(*(t for grupo in workers for t in grupo), return_exceptions=True)
+
+        return self.estadisticas
+
+    def resumen(self) -> str:
+        """Una línea por etapa con su volumen, errores y tiempo acumulado"""
+        lineas = []
+        for etapa in self.etapas:
+            e = self.estadisticas[etapa.nombre]
+            lineas.append(
+                f"   {etapa.nombre} x{etapa.concurrencia}: {e.entradas} → {e.salidas} "
+                f"| errores {e.errores} | {e.segundos:.1f}s | cola máx {e.max_en_cola}/{etapa.capacidad}"
+            )
+        return "\n".join(lineas)
@@ -0,0 +1,191 @@
+"""
+reanalizar.py - Re-análisis masivo del historial de anuncios
+
+Después de un cambio en los parsers o en los precios de referencia, vuelve a
+analizar cada anuncio guardado a partir de su texto (columna `texto`) con el
+mismo análisis que usa el scraper.
+
+- El trabajo se reparte por modelo en un ProcessPoolExecutor. Los precios de
+  referencia son por modelo, así que cada shard lee un snapshot coherente:
+  sus cambios se escriben recién cuando el modelo completo terminó.
+- Cada worker precalienta regex, clasificador y detector al arrancar, y
+  memoriza las referencias de precio durante su shard.
+- Los resultados se escriben en lotes con executemany.
+
+Uso:
+    python reanalizar.py [--db RUTA] [--workers N] [--modelo yaris ...] [--solo-anio] [--simular]
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import utils_analisis
+from utils_analisis import (
+    inicializar_tabla_anuncios, precalentar_analisis, referencias_congeladas, extraer_anio
+)
+from scraper_marketplace import analizar_anuncio_scraper, anio_valido
+from anuncio import TextoAnuncio
+from historial_precios import ahora_sql, marcar_reanalisis
+from cuantiles import consolidar_sketches
+
+TAMAÑO_LOTE = 1000
+
+SQL_ACTUALIZAR = """
+    UPDATE anuncios
+    SET anio = ?, precio = ?, roi = ?, score = ?, relevante = ?,
+        confianza_precio = ?, muestra_precio = ?, año_asignado_inteligente = 0
+    WHERE link = ?
+"""
+SQL_ACTUALIZAR_ANIO = "UPDATE anuncios SET anio = ? WHERE link = ?"
+
+@dataclass
+class ResultadoShard:
+    """Lo que un worker devuelve por modelo: solo las filas que cambiaron"""
+    modelo: str
+    total: int = 0
+    cambios: List[Tuple] = field(default_factory=list)
+    descartados: Dict[str, int] = field(default_factory=dict)
+    segundos: float = 0.0
+
+def _inicializar_worker(db_path: str):
+    utils_analisis.DB_PATH = db_path
+    precalentar_analisis()
+
+def reanalizar_modelo(modelo: str, solo_anio: bool = False) -> ResultadoShard:
+    """Re-analiza todos los anuncios con texto de un modelo (corre en un worker)"""
+    inicio = time.perf_counter()
+    resultado = ResultadoShard(modelo)
+
+    conn = sqlite3.connect(utils_analisis.DB_PATH)
+    try:
+        filas = conn.execute("""
+            SELECT link, texto, anio, precio, roi, score, relevante, confianza_precio, muestra_precio
+            FROM anuncios WHERE modelo = ? AND texto IS NOT NULL
+        """, (modelo,))
+
+        # Los años ya guardados cubren casi todas las referencias del shard; las
+        # que falten (año corregido por el parser) se consultan una a una
+        anios = [(modelo, a) for (a,) in conn.execute(
+            "SELECT DISTINCT anio FROM anuncios WHERE modelo = ? AND anio IS NOT NULL", (modelo,)
+        )]
+        with referencias_congeladas(precargar=None if solo_anio else anios):
+            for link, texto, *actual in filas:
+                resultado.total += 1
+                texto_anuncio = TextoAnuncio(texto)
+
+                if solo_anio:
+                    anio = extraer_anio(texto_anuncio)
+                    if anio_valido(anio) and anio != actual[0]:
+                        resultado.cambios.append((anio, link))
+                    continue
+
+                anuncio, motivo = analizar_anuncio_scraper(texto_anuncio, link, modelo)
+                if motivo:
+                    resultado.descartados[motivo] = resultado.descartados.get(motivo, 0) + 1
+                    continue
+
+                nuevo = (
+                    anuncio.anio, anuncio.precio, anuncio.roi, anuncio.score, int(anuncio.relevante),
+                    anuncio.confianza_precio, anuncio.muestra_precio
+                )
+                if nuevo != tuple(actual):
+                    resultado.cambios.append(nuevo + (link,))
+    finally:
+        conn.close()
+
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+def aplicar_cambios(conn: sqlite3.Connection, resultado: ResultadoShard, solo_anio: bool = False):
+    """
+    Escribe los cambios de un shard en lotes de TAMAÑO_LOTE filas. Los precios
+    que cambian quedan en precio_historial como 'reanalisis': son correcciones
+    del parser, no bajadas ni subidas reales.
+    """
+    sql = SQL_ACTUALIZAR_ANIO if solo_anio else SQL_ACTUALIZAR
+    for i in range(0, len(resultado.cambios), TAMAÑO_LOTE):
+        lote = resultado.cambios[i:i + TAMAÑO_LOTE]
+        with conn:
+            desde = ahora_sql(conn)
+            conn.executemany(sql, lote)
+            if not solo_anio:
+                marcar_reanalisis(conn, [fila[-1] for fila in lote], desde)
+
+def reanalizar_historial(
+    db_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    modelos: Optional[List[str]] = None,
+    solo_anio: bool = False,
+    simular: bool = False
+) -> Dict[str, int]:
+    """Re-analiza el historial completo y retorna los totales de la corrida"""
+    db_path = os.path.abspath(db_path or utils_analisis.DB_PATH)
+    utils_analisis.DB_PATH = db_path
+    inicializar_tabla_anuncios()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        por_modelo = dict(conn.execute("""
+            SELECT modelo, COUNT(*) FROM anuncios
+            WHERE texto IS NOT NULL GROUP BY modelo
+        """).fetchall())
+        sin_texto = conn.execute("SELECT COUNT(*) FROM anuncios WHERE texto IS NULL").fetchone()[0]
+
+        if modelos:
+            por_modelo = {m: n for m, n in por_modelo.items() if m in modelos}
+        total = sum(por_modelo.values())
+        totales = {"anuncios": total, "cambiados": 0, "descartados": 0, "sin_texto": sin_texto}
+
+        print(f"🔁 Re-análisis {'de años ' if solo_anio else ''}de {total} anuncios en {len(por_modelo)} modelos")
+        if sin_texto:
+            print(f"⚠️ {sin_texto} anuncios sin texto guardado no se pueden re-analizar")
+        if not total:
+            return totales
+
+        inicio = time.perf_counter()
+        hechos = 0
+        workers = workers or os.cpu_count() or 1
+        # Los modelos más grandes primero, para que el último shard no quede solo
+        orden = sorted(por_modelo, key=por_modelo.get, reverse=True)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_worker, initargs=(db_path,)) as pool:
+            futuros = [pool.submit(reanalizar_modelo, modelo, solo_anio) for modelo in orden]
+            for futuro in as_completed(futuros):
+                resultado = futuro.result()
+                if not simular:
+                    aplicar_cambios(conn, resultado, solo_anio)
+
+                hechos += resultado.total
+                descartados = sum(resultado.descartados.values())
+                totales["cambiados"] += len(resultado.cambios)
+                totales["descartados"] += descartados
+                transcurrido = time.perf_counter() - inicio
+                print(
+                    f"📈 {hechos}/{total} ({hechos / total * 100:.0f}%) | {hechos / transcurrido:.0f} anuncios/s | "
+                    f"{resultado.modelo}: {len(resultado.cambios)} cambiados, {descartados} descartados "
+                    f"en {resultado.segundos:.1f}s"
+                )
+        if totales["cambiados"] and not simular:
+            consolidar_sketches(conn)
+    finally:
+        conn.close()
+
+    duracion = time.perf_counter() - inicio
+    print(f"✅ {total} anuncios en {duracion:.1f}s con {workers} workers "
+          f"| Cambiados: {totales['cambiados']}{' (simulado)' if simular else ''} | Descartados: {totales['descartados']}")
+    return totales
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-analiza los anuncios guardados a partir de su texto")
+    parser.add_argument("--db", help="Ruta de la base (por defecto la del sistema)")
+    parser.add_argument("--workers", type=int, help="Procesos en paralelo (por defecto, todos los núcleos)")
+    parser.add_argument("--modelo", action="append", dest="modelos", help="Limitar a uno o más modelos")
+    parser.add_argument("--solo-anio", action="store_true", help="Solo corregir el año detectado")
+    parser.add_argument("--simular", action="store_true", help="Calcular los cambios sin escribirlos")
+    args = parser.parse_args()
+    reanalizar_historial(args.db, args.workers, args.modelos, args.solo_anio, args.simular)
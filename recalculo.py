@@ -0,0 +1,225 @@
+"""
+recalculo.py - Recalcula ROI, score y relevancia de toda la tabla en lote
+
+Después de ajustar DEPRECIACION_ANUAL, ROI_MINIMO o los pesos de
+puntuar_anuncio (SCORE_BASE, BONUS_*, PENALTY_*), recalcula toda la base
+con operaciones vectorizadas en vez de analizar anuncio por anuncio:
+
+- Lee la tabla una vez en columnas (pandas).
+- Calcula el precio de referencia una sola vez por (modelo, año), con los
+  mismos precios y la misma lógica que get_precio_referencia.
+- Depreciación, ROI, coherencia de precio y la parte numérica del score son
+  operaciones sobre arreglos de NumPy. Las señales de texto (negativo,
+  extranjero, contexto vehicular, calidad) se clasifican una vez por anuncio.
+- Escribe solo las filas que cambiaron, en una sola transacción.
+
+El resultado es el mismo que dan calcular_roi_real y puntuar_anuncio sobre
+la base actual. A diferencia de reanalizar.py no vuelve a extraer año ni
+precio del texto. Los anuncios sin texto guardado conservan su score.
+
+pandas/numpy son opcionales: sin ellos, PANDAS_DISPONIBLE es False y
+`recalcular_tabla` avisa y no hace nada.
+
+Uso:
+    python recalculo.py [--db RUTA] [--simular] [--ajuste BONUS_ROI=25 ...]
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    import pandas as pd
+    PANDAS_DISPONIBLE = True
+except ImportError:
+    PANDAS_DISPONIBLE = False
+
+import utils_analisis
+from utils_analisis import clasificar_texto, referencia_desde_precios
+from anuncio import TextoAnuncio
+
+# Parámetros de utils_analisis que se pueden ajustar por corrida (ver `ajustes`)
+PARAMETROS = (
+    "DEPRECIACION_ANUAL", "COSTO_EXTRA", "ROI_MINIMO", "SCORE_MIN_TELEGRAM", "TOLERANCIA_PRECIO_REF",
+    "SCORE_BASE", "PENALTY_NEGATIVO", "PENALTY_EXTRANJERO", "PENALTY_INVALID", "PENALTY_FUTURO",
+    "BONUS_CONTEXTO_FUERTE", "BONUS_CALIDAD", "BONUS_ROI_DOBLE", "BONUS_ROI",
+    "BONUS_BAJO_REFERENCIA", "FACTOR_BAJO_REFERENCIA", "BONUS_PRECIO_HIGH", "BONUS_CONFIANZA_MEDIA",
+    "PENALTY_CONFIANZA_BAJA", "ROI_CONFIANZA_BAJA", "BONUS_TEXTO_LARGO", "PENALTY_TEXTO_CORTO",
+    "TEXTO_LARGO", "TEXTO_CORTO",
+)
+
+SQL_ACTUALIZAR = """
+    UPDATE anuncios
+    SET roi = ?, score = ?, relevante = ?, confianza_precio = ?, muestra_precio = ?
+    WHERE link = ?
+"""
+
+def _parametros(ajustes: Optional[Dict[str, float]]) -> Dict[str, Any]:
+    ajustes = ajustes or {}
+    desconocidos = set(ajustes) - set(PARAMETROS)
+    if desconocidos:
+        raise ValueError(f"Parámetros desconocidos: {', '.join(sorted(desconocidos))}")
+    return {nombre: ajustes.get(nombre, getattr(utils_analisis, nombre)) for nombre in PARAMETROS}
+
+def _señales_texto(textos: "pd.Series") -> Dict[str, "np.ndarray"]:
+    """Lo que puntuar_anuncio lee del texto, como arreglos (una pasada por anuncio)"""
+    señales: Dict[str, List[Any]] = {"negativo": [], "extranjero": [], "vehicular": [], "calidad": [],
+                                     "reparar": [], "largo": []}
+    for texto in textos:
+        texto = TextoAnuncio.de(texto if isinstance(texto, str) else None)  # pandas trae NaN por NULL
+        motivos = clasificar_texto(texto)
+        for categoria in ("negativo", "extranjero", "vehicular", "calidad"):
+            señales[categoria].append(categoria in motivos)
+        señales["reparar"].append("reparar" in texto.lower or "repuesto" in texto.lower)
+        señales["largo"].append(len(texto))
+    return {nombre: np.array(valores) for nombre, valores in señales.items()}
+
+def referencias_por_par(
+    datos: "pd.DataFrame", pares: List[Tuple[str, int]], tolerancia: int
+) -> "pd.DataFrame":
+    """
+    Precio, confianza y muestra de referencia por (modelo, anio) a partir de
+    los precios ya cargados: una pasada por par, no una consulta por anuncio.
+    """
+    base = datos[(datos["precio"] > 0) & datos["anio"].notna()]
+    por_modelo = {
+        modelo: (grupo["anio"].to_numpy(), grupo["precio"].to_numpy())
+        for modelo, grupo in base.sort_values("precio").groupby("modelo")
+    }
+
+    filas = []
+    for modelo, anio in pares:
+        anios, precios = por_modelo.get(modelo, (np.empty(0), np.empty(0, dtype=np.int64)))
+        en_ventana = (anios >= anio - tolerancia) & (anios <= anio + tolerancia)
+        ref = referencia_desde_precios(modelo, [int(p) for p in precios[en_ventana]])
+        filas.append((modelo, anio, ref["precio"], ref["confianza"], ref["muestra"]))
+    return pd.DataFrame(filas, columns=["modelo", "anio", "precio_ref", "confianza", "muestra"])
+
+def calcular_lote(datos: "pd.DataFrame", ajustes: Optional[Dict[str, float]] = None) -> "pd.DataFrame":
+    """
+    ROI, confianza, muestra, score y relevancia para cada fila de `datos`
+    (columnas de anuncios), con los parámetros actuales o los de `ajustes`.
+    Las filas sin precio o sin año se omiten.
+    """
+    p = _parametros(ajustes)
+    año_actual = utils_analisis.CURRENT_YEAR
+
+    lote = datos[(datos["precio"] > 0) & datos["anio"].notna()].copy()
+    lote["anio"] = lote["anio"].astype(np.int64)
+    pares = list(lote[["modelo", "anio"]].drop_duplicates().itertuples(index=False, name=None))
+    refs = referencias_por_par(datos, pares, p["TOLERANCIA_PRECIO_REF"])
+    lote = lote.merge(refs, on=["modelo", "anio"], how="left")
+
+    precio = lote["precio"].to_numpy(dtype=np.int64)
+    anio = lote["anio"].to_numpy()
+    ref = lote["precio_ref"].to_numpy(dtype=np.float64)
+    muestra = lote["muestra"].to_numpy()
+    confianza = lote["confianza"].to_numpy()
+
+    # ROI (calcular_roi_real)
+    factor = (1 - p["DEPRECIACION_ANUAL"]) ** np.maximum(0, año_actual - anio)
+    inversion = precio + p["COSTO_EXTRA"]
+    roi = np.where(inversion > 0, ((ref * factor - inversion) / inversion) * 100, 0.0).round(1)
+
+    # Coherencia de precio (validar_precio_coherente)
+    confiable = muestra >= utils_analisis.MUESTRA_MINIMA_CONFIABLE
+    s = _señales_texto(lote["texto"])
+    coherente = (
+        (precio >= 2000) & (precio <= 600000) & ~s["reparar"]
+        & (precio >= np.where(confiable, 0.25, 0.15) * ref)
+        & (precio <= np.where(confiable, 2.0, 2.5) * ref)
+    )
+
+    # Score (puntuar_anuncio)
+    score = (
+        p["SCORE_BASE"]
+        + s["negativo"] * p["PENALTY_NEGATIVO"]
+        + s["extranjero"] * p["PENALTY_EXTRANJERO"]
+        + ~coherente * p["PENALTY_INVALID"]
+        + (anio > año_actual) * p["PENALTY_FUTURO"]
+        + s["vehicular"] * p["BONUS_CONTEXTO_FUERTE"]
+        + s["calidad"] * p["BONUS_CALIDAD"]
+        + np.select([roi >= p["ROI_MINIMO"] * 2, roi >= p["ROI_MINIMO"]], [p["BONUS_ROI_DOBLE"], p["BONUS_ROI"]], 0)
+        + (precio < p["FACTOR_BAJO_REFERENCIA"] * ref) * p["BONUS_BAJO_REFERENCIA"]
+        + np.select([(confianza == "alta") & confiable, confianza == "media"],
+                    [p["BONUS_PRECIO_HIGH"], p["BONUS_CONFIANZA_MEDIA"]], 0)
+        + ((confianza == "baja") & (roi < p["ROI_CONFIANZA_BAJA"])) * p["PENALTY_CONFIANZA_BAJA"]
+        + np.select([s["largo"] > p["TEXTO_LARGO"], s["largo"] < p["TEXTO_CORTO"]],
+                    [p["BONUS_TEXTO_LARGO"], p["PENALTY_TEXTO_CORTO"]], 0)
+    )
+    score = np.maximum(0, score)
+    # Sin texto guardado no hay con qué puntuar: se conserva el score actual
+    con_texto = lote["texto"].notna().to_numpy()
+    score = np.where(con_texto, score, lote["score"].fillna(0).to_numpy()).astype(np.int64)
+
+    return pd.DataFrame({
+        "link": lote["link"],
+        "roi": roi,
+        "score": score,
+        "relevante": ((score >= p["SCORE_MIN_TELEGRAM"]) & (roi >= p["ROI_MINIMO"])).astype(np.int64),
+        "confianza_precio": confianza,
+        "muestra_precio": muestra.astype(np.int64),
+    })
+
+def recalcular_tabla(
+    db_path: Optional[str] = None,
+    ajustes: Optional[Dict[str, float]] = None,
+    simular: bool = False
+) -> Dict[str, Any]:
+    """Recalcula toda la tabla y escribe los cambios en una transacción; retorna los totales"""
+    totales: Dict[str, Any] = {"anuncios": 0, "cambiados": 0, "relevantes": 0, "segundos": 0.0}
+    if not PANDAS_DISPONIBLE:
+        print("⚠️ pandas/numpy no están instalados, se omite el recálculo en lote")
+        return totales
+
+    inicio = time.perf_counter()
+    db_path = os.path.abspath(db_path or utils_analisis.DB_PATH)
+    conn = sqlite3.connect(db_path)
+    try:
+        datos = pd.read_sql_query("""
+            SELECT link, modelo, anio, precio, roi, score, relevante, confianza_precio, muestra_precio, texto
+            FROM anuncios
+        """, conn)
+        nuevos = calcular_lote(datos, ajustes)
+
+        actuales = datos.set_index("link").loc[nuevos["link"]]
+        cambiados = nuevos[
+            (actuales["roi"].to_numpy() != nuevos["roi"].to_numpy())
+            | (actuales["score"].to_numpy() != nuevos["score"].to_numpy())
+            | (actuales["relevante"].to_numpy() != nuevos["relevante"].to_numpy())
+            | (actuales["confianza_precio"].to_numpy() != nuevos["confianza_precio"].to_numpy())
+            | (actuales["muestra_precio"].to_numpy() != nuevos["muestra_precio"].to_numpy())
+        ]
+
+        totales["anuncios"] = len(nuevos)
+        totales["cambiados"] = len(cambiados)
+        totales["relevantes"] = int(nuevos["relevante"].sum())
+        if not simular and len(cambiados):
+            columnas = ["roi", "score", "relevante", "confianza_precio", "muestra_precio", "link"]
+            with conn:
+                conn.executemany(SQL_ACTUALIZAR, zip(*(cambiados[c].tolist() for c in columnas)))
+    finally:
+        conn.close()
+
+    totales["segundos"] = round(time.perf_counter() - inicio, 2)
+    print(f"🧮 Recálculo {'simulado ' if simular else ''}de {totales['anuncios']} anuncios en "
+          f"{totales['segundos']}s: {totales['cambiados']} cambiados, {totales['relevantes']} relevantes")
+    return totales
+
+def _ajuste(texto: str) -> Tuple[str, float]:
+    nombre, _, valor = texto.partition("=")
+    if not valor:
+        raise argparse.ArgumentTypeError(f"Se esperaba NOMBRE=VALOR: {texto}")
+    return nombre.strip().upper(), float(valor)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula ROI, score y relevancia de toda la base en lote")
+    parser.add_argument("--db", help="Ruta de la base (por defecto la del sistema)")
+    parser.add_argument("--simular", action="store_true", help="Calcular sin escribir en la base")
+    parser.add_argument("--ajuste", type=_ajuste, action="append", default=[],
+                        help="Parámetro a probar, p. ej. BONUS_ROI=25 (se puede repetir)")
+    args = parser.parse_args()
+    recalcular_tabla(args.db, dict(args.ajuste), args.simular)
@@ -0,0 +1,164 @@
+"""
+resumenes.py - Tablas resumen de `anuncios` mantenidas por triggers
+
+- resumen_modelo:       por modelo
+- resumen_modelo_anio:  por (modelo, anio)
+- resumen_diario:       por (fecha, modelo), usando fecha_scrape
+
+Cada tabla guarda conteos y sumas aditivas (precio, ROI, score, relevantes,
+buckets de confianza, años asignados...) más el mínimo y máximo de precio.
+Los triggers de INSERT/UPDATE/DELETE sobre `anuncios` las mantienen al día,
+así las estadísticas cuestan O(modelos) en vez de recorrer la tabla.
+
+Un INSERT OR REPLACE no dispara los triggers de DELETE, por eso los anuncios
+se guardan con UPSERT (ver insertar_anuncio_db).
+"""
+
+import sqlite3
+from typing import Dict, List, Tuple
+
+# Cambiar al modificar tablas, métricas o triggers: fuerza la reconstrucción
+VERSION_RESUMENES = "1"
+
+# (tabla, [(columna clave, columna de anuncios)]); los NULL se agrupan como '' o 0
+TABLAS_RESUMEN: List[Tuple[str, List[Tuple[str, str]]]] = [
+    ("resumen_modelo", [("modelo", "modelo")]),
+    ("resumen_modelo_anio", [("modelo", "modelo"), ("anio", "anio")]),
+    ("resumen_diario", [("fecha", "fecha_scrape"), ("modelo", "modelo")]),
+]
+
+# Métricas aditivas: columna → aporte de una fila de anuncios ({f} = NEW, OLD o anuncios)
+METRICAS: Dict[str, str] = {
+    "total": "1",
+    "con_precio": "({f}.precio > 0)",
+    "suma_precio": "CASE WHEN {f}.precio > 0 THEN {f}.precio ELSE 0 END",
+    "con_roi": "({f}.roi IS NOT NULL)",
+    "suma_roi": "COALESCE({f}.roi, 0)",
+    "con_score": "({f}.score IS NOT NULL)",
+    "suma_score": "COALESCE({f}.score, 0)",
+    "relevantes": "({f}.relevante = 1)",
+    "conf_alta": "({f}.confianza_precio = 'alta')",
+    "conf_media": "({f}.confianza_precio = 'media')",
+    "conf_baja": "({f}.confianza_precio = 'baja')",
+    "asignados": "({f}.año_asignado_inteligente = 1)",
+    "con_score_asignados": "({f}.año_asignado_inteligente = 1 AND {f}.score IS NOT NULL)",
+    "suma_score_asignados": "CASE WHEN {f}.año_asignado_inteligente = 1 THEN COALESCE({f}.score, 0) ELSE 0 END",
+    "con_roi_asignados": "({f}.año_asignado_inteligente = 1 AND {f}.roi IS NOT NULL)",
+    "suma_roi_asignados": "CASE WHEN {f}.año_asignado_inteligente = 1 THEN COALESCE({f}.roi, 0) ELSE 0 END",
+}
+
+# Columnas de anuncios que alimentan los resúmenes (para el trigger de UPDATE)
+COLUMNAS_FUENTE = (
+    "modelo", "anio", "precio", "roi", "score", "relevante",
+    "confianza_precio", "año_asignado_inteligente", "fecha_scrape"
+)
+
+def _clave(columna: str, fila: str) -> str:
+    return f"COALESCE({fila}.{columna}, {0 if columna == 'anio' else repr('')})"
+
+def _aporte(expresion: str, fila: str) -> str:
+    # Las comparaciones con NULL dan NULL: cuentan como 0
+    return f"COALESCE({expresion.format(f=fila)}, 0)"
+
+def _precio_valido(fila: str) -> str:
+    return f"CASE WHEN {fila}.precio > 0 THEN {fila}.precio END"
+
+def _ddl_tabla(tabla: str, claves: List[Tuple[str, str]]) -> str:
+    columnas_clave = ", ".join(f"{c} {'INTEGER' if c == 'anio' else 'TEXT'} NOT NULL" for c, _ in claves)
+    columnas_metricas = ", ".join(f"{m} {'REAL' if 'roi' in m else 'INTEGER'} NOT NULL DEFAULT 0" for m in METRICAS)
+    return f"""
+        CREATE TABLE IF NOT EXISTS {tabla} (
+            {columnas_clave},
+            {columnas_metricas},
+            min_precio INTEGER,
+            max_precio INTEGER,
+            PRIMARY KEY ({", ".join(c for c, _ in claves)})
+        )
+    """
+
+def _sumar(tabla: str, claves: List[Tuple[str, str]], fila: str) -> str:
+    """UPSERT que agrega la fila (NEW) al grupo que le corresponde"""
+    nombres = [c for c, _ in claves] + list(METRICAS) + ["min_precio", "max_precio"]
+    valores = (
+        [_clave(col, fila) for _, col in claves]
+        + [_aporte(e, fila) for e in METRICAS.values()]
+        + [_precio_valido(fila)] * 2
+    )
+    actualizaciones = [f"{m} = {m} + excluded.{m}" for m in METRICAS] + [
+        "min_precio = COALESCE(MIN(min_precio, excluded.min_precio), min_precio, excluded.min_precio)",
+        "max_precio = COALESCE(MAX(max_precio, excluded.max_precio), max_precio, excluded.max_precio)",
+    ]
+    return f"""
+        INSERT INTO {tabla} ({", ".join(nombres)})
+        VALUES ({", ".join(valores)})
+        ON CONFLICT({", ".join(c for c, _ in claves)}) DO UPDATE SET {", ".join(actualizaciones)};
+    """
+
+def _restar(tabla: str, claves: List[Tuple[str, str]], fila: str) -> str:
+    """
+    Descuenta la fila (OLD) de su grupo. Si era el precio mínimo o máximo, se
+    recalcula sobre anuncios (en un trigger AFTER la fila ya no está o ya cambió).
+    """
+    donde = " AND ".join(f"{c} = {_clave(col, fila)}" for c, col in claves)
+    # IS sobre la columna cruda (no COALESCE) para que el recálculo use los índices
+    grupo = " AND ".join(f"{col} IS {fila}.{col}" for _, col in claves)
+    actualizaciones = [f"{m} = {m} - {_aporte(e, fila)}" for m, e in METRICAS.items()]
+    for columna, agregado, comparacion in (("min_precio", "MIN", "<="), ("max_precio", "MAX", ">=")):
+        actualizaciones.append(
+            f"{columna} = CASE WHEN {fila}.precio > 0 AND {fila}.precio {comparacion} {columna} "
+            f"THEN (SELECT {agregado}(precio) FROM anuncios WHERE {grupo} AND precio > 0) "
+            f"ELSE {columna} END"
+        )
+    return f"""
+        UPDATE {tabla} SET {", ".join(actualizaciones)} WHERE {donde};
+        DELETE FROM {tabla} WHERE {donde} AND total <= 0;
+    """
+
+def _triggers() -> Dict[str, str]:
+    cuerpo_insert = "".join(_sumar(t, c, "NEW") for t, c in TABLAS_RESUMEN)
+    cuerpo_delete = "".join(_restar(t, c, "OLD") for t, c in TABLAS_RESUMEN)
+    return {
+        "trg_resumen_insert": f"AFTER INSERT ON anuncios BEGIN {cuerpo_insert} END",
+        "trg_resumen_delete": f"AFTER DELETE ON anuncios BEGIN {cuerpo_delete} END",
+        "trg_resumen_update": (
+            f"AFTER UPDATE OF {', '.join(COLUMNAS_FUENTE)} ON anuncios "
+            f"BEGIN {cuerpo_delete} {cuerpo_insert} END"
+        ),
+    }
+
+def reconstruir_resumenes(conn: sqlite3.Connection):
+    """Recalcula todas las tablas resumen desde cero a partir de anuncios"""
+    for tabla, claves in TABLAS_RESUMEN:
+        conn.execute(f"DELETE FROM {tabla}")
+        grupo = ", ".join(_clave(col, "anuncios") for _, col in claves)
+        conn.execute(f"""
+            INSERT INTO {tabla} ({", ".join(c for c, _ in claves)}, {", ".join(METRICAS)}, min_precio, max_precio)
+            SELECT {grupo}, {", ".join(f"SUM({_aporte(e, 'anuncios')})" for e in METRICAS.values())},
+                   MIN({_precio_valido('anuncios')}), MAX({_precio_valido('anuncios')})
+            FROM anuncios GROUP BY {grupo}
+        """)
+
+def crear_resumenes(conn: sqlite3.Connection):
+    """
+    Crea tablas y triggers si faltan. Si la versión guardada en `meta` no
+    coincide con VERSION_RESUMENES, los recrea y reconstruye los datos.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+    fila = conn.execute("SELECT valor FROM meta WHERE clave = 'version_resumenes'").fetchone()
+    if fila and fila[0] == VERSION_RESUMENES:
+        return
+
+    for nombre in _triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+    for tabla, claves in TABLAS_RESUMEN:
+        conn.execute(f"DROP TABLE IF EXISTS {tabla}")
+        conn.execute(_ddl_tabla(tabla, claves))
+    for nombre, definicion in _triggers().items():
+        conn.execute(f"CREATE TRIGGER {nombre} {definicion}")
+
+    reconstruir_resumenes(conn)
+    conn.execute(
+        "INSERT INTO meta (clave, valor) VALUES ('version_resumenes', ?) "
+        "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+        (VERSION_RESUMENES,)
+    )
@@ -1,22 +1,35 @@
 # scraper_marketplace.py
 
+from __future__ import annotations
+
 import os
 import re
 import json
 import random
 import asyncio
 import logging
+import time
+from dataclasses import dataclass
 from urllib.parse import urlparse
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple, Set
-from playwright.async_api import async_playwright, Browser, Page, BrowserContext, Error as PlaywrightError, Playwright
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Optional, Tuple, Set, TYPE_CHECKING
 from utils_analisis import (
-    limpiar_precio, contiene_negativos, puntuar_anuncio,
-    calcular_roi_real, coincide_modelo, extraer_anio,
-    existe_en_db, insertar_anuncio_db, inicializar_tabla_anuncios,
-    limpiar_link, modelos_bajo_rendimiento, MODELOS_INTERES,
-    SCORE_MIN_TELEGRAM, ROI_MINIMO, obtener_anuncio_db, anuncio_diferente
+    extraer_precio, clasificar_texto, puntuar_anuncio,
+    calcular_roi_real, coincide_modelo, extraer_anio, resolver_anio,
+    existe_en_db, guardar_anuncio_db, inicializar_tabla_anuncios,
+    limpiar_link, modelos_bajo_rendimiento, limpiar_cache_rendimiento, MODELOS_INTERES,
+    SCORE_MIN_TELEGRAM, ROI_MINIMO, obtener_anuncio_db, anuncio_diferente,
+    estadisticas_cache_anios, hash_contenido_anuncio, obtener_analisis_cache,
+    guardar_analisis_cache, marcar_vistos, validar_precio_coherente, consolidar_sketches_db
 )
+from arranque import tiempos_inicializacion
+from anuncio import Anuncio, ResultadoScraping, TextoAnuncio
+from pipeline import Pipeline, Etapa
+from ejecutores import en_analisis, en_db, cerrar_ejecutores, HILOS_ANALISIS
+
+if TYPE_CHECKING:
+    # Playwright se importa solo al iniciar el scraping (ver buscar_autos_marketplace)
+    from playwright.async_api import Browser, Page, BrowserContext, Playwright
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -31,7 +44,16 @@ MIN_DELAY = 2
 MAX_DELAY = 4
 DELAY_ENTRE_ANUNCIOS = 1.5  # Reducido de 2 para acelerar
 MAX_CONSECUTIVOS_SIN_NUEVOS = 4  # Aumentado de 3 para ser menos agresivo
-BATCH_SIZE_SCROLL = 8  # Aumentado de 6 para procesar más por lote
+SORT_OPTS = ["best_match", "price_asc"]
+
+# Pipeline: workers por etapa y capacidad de cada cola (backpressure)
+CONCURRENCIA_FETCH = int(os.environ.get("CONCURRENCIA_FETCH", "2"))
+CONCURRENCIA_ANALISIS = HILOS_ANALISIS  # Un worker por hilo del pool de análisis
+CAPACIDAD_COLA = int(os.environ.get("CAPACIDAD_COLA", "16"))
+TIMEOUT_MODELO = 300  # Segundos de descubrimiento por modelo
+TIMEOUT_SORT = 180
+TIMEOUT_SCRAPING = int(os.environ.get("TIMEOUT_SCRAPING", str(75 * 60)))  # Por debajo del límite del workflow
+TIMEOUT_DRENADO = 120
 
 class BrowserManager:
     """Gestiona el ciclo de vida del navegador y contextos"""
@@ -309,360 +331,423 @@ async def extraer_texto_anuncio(page: Page, url: str) -> str:
     
     return texto
 
-async def procesar_anuncio_individual(
-    page: Page,
-    url: str,
-    texto: str,
-    modelo: str,
-    contador: Dict[str, int],
-    procesados: List[str],
-    potenciales: List[str],
-    relevantes: List[str],
-    sin_anio_ejemplos: List[Tuple[str, str]]
-) -> bool:
-    """Procesa un anuncio individual y retorna True si fue procesado exitosamente"""
-    
-    try:
-        texto = texto.strip()
-        if not texto or len(texto) < 10:
-            contador["texto_vacio"] = contador.get("texto_vacio", 0) + 1
-            return False
-            
-        if not coincide_modelo(texto, modelo):
-            contador["filtro_modelo"] += 1
-            return False
-            
-        if contiene_negativos(texto):
-            contador["negativo"] += 1
-            return False
-            
-        if "mexico" in texto.lower():
-            contador["extranjero"] += 1
-            return False
+class SesionInvalida(RuntimeError):
+    """Facebook redirigió al login: las cookies ya no sirven"""
 
-        m = re.search(r"[Qq\$]\s?[\d\.,]+", texto)
-        if not m:
-            contador["sin_precio"] += 1
-            return False
-            
-        precio = limpiar_precio(m.group())
-        if precio < MIN_PRECIO_VALIDO:
-            contador["precio_bajo"] += 1
-            return False
+def es_potencial(anuncio: Anuncio) -> bool:
+    """ROI cerca del mínimo: vale una revisión manual aunque no sea relevante"""
+    return not anuncio.relevante and ROI_POTENCIAL_MIN <= anuncio.roi < ROI_MINIMO
 
-        anio = extraer_anio(texto)
+def anio_valido(anio: Optional[int]) -> bool:
+    return bool(anio) and 1990 <= anio <= datetime.now().year
 
-        if not anio or not (1990 <= anio <= datetime.now().year):
-            try:
-                ver_mas = await asyncio.wait_for(
-                    page.query_selector("div[role='main'] span:has-text('Ver más')"),
-                    timeout=3
-                )
-                if ver_mas:
-                    await ver_mas.click()
-                    await asyncio.sleep(1.0)
-                    texto_expandido = await asyncio.wait_for(
-                        page.inner_text("div[role='main']"),
-                        timeout=5
-                    )
-                    anio_expandido = extraer_anio(texto_expandido)
-                    if anio_expandido and (1990 <= anio_expandido <= datetime.now().year):
-                        anio = anio_expandido
-                        texto = texto_expandido
-            except Exception:
-                pass
-        
-        if not anio or not (1990 <= anio <= datetime.now().year):
-            contador["sin_anio"] += 1
-            if len(sin_anio_ejemplos) < MAX_EJEMPLOS_SIN_ANIO:
-                sin_anio_ejemplos.append((texto, url))
-            return False
+def crear_contador() -> Dict[str, int]:
+    return {k: 0 for k in [
+        "total", "duplicado", "negativo", "sin_precio", "sin_anio",
+        "filtro_modelo", "guardado", "precio_bajo", "extranjero",
+        "actualizados", "repetidos", "error", "timeout", "texto_insuficiente",
+        "error_procesamiento", "error_db", "error_general", "texto_vacio", "cache",
+        "precio_incoherente"
+    ]}
 
-        roi_data = calcular_roi_real(modelo, precio, anio)
-        score = puntuar_anuncio({
-            "texto": texto,
-            "modelo": modelo,
-            "anio": anio,
-            "precio": precio,
-            "roi": roi_data.get("roi", 0)
-        })
-
-        relevante = score >= SCORE_MIN_TELEGRAM and roi_data["roi"] >= ROI_MINIMO
-
-        mensaje_base = (
-            f"🚘 *{modelo.title()}*\n"
-            f"• Año: {anio}\n"
-            f"• Precio: Q{precio:,}\n"
-            f"• ROI: {roi_data['roi']:.2f}%\n"
-            f"• Score: {score}/10\n"
-            f"🔗 {url}"
+# Motivos de descarte de analizar_anuncio_scraper, como se reportan en Telegram
+MOTIVOS_DESCARTE = {
+    "filtro_modelo": "modelo no detectado",
+    "negativo": "negativo",
+    "extranjero": "extranjero",
+    "sin_precio": "sin precio",
+    "precio_bajo": "precio fuera de rango",
+    "sin_anio": "año fuera de rango",
+    "precio_incoherente": "precio-año incoherente",
+}
+
+async def expandir_descripcion(page: Page) -> Optional[str]:
+    """Pulsa "Ver más" en la descripción y retorna el texto completo, si lo hay"""
+    try:
+        ver_mas = await asyncio.wait_for(
+            page.query_selector("div[role='main'] span:has-text('Ver más')"),
+            timeout=3
         )
-
+        if not ver_mas:
+            return None
+        await ver_mas.click()
+        await asyncio.sleep(1.0)
+        return await asyncio.wait_for(page.inner_text("div[role='main']"), timeout=5)
+    except Exception:
+        return None
+
+@dataclass(slots=True)
+class TareaAnuncio:
+    """Anuncio en tránsito por las etapas del pipeline"""
+    modelo: str
+    url: str
+    texto: Optional[TextoAnuncio] = None
+    hash_contenido: str = ""
+    anuncio: Optional[Anuncio] = None
+    estado: str = ""  # nuevo | actualizado | repetido | cache
+
+# Callback opcional que recibe cada resultado apenas se persiste
+Notificador = Callable[[ResultadoScraping], Awaitable[None]]
+
+class CorridaMarketplace:
+    """
+    Una ejecución del scraper como pipeline de colas acotadas:
+    descubrir (scroll de búsquedas) → fetch (una página por worker) →
+    analizar → persistir (un solo escritor SQLite) → notificar.
+    El análisis y SQLite corren en sus ejecutores (ver ejecutores.py), así la
+    navegación sigue mientras se analiza la página anterior.
+    """
+
+    def __init__(
+        self,
+        browser_manager: BrowserManager,
+        modelos: List[str],
+        al_notificar: Optional[Notificador] = None
+    ):
+        self.browser_manager = browser_manager
+        self.modelos = modelos
+        self.al_notificar = al_notificar
+        self.contadores: Dict[str, Dict[str, int]] = {m: crear_contador() for m in modelos}
+        self.sin_anio_ejemplos: List[Tuple[str, str]] = []
+        self.resultados: List[ResultadoScraping] = []
+        self.relevantes_por_modelo: Dict[str, int] = {m: 0 for m in modelos}
+        self._paginas_fetch: Dict[int, Page] = {}
+        # Todo link que aparece en una búsqueda, aunque no se vuelva a abrir
+        self.urls_vistas: Set[str] = set()
+        self.pipeline = Pipeline([
+            Etapa("fetch", self.fetch, CONCURRENCIA_FETCH, CAPACIDAD_COLA),
+            Etapa("analizar", self.analizar, CONCURRENCIA_ANALISIS, CAPACIDAD_COLA),
+            Etapa("persistir", self.persistir, 1, CAPACIDAD_COLA),
+            Etapa("notificar", self.notificar, 1, CAPACIDAD_COLA),
+        ])
+
+    async def ejecutar(self, timeout: float = TIMEOUT_SCRAPING):
         try:
-            if existe_en_db(url):
-                existente = obtener_anuncio_db(url)
-                nuevo = {
-                    "modelo": modelo,
-                    "anio": anio,
-                    "precio": precio,
-                    "km": "",
-                    "roi": roi_data["roi"],
-                    "score": score
-                }
-                if anuncio_diferente(nuevo, existente):
-                    insertar_anuncio_db(link=url, modelo=modelo, anio=anio, precio=precio, km="", roi=roi_data["roi"],
-                                       score=score, relevante=relevante, confianza_precio=roi_data["confianza"],
-                                       muestra_precio=roi_data["muestra"])
-                    logger.info(f"🔄 Actualizado: {modelo} | ROI={roi_data['roi']:.2f}% | Score={score}")
-                    contador["actualizados"] += 1
-                else:
-                    contador["repetidos"] += 1
-            else:
-                insertar_anuncio_db(link=url, modelo=modelo, anio=anio, precio=precio, km="", roi=roi_data["roi"],
-                                   score=score, relevante=relevante, confianza_precio=roi_data["confianza"],
-                                   muestra_precio=roi_data["muestra"])
-                logger.info(f"💾 Guardado nuevo: {modelo} | ROI={roi_data['roi']:.2f}% | Score={score}")
-                contador["guardado"] += 1
-        except Exception as e:
-            logger.error(f"Error en DB para {url}: {e}")
-            contador["error_db"] = contador.get("error_db", 0) + 1
-            return False
-
-        procesados.append(mensaje_base)
+            await self.pipeline.ejecutar(self.descubrir(), timeout=timeout, timeout_drenado=TIMEOUT_DRENADO)
+        finally:
+            try:
+                marcados = await en_db(marcar_vistos, list(self.urls_vistas))
+                logger.info(f"👀 {len(self.urls_vistas)} anuncios vistos, {marcados} con ultimo_visto actualizado")
+            except Exception as e:
+                logger.warning(f"Error registrando anuncios vistos: {e}")
+            try:
+                # Las lecturas no escriben: los precios de la corrida se integran aquí
+                await en_db(consolidar_sketches_db)
+            except Exception as e:
+                logger.warning(f"Error consolidando sketches de precios: {e}")
+            for page in self._paginas_fetch.values():
+                try:
+                    if not page.is_closed():
+                        await page.close()
+                except Exception:
+                    pass
+        logger.info(f"🧵 Pipeline{' (interrumpido)' if self.pipeline.interrumpido else ''}:\n{self.pipeline.resumen()}")
 
-        if relevante:
-            relevantes.append(mensaje_base)
-        elif ROI_POTENCIAL_MIN <= roi_data["roi"] < ROI_MINIMO:
-            potenciales.append(mensaje_base)
+    # --- Descubrir ---------------------------------------------------------
 
-        return True
+    async def descubrir(self) -> AsyncIterator[TareaAnuncio]:
+        """Recorre modelos y ordenamientos emitiendo cada URL nueva"""
+        for i, modelo in enumerate(self.modelos):
+            if not await self.browser_manager.verificar_y_recrear():
+                logger.error(f"❌ No se pudo recuperar navegador para {modelo}")
+                return
 
-    except Exception as e:
-        logger.error(f"Error en procesar_anuncio_individual: {e}")
-        contador["error_general"] = contador.get("error_general", 0) + 1
-        return False
+            logger.info(f"📋 Modelo {i+1}/{len(self.modelos)}: {modelo}")
+            vistos: Set[str] = set()
+            limite_modelo = time.monotonic() + TIMEOUT_MODELO
 
-async def procesar_lote_urls(
-    browser_manager: BrowserManager,
-    urls_lote: List[str],
-    modelo: str,
-    vistos_globales: Set[str],
-    contador: Dict[str, int],
-    procesados: List[str],
-    potenciales: List[str],
-    relevantes: List[str],
-    sin_anio_ejemplos: List[Tuple[str, str]]
-) -> int:
-    """Procesa un lote de URLs con manejo robusto de errores"""
-    nuevos_en_lote = 0
-
-    for url in urls_lote:
-        if url in vistos_globales:
-            contador["duplicado"] += 1
-            continue
-        vistos_globales.add(url)
-
-        # Solo verificar si hay un problema evidente, no en cada iteración
-        if browser_manager.page.is_closed():
-            if not await browser_manager.verificar_y_recrear():
-                logger.error("❌ No se pudo recuperar el navegador")
-                return nuevos_en_lote
-        
-        try:
-            await asyncio.wait_for(
-                browser_manager.page.goto(url, wait_until='domcontentloaded'),
-                timeout=15
-            )
-            await asyncio.sleep(random.uniform(1.5, 2.5))
-        except asyncio.TimeoutError:
-            logger.warning(f"⏳ Timeout navegando a {url}")
-            contador["timeout"] = contador.get("timeout", 0) + 1
-            continue
-        except Exception as e:
-            logger.warning(f"Error navegando a {url}: {e}")
-            contador["error"] += 1
-            continue
+            for sort in SORT_OPTS:
+                limite = min(limite_modelo, time.monotonic() + TIMEOUT_SORT)
+                logger.info(f"🔍 Descubriendo {modelo} con ordenamiento: {sort}")
+                try:
+                    async for url in self.descubrir_ordenamiento(modelo, sort, vistos, limite):
+                        yield TareaAnuncio(modelo, url)
+                except Exception as e:
+                    logger.error(f"❌ Error en {sort} para {modelo}: {e}")
+
+                if sort != SORT_OPTS[-1]:
+                    await asyncio.sleep(random.uniform(3.0, 5.0))
+
+            if i < len(self.modelos) - 1:
+                await asyncio.sleep(random.uniform(8.0, 12.0))
+
+    async def descubrir_ordenamiento(
+        self, modelo: str, sort: str, vistos: Set[str], limite: float
+    ) -> AsyncIterator[str]:
+        """Scroll de una búsqueda hasta agotar resultados, repetir URLs o vencer el límite"""
+        contador = self.contadores[modelo]
+        page = self.browser_manager.page
+        if page.is_closed():
+            if not await self.browser_manager.verificar_y_recrear():
+                logger.error("❌ No se pudo verificar navegador")
+                return
+            page = self.browser_manager.page
 
-        try:
-            await asyncio.sleep(DELAY_ENTRE_ANUNCIOS)
-            texto = await extraer_texto_anuncio(browser_manager.page, url)
-            
-            if len(texto.strip()) < 10:
-                contador["texto_insuficiente"] = contador.get("texto_insuficiente", 0) + 1
-                continue
-            
-            if await procesar_anuncio_individual(
-                browser_manager.page, url, texto, modelo, contador,
-                procesados, potenciales, relevantes, sin_anio_ejemplos
-            ):
-                nuevos_en_lote += 1
-                
-                if nuevos_en_lote % 5 == 0:
-                    await asyncio.sleep(random.uniform(2.0, 3.0))
-        except Exception as e:
-            logger.error(f"Error procesando {url}: {e}")
-            contador["error_procesamiento"] = contador.get("error_procesamiento", 0) + 1
-            continue
-    
-    return nuevos_en_lote
-
-async def procesar_ordenamiento_optimizado(
-    browser_manager: BrowserManager,
-    modelo: str,
-    sort: str,
-    vistos_globales: Set[str],
-    contador: Dict[str, int],
-    procesados: List[str],
-    potenciales: List[str],
-    relevantes: List[str],
-    sin_anio_ejemplos: List[Tuple[str, str]]
-) -> int:
-    """Versión optimizada del procesamiento por ordenamiento"""
-    
-    # Verificación inicial solamente
-    if browser_manager.page.is_closed():
-        if not await browser_manager.verificar_y_recrear():
-            logger.error("❌ No se pudo verificar navegador")
-            return 0
-    
-    try:
         url_busq = f"https://www.facebook.com/marketplace/guatemala/search/?query={modelo.replace(' ', '%20')}&minPrice=1000&maxPrice=60000&sortBy={sort}"
-        await asyncio.wait_for(
-            browser_manager.page.goto(url_busq, wait_until='domcontentloaded'),
-            timeout=30
-        )
+        await asyncio.wait_for(page.goto(url_busq, wait_until='domcontentloaded'), timeout=30)
         await asyncio.sleep(random.uniform(MIN_DELAY, MAX_DELAY))
 
-        scrolls_realizados = 0
-        consec_repetidos = 0
-        nuevos_total = 0
-        urls_pendientes = []
+        vistos_en_busqueda: Set[str] = set()
+        consec_sin_nuevos = 0
+        for scroll in range(MAX_SCROLLS_POR_SORT):
+            if time.monotonic() > limite:
+                logger.warning(f"⏳ Timeout en {sort} para {modelo}")
+                return
 
-        while scrolls_realizados < MAX_SCROLLS_POR_SORT:
             # Verificar solo cada 3 scrolls para reducir overhead
-            if scrolls_realizados % 3 == 0 and browser_manager.page.is_closed():
-                if not await browser_manager.verificar_y_recrear():
-                    logger.error(f"❌ Navegador no disponible en scroll {scrolls_realizados}")
-                    break
-            
-            try:
-                items = await extraer_items_pagina(browser_manager.page)
-                urls_nuevas = []
-                
-                for itm in items:
-                    url = limpiar_link(itm["url"])
-                    contador["total"] += 1
-
-                    if url and url.startswith("https://www.facebook.com/marketplace/item/") and url not in vistos_globales:
-                        urls_nuevas.append(url)
-
-                urls_pendientes.extend(urls_nuevas)
-                
-                if len(urls_pendientes) >= BATCH_SIZE_SCROLL or scrolls_realizados >= MAX_SCROLLS_POR_SORT - 1:
-                    if urls_pendientes:
-                        lote_actual = urls_pendientes[:BATCH_SIZE_SCROLL]
-                        urls_pendientes = urls_pendientes[BATCH_SIZE_SCROLL:]
-                        
-                        nuevos_en_lote = await procesar_lote_urls(
-                            browser_manager, lote_actual, modelo, vistos_globales,
-                            contador, procesados, potenciales, relevantes, sin_anio_ejemplos
-                        )
-                        
-                        nuevos_total += nuevos_en_lote
-                        
-                        if nuevos_en_lote == 0:
-                            consec_repetidos += 1
-                        else:
-                            consec_repetidos = 0
-
-            except Exception as e:
-                logger.warning(f"Error en scroll {scrolls_realizados}: {e}")
-
-            scrolls_realizados += 1
-            
-            if consec_repetidos >= MAX_CONSECUTIVOS_SIN_NUEVOS and len(urls_nuevas) < 2:
+            if scroll % 3 == 0 and page.is_closed():
+                if not await self.browser_manager.verificar_y_recrear():
+                    logger.error(f"❌ Navegador no disponible en scroll {scroll}")
+                    return
+                page = self.browser_manager.page
+
+            nuevos = 0
+            for itm in await extraer_items_pagina(page):
+                url = limpiar_link(itm["url"])
+                contador["total"] += 1
+                if not url or not url.startswith("https://www.facebook.com/marketplace/item/"):
+                    continue
+                self.urls_vistas.add(url)
+                if url in vistos_en_busqueda:
+                    continue
+                vistos_en_busqueda.add(url)
+                if url in vistos:
+                    contador["duplicado"] += 1
+                    continue
+                vistos.add(url)
+                nuevos += 1
+                yield url
+
+            consec_sin_nuevos = 0 if nuevos else consec_sin_nuevos + 1
+            if consec_sin_nuevos >= MAX_CONSECUTIVOS_SIN_NUEVOS:
                 logger.info(f"🔄 Salida temprana en {sort}")
-                break
-                
-            if not await scroll_hasta(browser_manager.page):
-                logger.info(f"🔄 Fin de contenido en {sort}")
-                break
+                return
 
-        if urls_pendientes:
-            await procesar_lote_urls(
-                browser_manager, urls_pendientes, modelo, vistos_globales,
-                contador, procesados, potenciales, relevantes, sin_anio_ejemplos
-            )
-
-        return nuevos_total
-        
-    except Exception as e:
-        logger.error(f"❌ Error en ordenamiento {sort}: {e}")
-        return 0
-
-async def procesar_modelo(
-    browser_manager: BrowserManager,
-    modelo: str,
-    procesados: List[str],
-    potenciales: List[str],
-    relevantes: List[str]
-) -> int:
-    """Procesa un modelo específico con todos los ordenamientos"""
-    
-    vistos_globales = set()
-    sin_anio_ejemplos = []
-    contador = {k: 0 for k in [
-        "total", "duplicado", "negativo", "sin_precio", "sin_anio",
-        "filtro_modelo", "guardado", "precio_bajo", "extranjero",
-        "actualizados", "repetidos", "error", "timeout", "texto_insuficiente",
-        "error_procesamiento", "error_db", "error_general", "texto_vacio"
-    ]}
-    
-    SORT_OPTS = ["best_match", "price_asc"]
-    inicio = datetime.now()
-    total_nuevos = 0
-
-    for sort in SORT_OPTS:
-        # Verificación única al inicio de cada ordenamiento
-        if browser_manager.page.is_closed():
-            if not await browser_manager.verificar_y_recrear():
-                logger.error(f"❌ No se pudo recuperar navegador para {sort}")
-                break
-        
-        logger.info(f"🔍 Procesando {modelo} con ordenamiento: {sort}")
+            if not await scroll_hasta(page):
+                logger.info(f"🔄 Fin de contenido en {sort}")
+                return
+
+    # --- Fetch -------------------------------------------------------------
+
+    async def _pagina_fetch(self, worker: int) -> Page:
+        """Cada worker de fetch navega en su propia página del contexto"""
+        page = self._paginas_fetch.get(worker)
+        if page is None or page.is_closed():
+            page = await self.browser_manager.context.new_page()
+            await page.set_extra_http_headers({'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8'})
+            self._paginas_fetch[worker] = page
+        return page
+
+    async def fetch(self, tarea: TareaAnuncio, worker: int) -> Optional[TareaAnuncio]:
+        """Abre el anuncio y obtiene su texto, o el análisis guardado si no cambió"""
+        contador = self.contadores[tarea.modelo]
+        page = await self._pagina_fetch(worker)
         try:
-            nuevos_sort = await asyncio.wait_for(
-                procesar_ordenamiento_optimizado(
-                    browser_manager, modelo, sort, vistos_globales, contador,
-                    procesados, potenciales, relevantes, sin_anio_ejemplos
-                ),
-                timeout=180
-            )
-            total_nuevos += nuevos_sort
-            logger.info(f"✅ {sort}: {nuevos_sort} nuevos anuncios")
-            
-            if sort != SORT_OPTS[-1]:
-                await asyncio.sleep(random.uniform(3.0, 5.0))
-            
+            await asyncio.wait_for(page.goto(tarea.url, wait_until='domcontentloaded'), timeout=15)
+            await asyncio.sleep(random.uniform(1.5, 2.5))
         except asyncio.TimeoutError:
-            logger.warning(f"⏳ Timeout en {sort} para {modelo}")
-            continue
+            logger.warning(f"⏳ Timeout navegando a {tarea.url}")
+            contador["timeout"] += 1
+            return None
         except Exception as e:
-            logger.error(f"❌ Error en {sort} para {modelo}: {e}")
-            continue
+            logger.warning(f"Error navegando a {tarea.url}: {e}")
+            contador["error"] += 1
+            return None
+
+        await asyncio.sleep(DELAY_ENTRE_ANUNCIOS)
+        texto = (await extraer_texto_anuncio(page, tarea.url)).strip()
+        if len(texto) < 10:
+            contador["texto_insuficiente"] += 1
+            return None
+
+        # Si el texto no cambió desde la última visita y la referencia de precios
+        # sigue igual, se reutiliza el análisis guardado sin recalcular nada. Solo
+        # si es del mismo link y sigue en `anuncios`: un anuncio republicado con
+        # otro link o uno archivado que reaparece se analizan y se guardan
+        tarea.hash_contenido = hash_contenido_anuncio(texto, f"scraper:{tarea.modelo}")
+        previo = await en_db(obtener_analisis_cache, tarea.hash_contenido)
+        if previo and previo.link == tarea.url and await en_db(existe_en_db, tarea.url):
+            tarea.anuncio = previo
+            tarea.estado = "cache"
+            return tarea
+
+        tarea.texto = TextoAnuncio(texto)
+
+        # La descripción truncada suele esconder el año: se expande mientras
+        # la página sigue abierta, solo si el anuncio es del modelo buscado
+        if await en_analisis(necesita_expandir, tarea.texto, tarea.modelo):
+            texto_expandido = await expandir_descripcion(page)
+            if texto_expandido:
+                expandido = TextoAnuncio(texto_expandido)
+                if await en_analisis(anio_valido_en, expandido):
+                    tarea.texto = expandido
+        return tarea
+
+    # --- Analizar ----------------------------------------------------------
+
+    async def analizar(self, tarea: TareaAnuncio, worker: int) -> Optional[TareaAnuncio]:
+        if tarea.anuncio is not None:
+            return tarea
+        contador = self.contadores[tarea.modelo]
+        try:
+            tarea.anuncio, motivo = await en_analisis(
+                analizar_anuncio_scraper, tarea.texto, tarea.url, tarea.modelo
+            )
+        except Exception as e:
+            logger.error(f"Error en analizar_anuncio_scraper: {e}")
+            contador["error_general"] += 1
+            return None
+
+        if motivo:
+            contador[motivo] += 1
+            if motivo == "sin_anio" and len(self.sin_anio_ejemplos) < MAX_EJEMPLOS_SIN_ANIO:
+                self.sin_anio_ejemplos.append((tarea.texto.original, tarea.url))
+            return None
+        return tarea
+
+    # --- Persistir ---------------------------------------------------------
+
+    async def persistir(self, tarea: TareaAnuncio, worker: int) -> Optional[TareaAnuncio]:
+        contador = self.contadores[tarea.modelo]
+        if tarea.estado == "cache":
+            contador["cache"] += 1
+            contador["repetidos"] += 1
+            return tarea
+
+        anuncio = tarea.anuncio
+        try:
+            tarea.estado = await en_db(persistir_anuncio, anuncio, tarea.hash_contenido)
+        except Exception as e:
+            logger.error(f"Error en DB para {anuncio.link}: {e}")
+            contador["error_db"] += 1
+            return None
+
+        if tarea.estado == "actualizado":
+            logger.info(f"🔄 Actualizado: {anuncio.modelo} | ROI={anuncio.roi:.2f}% | Score={anuncio.score}")
+            contador["actualizados"] += 1
+        elif tarea.estado == "nuevo":
+            logger.info(f"💾 Guardado nuevo: {anuncio.modelo} | ROI={anuncio.roi:.2f}% | Score={anuncio.score}")
+            contador["guardado"] += 1
+        else:
+            contador["repetidos"] += 1
+        return tarea
 
-    duracion = (datetime.now() - inicio).seconds
-    
-    logger.info(f"""
+    # --- Notificar ---------------------------------------------------------
+
+    async def notificar(self, tarea: TareaAnuncio, worker: int) -> None:
+        resultado = ResultadoScraping(tarea.anuncio, tarea.estado)
+        self.resultados.append(resultado)
+        if resultado.anuncio.relevante:
+            self.relevantes_por_modelo[tarea.modelo] += 1
+        if self.al_notificar:
+            try:
+                await self.al_notificar(resultado)
+            except Exception as e:
+                logger.warning(f"Error notificando {resultado.anuncio.link}: {e}")
+
+    def descartados(self) -> Dict[str, int]:
+        """Anuncios descartados por el análisis, por motivo, sumando todos los modelos"""
+        return {
+            etiqueta: sum(contador[motivo] for contador in self.contadores.values())
+            for motivo, etiqueta in MOTIVOS_DESCARTE.items()
+        }
+
+    def resumen_modelos(self):
+        for modelo in self.modelos:
+            contador = self.contadores[modelo]
+            logger.info(f"""
 ✨ MODELO: {modelo.upper()}
-   Duración: {duracion}s | Guardados: {contador['guardado']} | Relevantes: {len([r for r in relevantes if modelo.lower() in r.lower()])}
-   Filtrados: Duplicados={contador['duplicado']}, Sin año={contador['sin_anio']}, Precio bajo={contador['precio_bajo']}
+   Guardados: {contador['guardado']} | Actualizados: {contador['actualizados']} | Relevantes: {self.relevantes_por_modelo[modelo]}
+   Filtrados: Duplicados={contador['duplicado']}, Sin año={contador['sin_anio']}, Precio bajo={contador['precio_bajo']}, Precio incoherente={contador['precio_incoherente']}
+   Reutilizados de caché: {contador['cache']}
    ✨""")
 
-    return total_nuevos
-
-async def buscar_autos_marketplace(modelos_override: Optional[List[str]] = None) -> Tuple[List[str], List[str], List[str]]:
-    """Función principal de búsqueda en Marketplace"""
+def analizar_anuncio_scraper(
+    texto_anuncio: TextoAnuncio,
+    url: str,
+    modelo: str
+) -> Tuple[Optional[Anuncio], Optional[str]]:
+    """
+    Aplica los filtros del scraper y arma el Anuncio. Retorna (anuncio, None)
+    o (None, motivo de descarte). Es síncrona: corre en el pool de análisis.
+    """
+    if not coincide_modelo(texto_anuncio, modelo):
+        return None, "filtro_modelo"
+
+    motivos = clasificar_texto(texto_anuncio)
+    if "negativo" in motivos:
+        return None, "negativo"
+
+    if "extranjero" in motivos:
+        return None, "extranjero"
+
+    precio = extraer_precio(texto_anuncio, solo_moneda=True)
+    if not precio:
+        return None, "sin_precio"
+
+    if precio < MIN_PRECIO_VALIDO:
+        return None, "precio_bajo"
+
+    resolucion = resolver_anio(texto_anuncio)
+    anio = resolucion.anio
+    if not anio_valido(anio):
+        return None, "sin_anio"
+
+    if not validar_precio_coherente(precio, modelo, anio, texto_anuncio):
+        return None, "precio_incoherente"
+
+    roi_data = calcular_roi_real(modelo, precio, anio)
+    anuncio = Anuncio(
+        link=url,
+        modelo=modelo,
+        anio=anio,
+        precio=precio,
+        roi=roi_data["roi"],
+        confianza_precio=roi_data["confianza"],
+        muestra_precio=roi_data["muestra"],
+        fuente_anio=resolucion.fuente,
+        texto=texto_anuncio,
+        roi_data=roi_data
+    )
+    anuncio.score = puntuar_anuncio(anuncio)
+    anuncio.relevante = anuncio.score >= SCORE_MIN_TELEGRAM and anuncio.roi >= ROI_MINIMO
+    return anuncio, None
+
+def necesita_expandir(texto_anuncio: TextoAnuncio, modelo: str) -> bool:
+    """El anuncio es del modelo buscado pero el texto visible no trae un año válido"""
+    return not anio_valido(extraer_anio(texto_anuncio)) and coincide_modelo(texto_anuncio, modelo)
+
+def anio_valido_en(texto_anuncio: TextoAnuncio) -> bool:
+    return anio_valido(extraer_anio(texto_anuncio))
+
+def persistir_anuncio(anuncio: Anuncio, hash_contenido: str) -> str:
+    """Inserta o actualiza el anuncio y su análisis; retorna nuevo/actualizado/repetido"""
+    if existe_en_db(anuncio.link):
+        if not anuncio_diferente(anuncio, obtener_anuncio_db(anuncio.link)):
+            estado = "repetido"
+        else:
+            guardar_anuncio_db(anuncio)
+            estado = "actualizado"
+    else:
+        guardar_anuncio_db(anuncio)
+        estado = "nuevo"
+    guardar_analisis_cache(hash_contenido, anuncio)
+    return estado
+
+async def buscar_autos_marketplace(
+    modelos_override: Optional[List[str]] = None,
+    al_notificar: Optional[Notificador] = None,
+    timeout: float = TIMEOUT_SCRAPING,
+    descartados: Optional[Dict[str, int]] = None
+) -> List[ResultadoScraping]:
+    """
+    Función principal de búsqueda en Marketplace. Retorna cada anuncio
+    analizado con su ROI, score, procedencia del año y estado en la base.
+    `al_notificar` se llama con cada resultado apenas se guarda, sin esperar
+    a que termine la corrida. Si se pasa `descartados`, se llena con los
+    anuncios que el análisis descartó, por motivo (ver MOTIVOS_DESCARTE).
+    Lanza SesionInvalida si Facebook pide login.
+    """
     
     try:
         inicializar_tabla_anuncios()
@@ -674,7 +759,7 @@ async def buscar_autos_marketplace(modelos_override: Optional[List[str]] = None)
             logger.warning("⚠️ No hay modelos activos por rendimiento. Usando todos.")
             activos = modelos
 
-        procesados, potenciales, relevantes = [], [], []
+        from playwright.async_api import async_playwright
 
         async with async_playwright() as p:
             browser_manager = BrowserManager(p)
@@ -691,54 +776,54 @@ async def buscar_autos_marketplace(modelos_override: Optional[List[str]] = None)
                 if "login" in browser_manager.page.url or "recover" in browser_manager.page.url:
                     alerta = "🚨 Sesión inválida. Verifica FB_COOKIES_JSON."
                     logger.warning(alerta)
-                    return [], [], [alerta]
+                    raise SesionInvalida(alerta)
 
                 logger.info("✅ Sesión activa en Marketplace.")
 
                 modelos_shuffled = activos.copy()
                 random.shuffle(modelos_shuffled)
 
-                for i, m in enumerate(modelos_shuffled):
-                    if not await browser_manager.verificar_y_recrear():
-                        logger.error(f"❌ No se pudo recuperar navegador para {m}")
-                        break
-                    
-                    logger.info(f"📋 Modelo {i+1}/{len(modelos_shuffled)}: {m}")
-                    try:
-                        await asyncio.wait_for(
-                            procesar_modelo(browser_manager, m, procesados, potenciales, relevantes),
-                            timeout=300
-                        )
-                        
-                        if i < len(modelos_shuffled) - 1:
-                            await asyncio.sleep(random.uniform(8.0, 12.0))
-                            
-                    except asyncio.TimeoutError:
-                        logger.warning(f"⏳ {m} → Timeout")
-                    except Exception as e:
-                        logger.error(f"❌ Error en {m}: {e}")
+                corrida = CorridaMarketplace(browser_manager, modelos_shuffled, al_notificar)
+                await corrida.ejecutar(timeout)
+                corrida.resumen_modelos()
+                if descartados is not None:
+                    descartados.update(corrida.descartados())
 
             finally:
                 await browser_manager.cerrar()
+                cerrar_ejecutores()
 
-        return procesados, potenciales, relevantes
-        
+        cache = estadisticas_cache_anios()
+        logger.info(
+            f"🗃️ Caché años: {cache['anios']['aciertos']} aciertos / {cache['anios']['fallos']} fallos | "
+            f"Caché correcciones: {cache['correcciones']['aciertos']} aciertos / {cache['correcciones']['fallos']} fallos"
+        )
+        for nombre, segundos in tiempos_inicializacion().items():
+            logger.info(f"⏱️ Inicialización {nombre}: {segundos * 1000:.1f} ms")
+
+        return corrida.resultados
+
+    except SesionInvalida:
+        raise
     except Exception as e:
         logger.error(f"❌ Error general: {e}")
-        return [], [], [f"🚨 Error: {str(e)}"]
+        return []
 
 if __name__ == "__main__":
     async def main():
         try:
-            procesados, potenciales, relevantes = await buscar_autos_marketplace()
+            limpiar_cache_rendimiento()
+            resultados = await buscar_autos_marketplace()
+            relevantes = [r.anuncio for r in resultados if r.anuncio.relevante]
+            potenciales = [r.anuncio for r in resultados if es_potencial(r.anuncio)]
 
             logger.info("📦 Resumen final")
-            logger.info(f"Guardados: {len(procesados)} | Relevantes: {len(relevantes)} | Potenciales: {len(potenciales)}")
+            logger.info(f"Guardados: {len(resultados)} | Relevantes: {len(relevantes)} | Potenciales: {len(potenciales)}")
 
             if relevantes:
                 logger.info("\n🟢 Relevantes:")
-                for r in relevantes[:10]:
-                    logger.info(r.replace("*", "").replace("\\n", "\n"))
+                for anuncio in relevantes[:10]:
+                    logger.info(anuncio.mensaje_telegram.replace("*", ""))
                 
         except Exception as e:
             logger.error(f"❌ Error en main: {e}")
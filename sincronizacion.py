@@ -0,0 +1,332 @@
+"""
+sincronizacion.py - Sincronización incremental de la base entre corridas
+
+En vez de guardar la base completa en cada corrida, el branch de datos guarda:
+
+    base.db                       snapshot compactado (VACUUM INTO)
+    deltas/delta-<UTC>.jsonl.gz   filas insertadas o modificadas, links borrados,
+                                  anuncios vistos y entradas nuevas de analisis_cache
+
+Captura de cambios:
+- `anuncios.updated_at` lo ponen triggers al insertar o modificar una fila.
+  Si la escritura ya trae su propio updated_at (el importador), se respeta.
+- `ultimo_visto` no cuenta como modificación: marcar_vistos lo actualiza en
+  casi todos los anuncios de cada corrida y reenviar esas filas completas (y
+  reescribir el snapshot Parquet) no tiene sentido. Viaja aparte, como pares
+  (link, fecha) de los anuncios vistos desde el día de la marca.
+- `anuncios_borrados` registra los links eliminados y cuándo.
+- `meta.sync_marca` es el momento de la última sincronización: exportar toma
+  todo lo que cambió desde entonces. Las demás claves de `meta` (p. ej. las
+  fechas de mantenimiento de archivo.py) viajan completas en cada delta.
+- `analisis_cache` solo tiene la fecha (día) de cada entrada: viajan las de
+  los días desde la marca. Repetir una entrada es inofensivo y al importarla
+  se borran las demás del mismo link, como en guardar_analisis_cache.
+
+Importar aplica los deltas posteriores al último incluido en la base
+(`meta.sync_ultimo_delta`) en orden; aplicar un delta dos veces no cambia
+nada. Cada COMPACTAR_CADA deltas se escribe una base nueva y se borran los
+deltas, así la sincronización cuesta lo que cambió en el día y no el historial.
+
+Uso:
+    python sincronizacion.py importar --dir data [--db RUTA]
+    python sincronizacion.py exportar --dir data [--db RUTA] [--compactar]
+"""
+
+import os
+import glob
+import gzip
+import json
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+VERSION_DELTA = 1
+COMPACTAR_CADA = int(os.environ.get("SYNC_COMPACTAR_CADA", "30"))  # deltas antes de una base nueva
+BASE = "base.db"
+DIR_DELTAS = "deltas"
+
+# Milisegundos: varias escrituras por segundo deben quedar ordenadas
+AHORA_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+# Columnas cuya escritura no marca la fila como modificada
+SIN_CAPTURA = ("updated_at", "ultimo_visto")
+
+def _sql_trigger_update(columnas: List[str]) -> str:
+    # Solo las columnas de datos. La condición evita la recursión y deja pasar
+    # el updated_at que trae el importador.
+    vigiladas = ", ".join(f'"{c}"' for c in columnas if c not in SIN_CAPTURA)
+    return f"""CREATE TRIGGER trg_sync_update AFTER UPDATE OF {vigiladas} ON anuncios
+        WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE anuncios SET updated_at = {AHORA_SQL} WHERE rowid = NEW.rowid;
+        END"""
+
+def crear_captura(conn: sqlite3.Connection):
+    """Tabla de borrados, índice de updated_at y triggers de captura (idempotente)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS anuncios_borrados (
+            link TEXT PRIMARY KEY,
+            borrado_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_anuncios_updated_at ON anuncios(updated_at)")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sync_insert AFTER INSERT ON anuncios
+        BEGIN
+            UPDATE anuncios SET updated_at = {AHORA_SQL}
+            WHERE rowid = NEW.rowid AND NEW.updated_at IS NULL;
+            DELETE FROM anuncios_borrados WHERE link = NEW.link;
+        END
+    """)
+    # La lista de columnas se fija al crear el trigger: se recrea si cambió
+    # (columnas nuevas, o bases con el trigger anterior sin `OF columnas`)
+    sql_update = _sql_trigger_update(_columnas(conn))
+    actual = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_sync_update'"
+    ).fetchone()
+    if actual is None or actual[0] != sql_update:
+        conn.execute("DROP TRIGGER IF EXISTS trg_sync_update")
+        conn.execute(sql_update)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sync_delete AFTER DELETE ON anuncios
+        BEGIN
+            INSERT INTO anuncios_borrados (link, borrado_at) VALUES (OLD.link, {AHORA_SQL})
+            ON CONFLICT(link) DO UPDATE SET borrado_at = excluded.borrado_at;
+        END
+    """)
+
+def _leer_meta(conn: sqlite3.Connection, clave: str) -> Optional[str]:
+    fila = conn.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+    return fila[0] if fila else None
+
+def _guardar_meta(conn: sqlite3.Connection, clave: str, valor: str):
+    conn.execute(
+        "INSERT INTO meta (clave, valor) VALUES (?, ?) ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+        (clave, valor)
+    )
+
+def _ahora(conn: sqlite3.Connection) -> str:
+    return conn.execute(f"SELECT {AHORA_SQL}").fetchone()[0]
+
+def _columnas(conn: sqlite3.Connection) -> List[str]:
+    return [fila[1] for fila in conn.execute("PRAGMA table_info(anuncios)")]
+
+def _deltas(directorio: str) -> List[str]:
+    # Los nombres llevan la fecha UTC: el orden alfabético es el cronológico
+    return sorted(glob.glob(os.path.join(directorio, DIR_DELTAS, "delta-*.jsonl.gz")))
+
+def marcar_sincronizada(conn: sqlite3.Connection):
+    """Lo cambiado hasta ahora ya está en el branch de datos"""
+    _guardar_meta(conn, "sync_marca", _ahora(conn))
+
+def exportar_delta(conn: sqlite3.Connection, directorio: str) -> Optional[str]:
+    """
+    Escribe las filas cambiadas, los borrados, los anuncios vistos y la caché
+    de análisis desde la última marca; None si no hubo cambios.
+    """
+    marca = _leer_meta(conn, "sync_marca") or ""
+    # La marca nueva se toma antes de leer: lo que cambie durante la exportación
+    # vuelve a salir en el próximo delta (aplicarlo dos veces es inofensivo)
+    nueva_marca = _ahora(conn)
+    columnas = _columnas(conn)
+
+    filas = conn.execute(
+        f"SELECT {', '.join(columnas)} FROM anuncios WHERE updated_at >= ? ORDER BY updated_at",
+        (marca,)
+    ).fetchall()
+    borrados = conn.execute(
+        "SELECT link, borrado_at FROM anuncios_borrados WHERE borrado_at >= ? ORDER BY borrado_at",
+        (marca,)
+    ).fetchall()
+    vistos = []
+    if "ultimo_visto" in columnas:
+        # Solo se sabe el día: viajan los vistos desde el día de la marca. Las
+        # filas que salen completas ya llevan su ultimo_visto
+        vistos = conn.execute(
+            "SELECT link, ultimo_visto FROM anuncios "
+            "WHERE ultimo_visto >= substr(?, 1, 10) AND (updated_at IS NULL OR updated_at < ?)",
+            (marca, marca)
+        ).fetchall()
+    caches = []
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'analisis_cache'").fetchone():
+        caches = conn.execute(
+            "SELECT hash_contenido, link, version_referencia, resultado, fecha FROM analisis_cache "
+            "WHERE fecha >= substr(?, 1, 10)",
+            (marca,)
+        ).fetchall()
+    # Estado local de la base (sync_* y version_* se calculan en cada copia)
+    metas = conn.execute("""
+        SELECT clave, valor FROM meta
+        WHERE substr(clave, 1, 5) != 'sync_' AND substr(clave, 1, 8) != 'version_'
+    """).fetchall()
+
+    ruta = None
+    if filas or borrados or vistos or caches:
+        os.makedirs(os.path.join(directorio, DIR_DELTAS), exist_ok=True)
+        nombre = f"delta-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}.jsonl.gz"
+        ruta = os.path.join(directorio, DIR_DELTAS, nombre)
+        with gzip.open(ruta + ".tmp", "wt", encoding="utf-8") as f:
+            cabecera = {
+                "version": VERSION_DELTA, "desde": marca, "hasta": nueva_marca,
+                "columnas": columnas, "filas": len(filas), "borrados": len(borrados),
+                "vistos": len(vistos), "cache": len(caches)
+            }
+            f.write(json.dumps(cabecera, ensure_ascii=False) + "\n")
+            for fila in filas:
+                f.write(json.dumps({"fila": fila}, ensure_ascii=False) + "\n")
+            for link, borrado_at in borrados:
+                f.write(json.dumps({"borrado": link, "at": borrado_at}, ensure_ascii=False) + "\n")
+            for link, visto in vistos:
+                f.write(json.dumps({"visto": link, "fecha": visto}, ensure_ascii=False) + "\n")
+            for entrada in caches:
+                f.write(json.dumps({"cache": entrada}, ensure_ascii=False) + "\n")
+            for clave, valor in metas:
+                f.write(json.dumps({"meta": clave, "valor": valor}, ensure_ascii=False) + "\n")
+        os.replace(ruta + ".tmp", ruta)
+        print(f"📤 Delta {nombre}: {len(filas)} filas, {len(borrados)} borrados, {len(vistos)} vistos, "
+              f"{len(caches)} análisis en caché")
+
+    _guardar_meta(conn, "sync_marca", nueva_marca)
+    conn.commit()
+    return ruta
+
+def aplicar_delta(conn: sqlite3.Connection, ruta: str) -> Dict[str, int]:
+    """Aplica un delta en una transacción: UPSERT de filas y caché, DELETE de borrados, UPDATE de vistos"""
+    locales = set(_columnas(conn))
+    totales = {"filas": 0, "borrados": 0, "vistos": 0, "cache": 0}
+    with gzip.open(ruta, "rt", encoding="utf-8") as f, conn:
+        cabecera = json.loads(f.readline())
+        if cabecera.get("version") != VERSION_DELTA:
+            raise ValueError(f"Versión de delta no soportada en {ruta}: {cabecera.get('version')}")
+
+        # Solo las columnas que existen en ambos lados, en el orden del delta
+        indices = [i for i, c in enumerate(cabecera["columnas"]) if c in locales]
+        columnas = [cabecera["columnas"][i] for i in indices]
+        if "link" not in columnas or "updated_at" not in columnas:
+            raise ValueError(f"Delta sin link o updated_at: {ruta}")
+        sql = (
+            f"INSERT INTO anuncios ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))}) "
+            f"ON CONFLICT(link) DO UPDATE SET "
+            + ", ".join(f"{c} = excluded.{c}" for c in columnas if c != "link")
+            # Gana la versión más reciente: reaplicar un delta no toca nada
+            + " WHERE anuncios.updated_at IS NULL OR excluded.updated_at > anuncios.updated_at"
+        )
+
+        for linea in f:
+            registro = json.loads(linea)
+            if "fila" in registro:
+                conn.execute(sql, [registro["fila"][i] for i in indices])
+                totales["filas"] += 1
+            elif "borrado" in registro:
+                conn.execute("DELETE FROM anuncios WHERE link = ?", (registro["borrado"],))
+                totales["borrados"] += 1
+            elif "visto" in registro:
+                if "ultimo_visto" in locales:
+                    # No dispara trg_sync_update (ver SIN_CAPTURA)
+                    conn.execute(
+                        "UPDATE anuncios SET ultimo_visto = ? "
+                        "WHERE link = ? AND (ultimo_visto IS NULL OR ultimo_visto < ?)",
+                        (registro["fecha"], registro["visto"], registro["fecha"])
+                    )
+                totales["vistos"] += 1
+            elif "cache" in registro:
+                hash_contenido, link, *_ = registro["cache"]
+                if link:
+                    conn.execute(
+                        "DELETE FROM analisis_cache WHERE link = ? AND hash_contenido != ?", (link, hash_contenido)
+                    )
+                conn.execute("""
+                    INSERT OR REPLACE INTO analisis_cache
+                    (hash_contenido, link, version_referencia, resultado, fecha) VALUES (?, ?, ?, ?, ?)
+                """, registro["cache"])
+                totales["cache"] += 1
+            elif "meta" in registro:
+                _guardar_meta(conn, registro["meta"], registro["valor"])
+    return totales
+
+def compactar(conn: sqlite3.Connection, directorio: str):
+    """Escribe una base nueva con VACUUM INTO y borra los deltas que ya incluye"""
+    deltas = _deltas(directorio)
+    if deltas:
+        _guardar_meta(conn, "sync_ultimo_delta", os.path.basename(deltas[-1]))
+    conn.commit()
+
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, BASE)
+    temporal = destino + ".tmp"
+    if os.path.exists(temporal):
+        os.remove(temporal)
+    conn.execute("VACUUM INTO ?", (temporal,))
+    os.replace(temporal, destino)
+    for ruta in deltas:
+        os.remove(ruta)
+    print(f"🗜️ Base compactada en {destino} ({os.path.getsize(destino)} bytes), {len(deltas)} deltas integrados")
+
+def importar(directorio: str, db_path: str) -> Dict[str, int]:
+    """
+    Reconstruye la base local desde base.db y los deltas posteriores. Sin
+    base.db usa anuncios.db (formato anterior) si existe.
+    """
+    totales = {"deltas": 0, "filas": 0, "borrados": 0, "vistos": 0, "cache": 0}
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    base = os.path.join(directorio, BASE)
+    anterior = os.path.join(directorio, "anuncios.db")
+    if os.path.exists(base):
+        shutil.copyfile(base, db_path)
+    elif os.path.exists(anterior):
+        print("ℹ️ Sin base.db: se parte de anuncios.db y se compactará al exportar")
+        shutil.copyfile(anterior, db_path)
+
+    # Columnas, triggers de resúmenes y de captura
+    import utils_analisis
+    utils_analisis.DB_PATH = os.path.abspath(db_path)
+    utils_analisis.inicializar_tabla_anuncios()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        ultimo = _leer_meta(conn, "sync_ultimo_delta") or ""
+        for ruta in _deltas(directorio):
+            if os.path.basename(ruta) <= ultimo:
+                continue
+            aplicado = aplicar_delta(conn, ruta)
+            totales["deltas"] += 1
+            totales["filas"] += aplicado["filas"]
+            totales["borrados"] += aplicado["borrados"]
+            totales["vistos"] += aplicado["vistos"]
+            totales["cache"] += aplicado["cache"]
+        marcar_sincronizada(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"📥 Base lista: {totales['deltas']} deltas aplicados ({totales['filas']} filas, {totales['borrados']} borrados, "
+          f"{totales['vistos']} vistos, {totales['cache']} análisis en caché)")
+    return totales
+
+def exportar(directorio: str, db_path: str, forzar_compactacion: bool = False) -> Optional[str]:
+    """Exporta el delta de la corrida y compacta si toca (o si no hay base.db todavía)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        ruta = exportar_delta(conn, directorio)
+        pendientes = len(_deltas(directorio))
+        if forzar_compactacion or pendientes >= COMPACTAR_CADA or not os.path.exists(os.path.join(directorio, BASE)):
+            compactar(conn, directorio)
+    finally:
+        conn.close()
+    return ruta
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincronización incremental de la base de anuncios")
+    parser.add_argument("accion", choices=("importar", "exportar"))
+    parser.add_argument("--dir", required=True, help="Directorio del branch de datos")
+    parser.add_argument("--db", default=os.environ.get("DB_PATH", "upload-artifact/anuncios.db"),
+                        help="Base local de trabajo")
+    parser.add_argument("--compactar", action="store_true", help="Escribir una base nueva al exportar")
+    args = parser.parse_args()
+
+    if args.accion == "importar":
+        importar(args.dir, args.db)
+    else:
+        exportar(args.dir, args.db, args.compactar)
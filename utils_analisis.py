@@ -1,13 +1,24 @@
 import os
 import re
+import json
 import sqlite3
 import time
-import unicodedata
 import statistics
+import bisect
+import functools
 from datetime import datetime
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Union, FrozenSet
 from contextlib import contextmanager
-from correcciones import obtener_correccion
+from arranque import perezoso
+from resumenes import crear_resumenes
+from sincronizacion import crear_captura
+from historial_precios import crear_historial
+from cuantiles import crear_sketches, consolidar_sketches, sketch_ventana, sketches_modelo
+from anuncio import Anuncio, ResolucionAño, TextoAnuncio, TokenNumerico, Texto
+from correcciones import (
+    obtener_correccion_con_fuente, CacheLRU, hash_texto, version_correcciones, huella_correcciones,
+    estadisticas_cache_correcciones, SIN_VALOR
+)
 
 def escapar_multilinea(texto: str) -> str:
     return re.sub(r'([_*\[\]()~`>#+=|{}.!\\-])', r'\\\1', texto)
@@ -28,18 +39,31 @@ MUESTRA_MINIMA_ASIGNACION_AÑO = 30
 CURRENT_YEAR = datetime.now().year
 MIN_YEAR = 1980
 MAX_YEAR = CURRENT_YEAR + 1
-
-# Configuración de pesos para calcular_score
-WEIGHT_MODEL      = 120
-WEIGHT_TITLE      = 110
-WEIGHT_WINDOW     =  95
-WEIGHT_GENERAL    =  70
-
-PENALTY_INVALID   = -50
-BONUS_VEHICULO    =  20
-BONUS_PRECIO_HIGH =  15
-PENALTY_FUTURO    = -60
-BONUS_CONTEXTO_FUERTE = 25
+MAX_CACHE_ANIOS = 4096
+# Subir cuando cambie la lógica de análisis para invalidar la caché persistente
+VERSION_ANALISIS = 2
+
+# Configuración de puntuar_anuncio (también la usa recalculo.py en lote)
+SCORE_BASE              =  50
+PENALTY_NEGATIVO        = -40
+PENALTY_EXTRANJERO      = -30
+PENALTY_INVALID         = -50   # precio incoherente con el año (validar_precio_coherente)
+PENALTY_FUTURO          = -60   # año posterior al actual
+BONUS_CONTEXTO_FUERTE   =  25   # texto con contexto vehicular
+BONUS_CALIDAD           =  15
+BONUS_ROI_DOBLE         =  30   # ROI ≥ 2 × ROI_MINIMO
+BONUS_ROI               =  20   # ROI ≥ ROI_MINIMO
+BONUS_BAJO_REFERENCIA   =  25   # precio < FACTOR_BAJO_REFERENCIA × referencia
+FACTOR_BAJO_REFERENCIA  = 0.7
+BONUS_PRECIO_HIGH       =  15   # referencia de confianza alta
+BONUS_CONFIANZA_MEDIA   =  10
+PENALTY_CONFIANZA_BAJA  = -20   # confianza baja y ROI < ROI_CONFIANZA_BAJA
+ROI_CONFIANZA_BAJA      = 5
+BONUS_TEXTO_LARGO       =  10   # más de TEXTO_LARGO caracteres
+PENALTY_TEXTO_CORTO     = -10   # menos de TEXTO_CORTO caracteres
+TEXTO_LARGO             = 300
+TEXTO_CORTO             = 50
+COSTO_EXTRA             = 2000  # traspaso y arreglos que se suman a la inversión
 
 PRECIOS_POR_DEFECTO = {
     "yaris": 45000, "civic": 65000, "corolla": 50000, "sentra": 42000,
@@ -63,6 +87,25 @@ LUGARES_EXTRANJEROS = [
     "honduras", "el salvador", "panamá", "costa rica", "colombia", "ecuador"
 ]
 
+PALABRAS_VEHICULARES = [
+    "modelo", "año", "del año", "versión", "m/", "vehículo", "carro", "auto", "motor",
+    "transmisión", "automático", "mecánico", "standard", "gasolina", "diésel"
+]
+
+PALABRAS_CALIDAD = [
+    "vehículo", "automático", "standard", "papeles al día",
+    "excelente estado", "poco kilometraje", "original"
+]
+
+# Código de motivo → términos. Se comparan sin acentos, con límites de palabra
+# y admitiendo plural, en una sola pasada (ver clasificar_texto)
+CATEGORIAS_PALABRAS = {
+    "negativo": PALABRAS_NEGATIVAS,
+    "extranjero": LUGARES_EXTRANJEROS,
+    "vehicular": PALABRAS_VEHICULARES,
+    "calidad": PALABRAS_CALIDAD,
+}
+
 # Patrones precompilados
 _PATTERN_YEAR_FULL = re.compile(r"\b(19[8-9]\d|20[0-2]\d)\b")
 _PATTERN_YEAR_SHORT = re.compile(r"['`´]?(\d{2})\b")
@@ -74,16 +117,6 @@ _PATTERN_INVALID_CTX = re.compile(
     flags=re.IGNORECASE
 )
 
-_PATTERN_VEHICULAR_FUERTE = re.compile(
-    r"\b(?:modelo|año|del año|versión|m/|vehículo|carro|auto|motor|transmisión|automático|mecánico|standard|gasolina|diésel)\b",
-    flags=re.IGNORECASE
-)
-
-_PATTERN_PRICE = re.compile(
-    r"\b(?:q|\$)?\s*[\d.,]+(?:\s*quetzales?)?\b",
-    flags=re.IGNORECASE
-)
-
 def timeit(func):
     def wrapper(*args, **kwargs):
         if not DEBUG:
@@ -272,24 +305,6 @@ sinonimos = {
     ]
 }
 
-def create_model_year_pattern(sinonimos: Dict[str, List[str]]) -> re.Pattern:
-    variantes = []
-    for lista in sinonimos.values():
-        variantes.extend(lista)
-    modelos_escapados = [re.escape(v) for v in sorted(variantes, key=len, reverse=True)]
-    modelos_union = '|'.join(modelos_escapados)
-    pattern = rf"""
-        \b(?P<y1>(?:19[8-9]\d|20[0-2]\d|\d{{2}}))\s+(?:{modelos_union})\b  |
-        \b(?:{modelos_union})\s+(?P<y2>(?:19[8-9]\d|20[0-2]\d|\d{{2}}))\b
-    """
-    return re.compile(pattern, flags=re.IGNORECASE | re.VERBOSE)
-
-_PATTERN_YEAR_AROUND_MODEL = create_model_year_pattern(sinonimos)
-
-_PATTERN_YEAR_AROUND_KEYWORD = re.compile(
-    r"(modelo|m/|versión|año|m\.|modelo:|año:|del|del:|md|md:)\s*[^\d]{0,5}([12]\d{3})", flags=re.IGNORECASE
-)
-
 @contextmanager
 def get_db_connection():
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
@@ -338,7 +353,10 @@ def inicializar_tabla_anuncios():
             "relevante": "BOOLEAN DEFAULT 0",
             "confianza_precio": "TEXT DEFAULT 'baja'",
             "muestra_precio": "INTEGER DEFAULT 0",
-            "año_asignado_inteligente": "BOOLEAN DEFAULT 0"  # NUEVA COLUMNA
+            "año_asignado_inteligente": "BOOLEAN DEFAULT 0",  # NUEVA COLUMNA
+            "texto": "TEXT",  # Texto original, para re-analizar el historial (ver reanalizar.py)
+            "updated_at": "TEXT",  # Último cambio de la fila, para los deltas (ver sincronizacion.py)
+            "ultimo_visto": "DATE"  # Última vez que apareció en una búsqueda (ver archivo.py)
         }
         
         for nombre, definicion in nuevas_columnas.items():
@@ -348,44 +366,122 @@ def inicializar_tabla_anuncios():
                     print(f"✅ Columna '{nombre}' agregada")
                 except sqlite3.OperationalError as e:
                     print(f"⚠️ Error al agregar columna '{nombre}': {e}")
-        
-        conn.commit()
 
-def normalizar_formatos_ano(texto: str) -> str:
-    texto = re.sub(r'\b(19|20)[,\.](\d{2})\b', r'\1\2', texto)
-    return texto
+        # Índices cubrientes: rendimiento por rango de fechas y precios de
+        # referencia por modelo/año se resuelven sin leer la tabla
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_anuncios_fecha ON anuncios(fecha_scrape, modelo, score)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_anuncios_modelo_anio ON anuncios(modelo, anio, precio)")
 
-def limpiar_emojis_numericos(texto: str) -> str:
-    mapa_emojis = {
-        '0️⃣': '0', '1️⃣': '1', '2️⃣': '2', '3️⃣': '3', '4️⃣': '4',
-        '5️⃣': '5', '6️⃣': '6', '7️⃣': '7', '8️⃣': '8', '9️⃣': '9',
-        '⓪': '0', '①': '1', '②': '2', '③': '3', '④': '4',
-        '⑤': '5', '⑥': '6', '⑦': '7', '⑧': '8', '⑨': '9'
-    }
-    for emoji, digito in mapa_emojis.items():
-        texto = texto.replace(emoji, digito)
-    return texto
+        # Resúmenes por modelo, modelo/año y día, mantenidos por triggers
+        crear_resumenes(conn)
+
+        # updated_at y registro de borrados para exportar deltas entre corridas
+        crear_captura(conn)
+
+        # Historial de precios (solo se agrega), mantenido por triggers
+        crear_historial(conn)
+
+        # Sketches de cuantiles de precio por modelo/año (ver cuantiles.py)
+        crear_sketches(conn)
+
+        # Caché persistente de resultados de análisis por hash de contenido
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS analisis_cache (
+                hash_contenido TEXT PRIMARY KEY,
+                link TEXT,
+                version_referencia TEXT,
+                resultado TEXT,
+                fecha DATE
+            )
+        """)
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_analisis_cache_link'")
+        if cur.fetchone() is None:
+            # Bases previas guardaban una fila por cada versión del texto
+            cur.execute("""
+                DELETE FROM analisis_cache WHERE link != '' AND rowid NOT IN (
+                    SELECT MAX(rowid) FROM analisis_cache WHERE link != '' GROUP BY link
+                )
+            """)
+            cur.execute("CREATE INDEX idx_analisis_cache_link ON analisis_cache(link)")
+        
+        conn.commit()
 
 def limpiar_link(link: Optional[str]) -> str:
     if not link:
         return ""
     return ''.join(c for c in link.strip() if c.isascii() and c.isprintable())
 
-def contiene_negativos(texto: str) -> bool:
-    return any(p in texto.lower() for p in PALABRAS_NEGATIVAS)
+@perezoso("clasificador_palabras")
+def get_clasificador_palabras() -> Tuple[re.Pattern, Dict[str, FrozenSet[str]]]:
+    """
+    Compila todos los términos de CATEGORIAS_PALABRAS en una sola alternancia.
+    Un término que contiene a otro hereda sus categorías ("motor fundido" también
+    es vehicular), así el emparejamiento sin solapes no pierde ninguna categoría.
+    """
+    categorias_por_termino: Dict[str, set] = {}
+    for categoria, terminos in CATEGORIAS_PALABRAS.items():
+        for termino in terminos:
+            categorias_por_termino.setdefault(TextoAnuncio(termino).ascii, set()).add(categoria)
+
+    for termino, categorias in categorias_por_termino.items():
+        for otro, categorias_otro in categorias_por_termino.items():
+            if otro != termino and re.search(rf"\b{re.escape(otro)}(?:es|s)?\b", termino):
+                categorias |= categorias_otro
+
+    alternancia = "|".join(
+        re.escape(t) for t in sorted(categorias_por_termino, key=len, reverse=True)
+    )
+    patron = re.compile(rf"\b({alternancia})(?:es|s)?\b")
+    return patron, {t: frozenset(c) for t, c in categorias_por_termino.items()}
 
-def es_extranjero(texto: str) -> bool:
-    return any(p in texto.lower() for p in LUGARES_EXTRANJEROS)
+def clasificar_texto(texto: Texto) -> Dict[str, List[str]]:
+    """
+    Recorre el texto una sola vez y retorna {código de motivo: términos encontrados}
+    para las categorías de CATEGORIAS_PALABRAS presentes.
+    """
+    patron, categorias_por_termino = get_clasificador_palabras()
+    motivos: Dict[str, List[str]] = {}
+    for m in patron.finditer(TextoAnuncio.de(texto).ascii):
+        for categoria in categorias_por_termino[m.group(1)]:
+            motivos.setdefault(categoria, []).append(m.group(1))
+    return motivos
+
+def contiene_negativos(texto: Texto) -> bool:
+    return "negativo" in clasificar_texto(texto)
+
+def es_extranjero(texto: Texto) -> bool:
+    return "extranjero" in clasificar_texto(texto)
+
+def es_token_precio(token: TokenNumerico) -> bool:
+    """Número sin moneda que aun así puede ser un precio (4 a 7 cifras, no año, km, cc ni teléfono)"""
+    if token.pegado or not (4 <= token.digitos <= 7):
+        return False
+    if token.contexto & {"kilometraje", "telefono", "motor"}:
+        return False
+    return not (MIN_YEAR <= token.valor <= MAX_YEAR)
 
-def limpiar_precio(texto: str) -> int:
-    s = re.sub(r"[Qq\$\.,]", "", texto.lower())
-    matches = re.findall(r"\b\d{4,7}\b", s)
-    candidatos = []
-    for match in matches:
-        num = int(match)
-        if not (MIN_YEAR <= num <= MAX_YEAR):
-            candidatos.append(num)
-    return candidatos[0] if candidatos else 0
+def extraer_precio(texto: Texto, solo_moneda: bool = False) -> int:
+    """
+    Precio del anuncio a partir de los tokens numéricos: el primer número con
+    moneda (Q, $, quetzales) de al menos 4 cifras o, si no hay, el primero que
+    parezca precio. Con solo_moneda se exige la moneda y se retorna el primer
+    monto aunque sea pequeño (el llamador decide si es demasiado bajo).
+    """
+    tokens = TextoAnuncio.de(texto).tokens
+    con_moneda = [t for t in tokens if t.moneda]
+    for token in con_moneda:
+        if token.digitos >= 4:
+            return token.valor
+    if solo_moneda:
+        return con_moneda[0].valor if con_moneda else 0
+    for token in tokens:
+        if es_token_precio(token):
+            return token.valor
+    return 0
+
+# FUNCIÓN DE COMPATIBILIDAD
+def limpiar_precio(texto: Texto) -> int:
+    return extraer_precio(texto)
 
 def filtrar_outliers(precios: List[int]) -> List[int]:
     if len(precios) < 4:
@@ -400,11 +496,10 @@ def filtrar_outliers(precios: List[int]) -> List[int]:
     except:
         return precios
 
-def coincide_modelo(texto: str, modelo: str) -> bool:
-    texto_l = unicodedata.normalize("NFKD", texto.lower())
+def coincide_modelo(texto: Texto, modelo: str) -> bool:
     modelo_l = modelo.lower()
     variantes = sinonimos.get(modelo_l, []) + [modelo_l]
-    texto_limpio = unicodedata.normalize("NFKD", texto_l).encode("ascii", "ignore").decode("ascii")
+    texto_limpio = TextoAnuncio.de(texto).ascii
     
     for variante in variantes:
         pattern = rf"\b{re.escape(variante)}\b"
@@ -413,10 +508,10 @@ def coincide_modelo(texto: str, modelo: str) -> bool:
     return False
 
 # NUEVA FUNCIÓN: Detectar modelo más frecuente
-def detectar_modelo_mas_frecuente(texto: str, debug: bool = False) -> Optional[str]:
+def detectar_modelo_mas_frecuente(texto: Texto, debug: bool = False) -> Optional[str]:
     """Detecta el modelo que más se repite en el texto"""
     contador_modelos = {}
-    texto_lower = texto.lower()
+    texto_lower = TextoAnuncio.de(texto).lower
     
     for modelo in MODELOS_INTERES:
         count = 0
@@ -455,8 +550,9 @@ def es_candidato_año(raw: str) -> bool:
         return False
 
 # NUEVA FUNCIÓN: Validar que no sea precio duplicado
-def validar_no_es_precio_duplicado(año_candidato: int, precio: int, texto: str, debug: bool = False) -> bool:
+def validar_no_es_precio_duplicado(año_candidato: int, precio: int, texto: Texto, debug: bool = False) -> bool:
     """Valida que el año candidato no sea el precio duplicado"""
+    tokens = TextoAnuncio.de(texto).tokens
     if año_candidato == precio:
         if debug:
             print(f"❌ Año {año_candidato} descartado: coincide exactamente con precio")
@@ -471,15 +567,11 @@ def validar_no_es_precio_duplicado(año_candidato: int, precio: int, texto: str,
             print(f"❌ Año {año_candidato} descartado: es parte del precio {precio}")
         return False
     
-    # Buscar si el precio aparece múltiples veces
-    apariciones_precio = len(re.findall(rf'\b{re.escape(precio_str)}\b', texto))
+    # Si el precio aparece varias veces, descartar el año cuando solo aparece como monto
+    apariciones_precio = sum(1 for t in tokens if t.valor == precio)
     if apariciones_precio > 1:
-        pattern = rf'\b{año_candidato}\b'
-        matches = list(re.finditer(pattern, texto))
-        
-        for match in matches:
-            contexto = texto[max(0, match.start()-20):match.end()+20]
-            if re.search(r'[Q$]', contexto):
+        for token in tokens:
+            if token.valor == año_candidato and (token.moneda or "precio" in token.contexto):
                 if debug:
                     print(f"❌ Año {año_candidato} descartado: aparece en contexto de precio")
                 return False
@@ -490,64 +582,42 @@ def validar_no_es_precio_duplicado(año_candidato: int, precio: int, texto: str,
 def obtener_datos_historicos_modelo(modelo: str, debug: bool = False) -> Dict[str, Any]:
     """Obtiene datos históricos del modelo para asignación inteligente de año"""
     with get_db_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT anio, precio, COUNT(*) as frecuencia
-            FROM anuncios 
-            WHERE modelo = ? AND anio IS NOT NULL AND precio > 0
-            GROUP BY anio
-            ORDER BY anio
-        """, (modelo,))
-        
-        datos_raw = cur.fetchall()
-        
-        if not datos_raw:
-            if debug:
-                print(f"❌ Sin datos históricos para {modelo}")
-            return {"suficientes_datos": False, "total_anuncios": 0}
-        
-        # Procesar datos
-        años_con_datos = {}
-        total_anuncios = 0
-        
-        for anio, precio_promedio, freq in datos_raw:
-            # Obtener todos los precios del año específico
-            cur.execute("""
-                SELECT precio FROM anuncios 
-                WHERE modelo = ? AND anio = ? AND precio > 0
-            """, (modelo, anio))
-            precios_año = [row[0] for row in cur.fetchall()]
-            
-            años_con_datos[anio] = precios_año
-            total_anuncios += len(precios_año)
-        
-        # Calcular estadísticas por año
-        estadisticas_por_año = {}
-        for anio, precios in años_con_datos.items():
-            if len(precios) >= 2:  # Mínimo 2 precios para estadísticas confiables
-                precios_filtrados = filtrar_outliers(precios)
-                estadisticas_por_año[anio] = {
-                    "precio_min": min(precios_filtrados),
-                    "precio_max": max(precios_filtrados),
-                    "precio_promedio": statistics.mean(precios_filtrados),
-                    "precio_mediana": statistics.median(precios_filtrados),
-                    "cantidad_anuncios": len(precios_filtrados),
-                    "precios": precios_filtrados
-                }
-        
+        # Un sketch por año (ver cuantiles.py) en vez de leer los precios año por año
+        sketches = sketches_modelo(conn, modelo)
+
+    if not sketches:
         if debug:
-            print(f"📊 {modelo}: {total_anuncios} anuncios, {len(años_con_datos)} años diferentes")
-        
-        suficientes_datos = total_anuncios >= MUESTRA_MINIMA_ASIGNACION_AÑO
-        año_más_común = max(años_con_datos.items(), key=lambda x: len(x[1]))[0] if años_con_datos else None
-        
-        return {
-            "suficientes_datos": suficientes_datos,
-            "total_anuncios": total_anuncios,
-            "años_únicos": len(años_con_datos),
-            "estadisticas_por_año": estadisticas_por_año,
-            "año_más_común": año_más_común
-        }
+            print(f"❌ Sin datos históricos para {modelo}")
+        return {"suficientes_datos": False, "total_anuncios": 0}
+
+    total_anuncios = sum(sketch.n for sketch in sketches.values())
+
+    # Calcular estadísticas por año
+    estadisticas_por_año = {}
+    for anio, sketch in sketches.items():
+        if sketch.n >= 2:  # Mínimo 2 precios para estadísticas confiables
+            filtrado = sketch.filtrado()
+            estadisticas_por_año[anio] = {
+                "precio_min": filtrado.minimo,
+                "precio_max": filtrado.maximo,
+                "precio_promedio": filtrado.media(),
+                "precio_mediana": filtrado.mediana(),
+                "cantidad_anuncios": filtrado.n
+            }
+
+    if debug:
+        print(f"📊 {modelo}: {total_anuncios} anuncios, {len(sketches)} años diferentes")
+
+    suficientes_datos = total_anuncios >= MUESTRA_MINIMA_ASIGNACION_AÑO
+    año_más_común = max(sketches.items(), key=lambda x: x[1].n)[0]
+
+    return {
+        "suficientes_datos": suficientes_datos,
+        "total_anuncios": total_anuncios,
+        "años_únicos": len(sketches),
+        "estadisticas_por_año": estadisticas_por_año,
+        "año_más_común": año_más_común
+    }
 
 # NUEVA FUNCIÓN: Calcular año probable por precio
 def calcular_año_probable_por_precio(precio_objetivo: int, datos_historicos: Dict, debug: bool = False) -> Optional[int]:
@@ -590,36 +660,38 @@ def calcular_año_probable_por_precio(precio_objetivo: int, datos_historicos: Di
     return mejor_candidato["anio"]
 
 # NUEVA FUNCIÓN: Asignación inteligente de año
-def asignar_año_inteligente(texto: str, modelo: str, precio: int, precio_oficial: Optional[int] = None, debug: bool = False) -> Optional[int]:
+def resolver_año_inteligente(texto: Texto, modelo: str, precio: int, precio_oficial: Optional[int] = None, debug: bool = False) -> ResolucionAño:
     """
     Sistema inteligente de asignación de año:
     1. Intenta extraer año del texto
     2. Si no encuentra año, usa datos históricos para asignar año probable
+    La resolución indica de dónde salió el año, para no tener que volver a extraerlo.
     """
     
     # PASO 1: Intentar extraer año del texto (caso normal)
-    año_extraido = extraer_anio(texto, modelo=modelo, precio=precio, debug=debug)
+    extraida = resolver_anio(texto, modelo=modelo, precio=precio, debug=debug)
     
-    if año_extraido:
+    if extraida:
         # VALIDACIÓN ADICIONAL: Verificar que no sea precio duplicado
-        if not validar_no_es_precio_duplicado(año_extraido, precio_oficial or precio, texto, debug):
+        if not validar_no_es_precio_duplicado(extraida.anio, precio_oficial or precio, texto, debug):
             if debug:
                 print("🔄 Año extraído descartado por validación de precio duplicado")
         else:
             if debug:
-                print(f"✅ Año extraído del texto: {año_extraido}")
-            return año_extraido
+                print(f"✅ Año extraído del texto: {extraida.anio}")
+            return extraida
     
     if debug:
         print("🔍 No se encontró año confiable en texto. Intentando asignación inteligente...")
     
     # PASO 2: Obtener datos históricos del modelo
     datos_historicos = obtener_datos_historicos_modelo(modelo, debug)
+    sin_resolver = ResolucionAño(candidatos=extraida.candidatos)
     
     if not datos_historicos["suficientes_datos"]:
         if debug:
             print(f"❌ Datos insuficientes para {modelo} ({datos_historicos['total_anuncios']} anuncios < {MUESTRA_MINIMA_ASIGNACION_AÑO}). Descartando.")
-        return None
+        return sin_resolver
     
     # PASO 3: MÉTODO COMBINADO - Año más común + Concordancia por precio
     año_más_común = datos_historicos["año_más_común"]
@@ -634,160 +706,336 @@ def asignar_año_inteligente(texto: str, modelo: str, precio: int, precio_oficia
         if año_por_precio == año_más_común:
             if debug:
                 print(f"🎯 ALTA CONFIANZA: Ambos métodos concuerdan en {año_más_común}")
-            return año_más_común
+            return ResolucionAño(año_más_común, "precio_historico", "alta", extraida.candidatos)
         else:
             # Verificar compatibilidad del precio con el año más común
             stats_común = datos_historicos["estadisticas_por_año"].get(año_más_común, {})
             if stats_común and stats_común["precio_min"] <= precio <= stats_común["precio_max"]:
                 if debug:
                     print(f"🎯 CONFIANZA MEDIA: Precio compatible con año más común {año_más_común}")
-                return año_más_común
+                return ResolucionAño(año_más_común, "mas_comun", "media", extraida.candidatos)
             else:
                 if debug:
                     print(f"🎯 CONFIANZA MEDIA: Precio sugiere {año_por_precio}")
-                return año_por_precio
+                return ResolucionAño(año_por_precio, "precio_historico", "media", extraida.candidatos)
     
     elif año_más_común:
         stats_común = datos_historicos["estadisticas_por_año"].get(año_más_común, {})
         if stats_común and stats_común["precio_min"] <= precio <= stats_común["precio_max"]:
             if debug:
                 print(f"🎯 CONFIANZA BAJA: Solo año más común {año_más_común}")
-            return año_más_común
+            return ResolucionAño(año_más_común, "mas_comun", "baja", extraida.candidatos)
     
     if debug:
         print("❌ No se pudo determinar año con suficiente confianza")
-    return None
+    return sin_resolver
+
+def asignar_año_inteligente(texto: Texto, modelo: str, precio: int, precio_oficial: Optional[int] = None, debug: bool = False) -> Optional[int]:
+    """Año del anuncio, extraído o asignado inteligentemente (ver resolver_año_inteligente)"""
+    return resolver_año_inteligente(texto, modelo, precio, precio_oficial, debug).anio
+
+_cache_anios = CacheLRU(MAX_CACHE_ANIOS)
+
+def estadisticas_cache_anios() -> Dict[str, Any]:
+    """Aciertos/fallos de la caché de extracción de años y de la de correcciones"""
+    return {
+        "anios": _cache_anios.estadisticas(),
+        "correcciones": estadisticas_cache_correcciones()
+    }
+
+def precalentar_analisis():
+    """
+    Construye de una vez los artefactos perezosos del análisis (regex de
+    variantes de cada modelo, clasificador de palabras, detector de correcciones).
+    Útil en procesos worker, para no pagar ese costo con el primer anuncio.
+    """
+    get_clasificador_palabras()
+    for modelo in MODELOS_INTERES:
+        _patron_variantes_modelo(modelo)
+    obtener_correccion_con_fuente("precalentar")
+
+def resolver_anio(texto: Texto, modelo: Optional[str] = None, precio: Optional[int] = None, debug: bool = False) -> ResolucionAño:
+    """
+    Resuelve el año del texto con su procedencia y candidatos. El resultado se
+    memoriza por hash del texto, modelo y versión de las correcciones, ya que el
+    mismo anuncio se analiza varias veces por ejecución (se omite en modo debug).
+    """
+    if debug or not texto or not isinstance(texto, (str, TextoAnuncio)):
+        return _resolver_anio_sin_cache(texto, modelo, precio, debug)
+
+    texto = TextoAnuncio.de(texto)
+    clave = (version_correcciones(), texto.hash, modelo)
+    resolucion = _cache_anios.obtener(clave)
+    if resolucion is SIN_VALOR:
+        resolucion = _resolver_anio_sin_cache(texto, modelo, precio)
+        _cache_anios.guardar(clave, resolucion)
+    return resolucion
 
 def extraer_anio(texto, modelo=None, precio=None, debug=False):
-    if not texto or not isinstance(texto, str):
+    """Extrae el año del texto (ver resolver_anio)"""
+    return resolver_anio(texto, modelo, precio, debug).anio
+
+# Contexto vehicular mínimo para intentar extraer un año
+_PATTERN_CONTEXTO_ANIO = re.compile(
+    r'\b(modelo|año|versión|motor|vehículo|carro|auto|transmisión|automático|mecánico|gasolina|diésel)\b'
+)
+# Palabras clave de año y contextos que descartan un año (perfil del vendedor), en una pasada
+_PATTERN_PALABRAS_ANIO = re.compile(
+    r'(?P<keyword>\b(?:modelo|m/|versión|año|del))|(?P<malo>nacido|miembro desde|facebook|perfil)'
+)
+_PATTERN_PALABRA = re.compile(r'\w')
+
+PRIORIDAD_MODELO = 1000
+PRIORIDAD_KEYWORD = 900
+PRIORIDAD_TITULO = 800
+PRIORIDAD_GENERAL = 100
+
+# Prioridad del candidato elegido → (fuente, confianza) de la resolución
+FUENTE_POR_PRIORIDAD = {
+    PRIORIDAD_MODELO: ("modelo", "alta"),
+    PRIORIDAD_KEYWORD: ("keyword", "alta"),
+    PRIORIDAD_TITULO: ("titulo", "media"),
+    PRIORIDAD_GENERAL: ("general", "baja"),
+}
+# Tipo de coincidencia en correcciones → (fuente, confianza)
+FUENTE_POR_CORRECCION = {
+    "exacta": ("correccion", "alta"),
+    "patron": ("patron", "media"),
+    "parcial": ("correccion", "baja"),
+}
+
+# Máximo de caracteres (sin contar los espacios iniciales) entre palabra clave y año
+MAX_SEPARACION_KEYWORD = 10
+VENTANA_CONTEXTO_GENERAL = 30
+
+def _anio_de_digitos(raw: str) -> Optional[int]:
+    """Año que representa una secuencia de 2 a 4 dígitos, o None (reglas de es_candidato_año)"""
+    if not (2 <= len(raw) <= 4) or raw.startswith("00"):
+        return None
+    año = int(raw)
+    if len(raw) == 2:
+        año = 1900 + año if año > 50 else 2000 + año
+    return año if MIN_YEAR <= año <= MAX_YEAR else None
+
+@functools.lru_cache(maxsize=None)
+def _patron_variantes_modelo(modelo: str) -> Tuple[re.Pattern, Dict[str, List[str]]]:
+    """
+    Lookahead con todas las variantes del modelo (la más larga primero): en una
+    pasada da, para cada posición, la variante más larga que empieza ahí. Las
+    demás variantes que empiezan en esa posición son prefijos suyos.
+    """
+    variantes = list(dict.fromkeys(sinonimos.get(modelo, [modelo])))
+    ordenadas = sorted(variantes, key=len, reverse=True)
+    patron = re.compile("(?=(" + "|".join(re.escape(v) for v in ordenadas) + "))")
+    prefijos = {v: [p for p in variantes if v.startswith(p)] for v in variantes}
+    return patron, prefijos
+
+class _SecuenciaDigitos:
+    """
+    Secuencias de dígitos del texto con sus vecindades precalculadas, sacadas
+    de TextoAnuncio.tokens (el mismo recorrido que usa el parser de precios):
+    "35,000" aporta "35" y "000". extraer_anio consulta esta lista en vez de
+    repetir búsquedas regex.
+    """
+    __slots__ = ("texto", "inicios", "fines", "raws", "anios")
+
+    def __init__(self, texto: TextoAnuncio):
+        self.texto = texto.lower
+        self.inicios, self.fines, self.raws = [], [], []
+        for token in texto.tokens:
+            partes = token.raw.replace(",", ".").split(".") if token.separador else (token.raw,)
+            inicio = token.inicio
+            for raw in partes:
+                self.inicios.append(inicio)
+                self.fines.append(inicio + len(raw))
+                self.raws.append(raw)
+                inicio += len(raw) + 1
+        self.anios = [_anio_de_digitos(raw) for raw in self.raws]
+
+    def es_palabra(self, i: int) -> bool:
+        return 0 <= i < len(self.texto) and _PATTERN_PALABRA.match(self.texto, i) is not None
+
+    def limite(self, i: int) -> bool:
+        """Equivalente a \\b en la posición i"""
+        return self.es_palabra(i - 1) != self.es_palabra(i)
+
+    def siguiente(self, desde: int) -> int:
+        """Índice de la primera secuencia que empieza en `desde` o después"""
+        return bisect.bisect_left(self.inicios, desde)
+
+    def aislada(self, i: int) -> bool:
+        """La secuencia i tiene 2-4 dígitos y límite de palabra a ambos lados"""
+        return (2 <= len(self.raws[i]) <= 4 and self.limite(self.inicios[i])
+                and self.limite(self.fines[i]))
+
+def _candidatos_modelo(digitos: _SecuenciaDigitos, modelo: str) -> List[Tuple[int, int, str]]:
+    """
+    Años pegados a una variante del modelo ("yaris 2015", "2015 ... yaris").
+    Reproduce las reglas `\\bvariante\\s+[^\\d]*?(\\d{2,4})\\b` y
+    `\\b(\\d{2,4})\\s+[^\\d]*?variante\\b`, en el orden variante → después/antes → posición.
+    """
+    texto = digitos.texto
+    patron, prefijos = _patron_variantes_modelo(modelo)
+
+    ocurrencias: Dict[str, List[int]] = {}
+    for m in patron.finditer(texto):
+        for variante in prefijos[m.group(1)]:
+            ocurrencias.setdefault(variante, []).append(m.start())
+
+    variantes = sinonimos.get(modelo, [modelo])
+    hallados = []
+    for orden, variante in enumerate(variantes):
+        posiciones = ocurrencias.get(variante)
+        if not posiciones:
+            continue
+        largo = len(variante)
+
+        # Año después de la variante: primera secuencia de dígitos tras un espacio
+        consumido = 0
+        for pos in posiciones:
+            fin_variante = pos + largo
+            if pos < consumido or not digitos.limite(pos) or not texto[fin_variante:fin_variante + 1].isspace():
+                continue
+            i = digitos.siguiente(fin_variante)
+            if i == len(digitos.raws) or not (2 <= len(digitos.raws[i]) <= 4) or not digitos.limite(digitos.fines[i]):
+                continue
+            consumido = digitos.fines[i]
+            if digitos.anios[i]:
+                hallados.append(((orden, 0, digitos.inicios[i]), digitos.anios[i], f"modelo_después_{variante}"))
+
+        # Año antes de la variante: sin otros dígitos entre ambos
+        consumido = 0
+        for i, raw in enumerate(digitos.raws):
+            inicio, fin = digitos.inicios[i], digitos.fines[i]
+            if inicio < consumido or not (2 <= len(raw) <= 4) or not digitos.limite(inicio):
+                continue
+            if not texto[fin:fin + 1].isspace():
+                continue
+            tope = digitos.inicios[i + 1] if i + 1 < len(digitos.raws) else len(texto)
+            k = bisect.bisect_left(posiciones, fin + 1)
+            while k < len(posiciones) and posiciones[k] <= tope:
+                if digitos.limite(posiciones[k] + largo):
+                    consumido = posiciones[k] + largo
+                    if digitos.anios[i]:
+                        hallados.append(((orden, 1, inicio), digitos.anios[i], f"modelo_antes_{variante}"))
+                    break
+                k += 1
+
+    hallados.sort(key=lambda h: h[0])
+    return [(año, PRIORIDAD_MODELO, fuente) for _, año, fuente in hallados]
+
+def _candidatos_keyword(digitos: _SecuenciaDigitos, keywords: List[re.Match]) -> List[Tuple[int, int, str]]:
+    """Años tras "modelo", "m/", "versión", "año" o "del" (a lo sumo 10 caracteres de separación)"""
+    texto = digitos.texto
+    candidatos = []
+    for m in keywords:
+        i = digitos.siguiente(m.end())
+        if i == len(digitos.raws):
+            break
+        if not (2 <= len(digitos.raws[i]) <= 4) or not digitos.limite(digitos.fines[i]):
+            continue
+        # "año:" y "modelo:" también son palabras clave: el ":" no cuenta como separación
+        finales = (m.end(), m.end() + 1) if m.group() in ("año", "modelo") and texto[m.end():m.end() + 1] == ":" else (m.end(),)
+        for fin_keyword in finales:
+            separacion = texto[fin_keyword:digitos.inicios[i]]
+            if len(separacion.lstrip()) <= MAX_SEPARACION_KEYWORD:
+                if digitos.anios[i]:
+                    candidatos.append((digitos.anios[i], PRIORIDAD_KEYWORD, "keyword"))
+                break
+    return candidatos
+
+def _resolver_anio_sin_cache(texto, modelo=None, precio=None, debug=False) -> ResolucionAño:
+    if not texto or not isinstance(texto, (str, TextoAnuncio)):
         if debug:
             print("❌ Texto inválido o vacío")
-        return None
+        return ResolucionAño()
     
-    texto = limpiar_emojis_numericos(texto) 
-    texto = normalizar_formatos_ano(texto)  
-    texto_original = texto
-    texto = texto.lower()
+    texto_anuncio = TextoAnuncio.de(texto)
+    texto_original = texto_anuncio.limpio
+    texto = texto_anuncio.lower
 
-    if not re.search(r'\b(modelo|año|versión|motor|vehículo|carro|auto|transmisión|automático|mecánico|gasolina|diésel)\b', texto):
+    if not _PATTERN_CONTEXTO_ANIO.search(texto):
         if debug:
             print("❌ No hay contexto vehicular suficiente para extraer año")
-        return None
+        return ResolucionAño()
 
     # 1) PRIORIDAD MÁXIMA: Correcciones manuales
-    correccion_manual = obtener_correccion(texto_original)
+    correccion_manual, tipo_correccion = obtener_correccion_con_fuente(texto_original)
     if correccion_manual:
         if debug:
             print(f"✅ Corrección manual aplicada: {correccion_manual}")
-        return correccion_manual
+        return ResolucionAño(correccion_manual, *FUENTE_POR_CORRECCION[tipo_correccion])
+
+    # Los dígitos salen de los tokens numéricos del texto; las prioridades se asignan sobre esta lista
+    digitos = _SecuenciaDigitos(texto_anuncio)
+    keywords, contexto_malo = [], []
+    for m in _PATTERN_PALABRAS_ANIO.finditer(texto):
+        if m.lastgroup == "keyword":
+            keywords.append(m)
+        else:
+            contexto_malo.append(m.span())
 
-    def normalizar_año_corto(a):
-        if a < 100:
-            return 1900 + a if a > 50 else 2000 + a
-        return a
+    def es_monto(posicion):
+        # Los dígitos forman parte de un número marcado con moneda
+        token = texto_anuncio.token_en(posicion)
+        return token is not None and token.moneda is not None
 
     candidatos_prioritarios = []
 
     # 2) MÁXIMA PRIORIDAD: Patrones modelo-año específicos
     if modelo:
-        modelo_variantes = sinonimos.get(modelo.lower(), [modelo.lower()])
-        for variante in modelo_variantes:
-            variante_escaped = re.escape(variante)
-            
-            patron_despues = rf'\b{variante_escaped}\s+[^\d]*?(\d{{2,4}})\b'
-            for match in re.finditer(patron_despues, texto):
-                raw = match.group(1)
-                if es_candidato_año(raw):
-                    try:
-                        año = int(raw)
-                        año = normalizar_año_corto(año) if len(raw) == 2 else año
-                        if MIN_YEAR <= año <= MAX_YEAR:
-                            candidatos_prioritarios.append((año, 1000, f"modelo_después_{variante}"))
-                            if debug:
-                                print(f"🎯 ALTA PRIORIDAD: {año} después de {variante}")
-                    except ValueError:
-                        continue
-            
-            patron_antes = rf'\b(\d{{2,4}})\s+[^\d]*?{variante_escaped}\b'
-            for match in re.finditer(patron_antes, texto):
-                raw = match.group(1)
-                if es_candidato_año(raw):
-                    try:
-                        año = int(raw)
-                        año = normalizar_año_corto(año) if len(raw) == 2 else año
-                        if MIN_YEAR <= año <= MAX_YEAR:
-                            candidatos_prioritarios.append((año, 1000, f"modelo_antes_{variante}"))
-                            if debug:
-                                print(f"🎯 ALTA PRIORIDAD: {año} antes de {variante}")
-                    except ValueError:
-                        continue
-
-        años_fuertes = [a for a, p, f in candidatos_prioritarios if p >= 1000]
+        candidatos_prioritarios = _candidatos_modelo(digitos, modelo.lower())
+        if debug:
+            for año, _, fuente in candidatos_prioritarios:
+                print(f"🎯 ALTA PRIORIDAD: {año} ({fuente})")
+
+        años_fuertes = [a for a, p, f in candidatos_prioritarios if p >= PRIORIDAD_MODELO]
         if len(set(años_fuertes)) == 1:
             if debug:
                 print(f"✅ Corte inmediato: {años_fuertes[0]} (modelo+año claro)")
-            return años_fuertes[0]
+            return ResolucionAño(años_fuertes[0], *FUENTE_POR_PRIORIDAD[PRIORIDAD_MODELO],
+                                 tuple(candidatos_prioritarios))
 
     # 3) ALTA PRIORIDAD: Palabras clave específicas
-    patron_keywords = r'\b(?:modelo|m/|versión|año|del|año:|modelo:)\s*[^\d]{0,10}?(\d{2,4})\b'
-    for match in re.finditer(patron_keywords, texto):
-        raw = match.group(1)
-        if es_candidato_año(raw):
-            try:
-                año = int(raw)
-                año = normalizar_año_corto(año) if len(raw) == 2 else año
-                if MIN_YEAR <= año <= MAX_YEAR:
-                    candidatos_prioritarios.append((año, 900, "keyword"))
-                    if debug:
-                        print(f"🔑 KEYWORD: {año}")
-            except ValueError:
-                continue
+    for candidato in _candidatos_keyword(digitos, keywords):
+        candidatos_prioritarios.append(candidato)
+        if debug:
+            print(f"🔑 KEYWORD: {candidato[0]}")
 
     # 4) PRIORIDAD MEDIA: Primera línea/título
-    primera_linea = texto.split('\n')[0] if '\n' in texto else texto[:150]
-    for match in re.finditer(r'\b(\d{2,4})\b', primera_linea):
-        raw = match.group(1)
-        if es_candidato_año(raw):
-            try:
-                año = int(raw)
-                año = normalizar_año_corto(año) if len(raw) == 2 else año
-                if MIN_YEAR <= año <= MAX_YEAR:
-                    contexto = primera_linea[max(0, match.start()-20):match.end()+20]
-                    if not re.search(rf'[q$]\s*{re.escape(raw)}', contexto, re.IGNORECASE):
-                        candidatos_prioritarios.append((año, 800, "titulo"))
-                        if debug:
-                            print(f"📄 TITULO: {año}")
-            except ValueError:
-                continue
+    fin_titulo = len(texto_anuncio.primera_linea)
+    for i in range(digitos.siguiente(0), digitos.siguiente(fin_titulo)):
+        inicio, fin = digitos.inicios[i], min(digitos.fines[i], fin_titulo)
+        # Un número cortado por el límite del título se evalúa con los dígitos que quedan dentro
+        raw = digitos.raws[i][:fin - inicio]
+        año = digitos.anios[i] if fin == digitos.fines[i] else _anio_de_digitos(raw)
+        if not año or not digitos.limite(inicio) or not (fin == fin_titulo or digitos.limite(fin)):
+            continue
+        if not es_monto(inicio):
+            candidatos_prioritarios.append((año, PRIORIDAD_TITULO, "titulo"))
+            if debug:
+                print(f"📄 TITULO: {año}")
 
     # 5) BAJA PRIORIDAD: Búsqueda general
-    if not any(prioridad >= 800 for _, prioridad, _ in candidatos_prioritarios):
-        for match in re.finditer(r'\b(\d{2,4})\b', texto):
-            raw = match.group(1)
-            if es_candidato_año(raw):
-                try:
-                    año = int(raw)
-                    año = normalizar_año_corto(año) if len(raw) == 2 else año
-                    if MIN_YEAR <= año <= MAX_YEAR:
-                        contexto = texto[max(0, match.start()-30):match.end()+30]
-                        
-                        if any(malo in contexto for malo in ['nacido', 'miembro desde', 'facebook', 'perfil']):
-                            continue
-                        
-                        if re.search(rf'[q$]\s*{re.escape(raw)}', contexto, re.IGNORECASE):
-                            continue
-                            
-                        candidatos_prioritarios.append((año, 100, "general"))
-                        if debug:
-                            print(f"🔍 GENERAL: {año}")
-                except ValueError:
-                    continue
+    if not any(prioridad >= PRIORIDAD_TITULO for _, prioridad, _ in candidatos_prioritarios):
+        for i, año in enumerate(digitos.anios):
+            if not año or not digitos.aislada(i):
+                continue
+            desde = max(0, digitos.inicios[i] - VENTANA_CONTEXTO_GENERAL)
+            hasta = digitos.fines[i] + VENTANA_CONTEXTO_GENERAL
+            if any(desde <= ini and fin <= hasta for ini, fin in contexto_malo):
+                continue
+            if es_monto(digitos.inicios[i]):
+                continue
+            candidatos_prioritarios.append((año, PRIORIDAD_GENERAL, "general"))
+            if debug:
+                print(f"🔍 GENERAL: {año}")
 
     # SELECCIÓN FINAL
     if not candidatos_prioritarios:
         if debug:
             print("❌ No se encontraron candidatos")
-        return None
+        return ResolucionAño()
 
     años_con_max_prioridad = {}
     for año, prioridad, fuente in candidatos_prioritarios:
@@ -799,14 +1047,14 @@ def extraer_anio(texto, modelo=None, precio=None, debug=False):
         for año, (prioridad, fuente) in sorted(años_con_max_prioridad.items(), key=lambda x: x[1][0], reverse=True):
             print(f"  - {año}: prioridad={prioridad}, fuente={fuente}")
 
-    año_final = max(años_con_max_prioridad.items(), key=lambda x: x[1][0])[0]
+    año_final, (prioridad_final, _) = max(años_con_max_prioridad.items(), key=lambda x: x[1][0])
     
     if debug:
         print(f"✅ Año seleccionado: {año_final}")
     
-    return año_final
+    return ResolucionAño(año_final, *FUENTE_POR_PRIORIDAD[prioridad_final], tuple(candidatos_prioritarios))
 
-def validar_precio_coherente(precio: int, modelo: str, anio: int, texto: str = "") -> bool:
+def validar_precio_coherente(precio: int, modelo: str, anio: int, texto: Texto = "") -> bool:
     if precio < 2000 or precio > 600000:
         return False
 
@@ -814,7 +1062,8 @@ def validar_precio_coherente(precio: int, modelo: str, anio: int, texto: str = "
     precio_ref = ref_info.get("precio", PRECIOS_POR_DEFECTO.get(modelo, 50000))
     muestra = ref_info.get("muestra", 0)
 
-    if "reparar" in texto.lower() or "repuesto" in texto.lower():
+    texto_l = TextoAnuncio.de(texto).lower
+    if "reparar" in texto_l or "repuesto" in texto_l:
         margen_bajo = 0.1 * precio_ref
     else:
         if muestra >= MUESTRA_MINIMA_CONFIABLE:
@@ -826,29 +1075,146 @@ def validar_precio_coherente(precio: int, modelo: str, anio: int, texto: str = "
     
         return margen_bajo <= precio <= margen_alto
 
-@timeit
-def get_precio_referencia(modelo: str, anio: int, tolerancia: Optional[int] = None) -> Dict[str, Any]:
-    with get_db_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT precio FROM anuncios 
-            WHERE modelo=? AND ABS(anio - ?) <= ? AND precio > 0
-            ORDER BY precio
-        """, (modelo, anio, tolerancia or TOLERANCIA_PRECIO_REF))
-        precios = [row[0] for row in cur.fetchall()]
-    
+# Memo opcional de referencias, activo solo dentro de `referencias_congeladas()`
+_referencias_congeladas: Optional[Dict[Tuple[str, int, int], Dict[str, Any]]] = None
+
+@contextmanager
+def referencias_congeladas(precargar: Optional[List[Tuple[str, int]]] = None):
+    """
+    Memoriza get_precio_referencia dentro del bloque. Solo es correcto si los
+    precios de los modelos consultados no cambian mientras tanto (por ejemplo,
+    un shard de reanalizar.py, que escribe recién al terminar su modelo).
+    `precargar` resuelve esos (modelo, anio) de entrada en una sola consulta.
+    """
+    global _referencias_congeladas
+    previo = _referencias_congeladas
+    _referencias_congeladas = {}
+    try:
+        if precargar:
+            get_precio_referencia_many(precargar)
+        yield
+    finally:
+        _referencias_congeladas = previo
+
+def referencia_desde_precios(modelo: str, precios: List[int]) -> Dict[str, Any]:
+    """Precio de referencia a partir de los precios ordenados de la ventana de años"""
     if len(precios) >= MUESTRA_MINIMA_CONFIABLE:
         pf = filtrar_outliers(precios)
         med = statistics.median(pf)
         return {"precio": int(med), "confianza": "alta", "muestra": len(pf), "rango": f"{min(pf)}-{max(pf)}"}
-    elif len(precios) >= MUESTRA_MINIMA_MEDIA:
+    if len(precios) >= MUESTRA_MINIMA_MEDIA:
         med = statistics.median(precios)
         return {"precio": int(med), "confianza": "media", "muestra": len(precios), "rango": f"{min(precios)}-{max(precios)}"}
-    else:
-        return {"precio": PRECIOS_POR_DEFECTO.get(modelo, 50000), "confianza": "baja", "muestra": 0, "rango": "default"}
+    return {"precio": PRECIOS_POR_DEFECTO.get(modelo, 50000), "confianza": "baja", "muestra": 0, "rango": "default"}
+
+@timeit
+def get_precio_referencia(modelo: str, anio: int, tolerancia: Optional[int] = None) -> Dict[str, Any]:
+    clave = (modelo, anio, tolerancia or TOLERANCIA_PRECIO_REF)
+    if _referencias_congeladas is not None and clave in _referencias_congeladas:
+        return _referencias_congeladas[clave]
+
+    # Fusión de los sketches de cada año de la ventana: exacta mientras cada
+    # año tenga hasta LIMITE_CENTROIDES precios distintos (ver cuantiles.py)
+    with get_db_connection() as conn:
+        ref = sketch_ventana(conn, modelo, anio - clave[2], anio + clave[2]).referencia(modelo)
+    if _referencias_congeladas is not None:
+        _referencias_congeladas[clave] = ref
+    return ref
+
+# Referencias de muchos (modelo, anio) en una sola consulta. Replica
+# referencia_desde_precios: cuartiles de statistics.quantiles(n=4) (posición
+# k*(n+1)/4 acotada a [1, n-1] e interpolación), filtro de filtrar_outliers
+# (Q1/Q3 ± 2·IQR, sin filtrar si quedan menos de 2) y statistics.median.
+# Los precios dentro de los límites son un rango contiguo [lo, hi] de la
+# ventana ordenada, así la mediana filtrada sale sin volver a numerar.
+SQL_REFERENCIAS_LOTE = """
+    WITH pedidos AS (
+        SELECT key AS pid, json_extract(value, '$[0]') AS modelo, json_extract(value, '$[1]') AS anio
+        FROM json_each(:pares)
+    ),
+    ventana AS (
+        SELECT p.pid, a.precio,
+               ROW_NUMBER() OVER orden AS i,
+               COUNT(*) OVER (orden ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS n
+        FROM pedidos p
+        JOIN anuncios a
+          ON a.modelo = p.modelo AND a.anio BETWEEN p.anio - :tolerancia AND p.anio + :tolerancia AND a.precio > 0
+        WINDOW orden AS (PARTITION BY p.pid ORDER BY a.precio)
+    ),
+    posiciones AS (
+        SELECT *, MIN(MAX((n + 1) / 4, 1), n - 1) AS j1, MIN(MAX(3 * (n + 1) / 4, 1), n - 1) AS j3
+        FROM ventana
+    ),
+    cuartiles AS (
+        SELECT pid, precio, i, n,
+               SUM(CASE WHEN i = j1 THEN precio * (4 - ((n + 1) - 4 * j1))
+                        WHEN i = j1 + 1 THEN precio * ((n + 1) - 4 * j1) ELSE 0 END) OVER grupo / 4.0 AS q1,
+               SUM(CASE WHEN i = j3 THEN precio * (4 - (3 * (n + 1) - 4 * j3))
+                        WHEN i = j3 + 1 THEN precio * (3 * (n + 1) - 4 * j3) ELSE 0 END) OVER grupo / 4.0 AS q3
+        FROM posiciones
+        WINDOW grupo AS (PARTITION BY pid)
+    ),
+    rangos AS (
+        SELECT pid, precio, i, n,
+               MIN(CASE WHEN precio >= q1 - 2.0 * (q3 - q1) THEN i END) OVER grupo AS lo,
+               MAX(CASE WHEN precio <= q3 + 2.0 * (q3 - q1) THEN i END) OVER grupo AS hi
+        FROM cuartiles
+        WINDOW grupo AS (PARTITION BY pid)
+    ),
+    filtrados AS (
+        SELECT pid, precio, i, n,
+               CASE WHEN n < :confiable OR hi - lo + 1 < 2 THEN 1 ELSE lo END AS lo,
+               CASE WHEN n < :confiable OR hi - lo + 1 < 2 THEN n ELSE hi END AS hi
+        FROM rangos
+    )
+    SELECT pid, n, hi - lo + 1 AS m,
+           AVG(CASE WHEN i IN (lo + (hi - lo) / 2, lo + (hi - lo + 1) / 2) THEN precio END) AS mediana,
+           MIN(CASE WHEN i = lo THEN precio END), MAX(CASE WHEN i = hi THEN precio END)
+    FROM filtrados
+    GROUP BY pid
+"""
+
+def get_precio_referencia_many(
+    pares: List[Tuple[str, int]], tolerancia: Optional[int] = None
+) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """
+    Precio de referencia de muchos (modelo, anio) en una sola consulta con
+    funciones de ventana, con el mismo resultado que referencia_desde_precios
+    sobre los precios de cada ventana de años. Respeta referencias_congeladas().
+    """
+    tolerancia = tolerancia or TOLERANCIA_PRECIO_REF
+    referencias: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    faltantes = []
+    for modelo, anio in dict.fromkeys(pares):
+        clave = (modelo, anio, tolerancia)
+        if _referencias_congeladas is not None and clave in _referencias_congeladas:
+            referencias[(modelo, anio)] = _referencias_congeladas[clave]
+        else:
+            faltantes.append((modelo, anio))
+    if not faltantes:
+        return referencias
+
+    with get_db_connection() as conn:
+        filas = conn.execute(SQL_REFERENCIAS_LOTE, {
+            "pares": json.dumps(faltantes), "tolerancia": tolerancia, "confiable": MUESTRA_MINIMA_CONFIABLE
+        }).fetchall()
+    por_pedido = {pid: resto for pid, *resto in filas}
+
+    for pid, (modelo, anio) in enumerate(faltantes):
+        n, m, mediana, minimo, maximo = por_pedido.get(pid, (0, 0, None, None, None))
+        if n >= MUESTRA_MINIMA_CONFIABLE:
+            ref = {"precio": int(mediana), "confianza": "alta", "muestra": m, "rango": f"{minimo}-{maximo}"}
+        elif n >= MUESTRA_MINIMA_MEDIA:
+            ref = {"precio": int(mediana), "confianza": "media", "muestra": n, "rango": f"{minimo}-{maximo}"}
+        else:
+            ref = {"precio": PRECIOS_POR_DEFECTO.get(modelo, 50000), "confianza": "baja", "muestra": 0, "rango": "default"}
+        referencias[(modelo, anio)] = ref
+        if _referencias_congeladas is not None:
+            _referencias_congeladas[(modelo, anio, tolerancia)] = ref
+    return referencias
 
 @timeit
-def calcular_roi_real(modelo: str, precio_compra: int, anio: int, costo_extra: int = 2000) -> Dict[str, Any]:
+def calcular_roi_real(modelo: str, precio_compra: int, anio: int, costo_extra: int = COSTO_EXTRA) -> Dict[str, Any]:
     ref = get_precio_referencia(modelo, anio)
     años_ant = max(0, CURRENT_YEAR - anio)
     f_dep = (1 - DEPRECIACION_ANUAL) ** años_ant
@@ -867,75 +1233,92 @@ def calcular_roi_real(modelo: str, precio_compra: int, anio: int, costo_extra: i
     }
 
 @timeit
-def puntuar_anuncio(anuncio: Dict[str, Any]) -> int:
-    score = 50
+def puntuar_anuncio(anuncio: Union[Anuncio, Dict[str, Any]]) -> int:
+    score = SCORE_BASE
+
+    if not isinstance(anuncio, Anuncio):
+        anuncio = Anuncio.desde_dict(anuncio)
 
-    texto = anuncio.get("texto", "")
-    modelo = anuncio.get("modelo", "")
-    anio = anuncio.get("anio", CURRENT_YEAR)
-    precio = anuncio.get("precio", 0)
+    texto = anuncio.texto or TextoAnuncio("")
+    modelo = anuncio.modelo
+    anio = anuncio.anio or CURRENT_YEAR
+    precio = anuncio.precio
 
-    if contiene_negativos(texto):
-        score -= 40
+    motivos = clasificar_texto(texto)
 
-    if es_extranjero(texto):
-        score -= 30
+    if "negativo" in motivos:
+        score += PENALTY_NEGATIVO
+
+    if "extranjero" in motivos:
+        score += PENALTY_EXTRANJERO
 
     if not validar_precio_coherente(precio, modelo, anio, texto):
-        score -= 50
+        score += PENALTY_INVALID
 
     if anio > CURRENT_YEAR:
-        score -= 60
+        score += PENALTY_FUTURO
 
-    if _PATTERN_VEHICULAR_FUERTE.search(texto.lower()):
-        score += 25
+    if "vehicular" in motivos:
+        score += BONUS_CONTEXTO_FUERTE
 
-    palabras_buenas = ['vehículo', 'automático', 'standard', 'papeles al día', 
-                       'excelente estado', 'poco kilometraje', 'original']
-    for palabra in palabras_buenas:
-        if palabra in texto.lower():
-            score += 15
-            break
+    if "calidad" in motivos:
+        score += BONUS_CALIDAD
 
     roi_info = get_precio_referencia(modelo, anio)
     precio_ref = roi_info.get("precio", PRECIOS_POR_DEFECTO.get(modelo, 50000))
-    roi_valor = anuncio.get("roi", 0)
+    roi_valor = anuncio.roi
     confianza = roi_info.get("confianza", "baja")
     muestra = roi_info.get("muestra", 0)
 
     if roi_valor >= ROI_MINIMO * 2:
-        score += 30
+        score += BONUS_ROI_DOBLE
     elif roi_valor >= ROI_MINIMO:
-        score += 20
+        score += BONUS_ROI
 
-    if precio < 0.7 * precio_ref:
-        score += 25
+    if precio < FACTOR_BAJO_REFERENCIA * precio_ref:
+        score += BONUS_BAJO_REFERENCIA
 
     if confianza == "alta" and muestra >= MUESTRA_MINIMA_CONFIABLE:
-        score += 15
+        score += BONUS_PRECIO_HIGH
     elif confianza == "media":
-        score += 10
+        score += BONUS_CONFIANZA_MEDIA
 
-    if confianza == "baja" and roi_valor < 5:
-        score -= 20
+    if confianza == "baja" and roi_valor < ROI_CONFIANZA_BAJA:
+        score += PENALTY_CONFIANZA_BAJA
 
-    if len(texto) > 300:
-        score += 10
-    elif len(texto) < 50:
-        score -= 10
+    if len(texto) > TEXTO_LARGO:
+        score += BONUS_TEXTO_LARGO
+    elif len(texto) < TEXTO_CORTO:
+        score += PENALTY_TEXTO_CORTO
 
     return max(0, score)
 
 @timeit
 def insertar_anuncio_db(link, modelo, anio, precio, km, roi, score, relevante=False,
-                        confianza_precio=None, muestra_precio=None, año_asignado_inteligente=False):
+                        confianza_precio=None, muestra_precio=None, año_asignado_inteligente=False,
+                        texto=None):
     conn = get_conn()
     cur = conn.cursor()
     
     cur.execute("PRAGMA table_info(anuncios)")
     columnas_existentes = {row[1] for row in cur.fetchall()}
     
-    if all(col in columnas_existentes for col in ["relevante", "confianza_precio", "muestra_precio", "año_asignado_inteligente"]):
+    if all(col in columnas_existentes for col in ["relevante", "confianza_precio", "muestra_precio", "año_asignado_inteligente", "texto", "ultimo_visto"]):
+        # UPSERT y no INSERT OR REPLACE: el REPLACE borra la fila sin disparar
+        # los triggers de las tablas resumen. Sin texto nuevo se conserva el guardado.
+        cur.execute("""
+        INSERT INTO anuncios 
+        (link, modelo, anio, precio, km, roi, score, relevante, confianza_precio, muestra_precio, año_asignado_inteligente, texto, fecha_scrape, ultimo_visto)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, DATE('now'), DATE('now'))
+        ON CONFLICT(link) DO UPDATE SET
+            modelo = excluded.modelo, anio = excluded.anio, precio = excluded.precio, km = excluded.km,
+            roi = excluded.roi, score = excluded.score, relevante = excluded.relevante,
+            confianza_precio = excluded.confianza_precio, muestra_precio = excluded.muestra_precio,
+            año_asignado_inteligente = excluded.año_asignado_inteligente,
+            texto = COALESCE(excluded.texto, anuncios.texto), fecha_scrape = excluded.fecha_scrape,
+            ultimo_visto = excluded.ultimo_visto
+        """, (link, modelo, anio, precio, km, roi, score, relevante, confianza_precio, muestra_precio, año_asignado_inteligente, texto))
+    elif all(col in columnas_existentes for col in ["relevante", "confianza_precio", "muestra_precio", "año_asignado_inteligente"]):
         cur.execute("""
         INSERT OR REPLACE INTO anuncios 
         (link, modelo, anio, precio, km, roi, score, relevante, confianza_precio, muestra_precio, año_asignado_inteligente, fecha_scrape)
@@ -950,75 +1333,86 @@ def insertar_anuncio_db(link, modelo, anio, precio, km, roi, score, relevante=Fa
     
     conn.commit()
 
+def marcar_vistos(links: List[str]) -> int:
+    """Registra que los links aparecieron hoy en una búsqueda (una escritura por día y link)"""
+    if not links:
+        return 0
+    conn = get_conn()
+    cur = conn.executemany("""
+        UPDATE anuncios SET ultimo_visto = DATE('now')
+        WHERE link = ? AND ultimo_visto IS NOT DATE('now')
+    """, [(link,) for link in links])
+    conn.commit()
+    return cur.rowcount
+
+def consolidar_sketches_db() -> int:
+    """Integra a los sketches los cambios de precio pendientes (ver cuantiles.py)"""
+    return consolidar_sketches(get_conn())
+
+def guardar_anuncio_db(anuncio: Anuncio):
+    """Inserta o actualiza un Anuncio en la base"""
+    insertar_anuncio_db(
+        link=anuncio.link, modelo=anuncio.modelo, anio=anuncio.anio, precio=anuncio.precio,
+        km=anuncio.km, roi=anuncio.roi, score=anuncio.score, relevante=anuncio.relevante,
+        confianza_precio=anuncio.confianza_precio, muestra_precio=anuncio.muestra_precio,
+        año_asignado_inteligente=anuncio.año_asignado_inteligente,
+        texto=anuncio.texto.original if anuncio.texto else None
+    )
+
 def existe_en_db(link: str) -> bool:
     with get_db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT 1 FROM anuncios WHERE link = ?", (limpiar_link(link),))
         return cur.fetchone() is not None
 
-def anuncio_diferente(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
-    campos_criticos = ["modelo", "anio", "precio"]
-    campos_secundarios = ["km", "roi", "score"]
-    
-    for campo in campos_criticos:
-        if str(a.get(campo, "")) != str(b.get(campo, "")):
-            return True
-    
-    roi_a, roi_b = a.get("roi", 0), b.get("roi", 0)
-    if abs(roi_a - roi_b) > 5:
-        return True
-        
-    score_a, score_b = a.get("score", 0), b.get("score", 0)
-    if abs(score_a - score_b) > 10:
-        return True
-        
-    return False
+def anuncio_diferente(a: Anuncio, b: Optional[Anuncio]) -> bool:
+    return a.diferente_de(b)
+
+# Rendimiento por ventana de días, calculado una vez por ejecución: el bot y el
+# scraper lo consultan al arrancar y no necesitan ver los inserts de esta corrida
+_cache_rendimiento: Dict[int, Dict[str, float]] = {}
 
 @timeit
+def get_rendimiento_modelos(dias: int = 7) -> Dict[str, float]:
+    """Proporción de anuncios con score ≥ SCORE_MIN_DB por modelo, en una sola consulta"""
+    if dias not in _cache_rendimiento:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT modelo, SUM(CASE WHEN score >= ? THEN 1 ELSE 0 END) * 1.0 / COUNT(*)
+                FROM anuncios WHERE fecha_scrape >= date('now', ?)
+                GROUP BY modelo
+            """, (SCORE_MIN_DB, f"-{dias} days"))
+            _cache_rendimiento[dias] = {modelo: round(r or 0.0, 3) for modelo, r in cur.fetchall()}
+    return _cache_rendimiento[dias]
+
+def limpiar_cache_rendimiento():
+    """Olvida el rendimiento calculado: se llama al iniciar cada corrida"""
+    _cache_rendimiento.clear()
+
 def get_rendimiento_modelo(modelo: str, dias: int = 7) -> float:
-    with get_db_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT SUM(CASE WHEN score >= ? THEN 1 ELSE 0 END) * 1.0 / COUNT(*)
-            FROM anuncios WHERE modelo = ? AND fecha_scrape >= date('now', ?)
-        """, (SCORE_MIN_DB, modelo, f"-{dias} days"))
-        result = cur.fetchone()[0]
-        return round(result or 0.0, 3)
+    return get_rendimiento_modelos(dias).get(modelo, 0.0)
 
 @timeit
 def modelos_bajo_rendimiento(threshold: float = 0.005, dias: int = 7) -> List[str]:
-    return [m for m in MODELOS_INTERES if get_rendimiento_modelo(m, dias) < threshold]
+    rendimiento = get_rendimiento_modelos(dias)
+    return [m for m in MODELOS_INTERES if rendimiento.get(m, 0.0) < threshold]
 
 def get_estadisticas_db() -> Dict[str, Any]:
+    """Totales de la base leídos de resumen_modelo (una fila por modelo)"""
     with get_db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM anuncios")
-        total = cur.fetchone()[0]
-        
-        cur.execute("PRAGMA table_info(anuncios)")
-        columnas_existentes = {row[1] for row in cur.fetchall()}
-        
-        if "confianza_precio" in columnas_existentes:
-            cur.execute("SELECT COUNT(*) FROM anuncios WHERE confianza_precio = 'alta'")
-            alta_conf = cur.fetchone()[0]
-            cur.execute("SELECT COUNT(*) FROM anuncios WHERE confianza_precio = 'baja'")
-            baja_conf = cur.fetchone()[0]
-        else:
-            alta_conf = 0
-            baja_conf = total
-        
-        # NUEVA ESTADÍSTICA: Años asignados inteligentemente
-        if "año_asignado_inteligente" in columnas_existentes:
-            cur.execute("SELECT COUNT(*) FROM anuncios WHERE año_asignado_inteligente = 1")
-            años_asignados = cur.fetchone()[0]
-        else:
-            años_asignados = 0
-        
         cur.execute("""
-            SELECT modelo, COUNT(*) FROM anuncios 
-            GROUP BY modelo ORDER BY COUNT(*) DESC
+            SELECT modelo, total, conf_alta, conf_baja, asignados
+            FROM resumen_modelo ORDER BY total DESC
         """)
-        por_modelo = dict(cur.fetchall())
+        filas = cur.fetchall()
+
+        total = sum(f[1] for f in filas)
+        alta_conf = sum(f[2] for f in filas)
+        baja_conf = sum(f[3] for f in filas)
+        años_asignados = sum(f[4] for f in filas)
+        por_modelo = {f[0]: f[1] for f in filas}
         
         return {
             "total_anuncios": total,
@@ -1030,26 +1424,80 @@ def get_estadisticas_db() -> Dict[str, Any]:
             "por_modelo": por_modelo
         }
 
-def obtener_anuncio_db(link: str) -> Optional[Dict[str, Any]]:
+def obtener_anuncio_db(link: str) -> Optional[Anuncio]:
+    columnas = ("link", "modelo", "anio", "precio", "km", "roi", "score")
     with get_db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT modelo, anio, precio, km, roi, score
+        cur.execute(f"""
+            SELECT {', '.join(columnas)}
             FROM anuncios
             WHERE link = ?
         """, (limpiar_link(link),))
         row = cur.fetchone()
         if row:
-            return {
-                "modelo": row[0],
-                "anio": row[1],
-                "precio": row[2],
-                "km": row[3],
-                "roi": row[4],
-                "score": row[5]
-            }
+            return Anuncio.desde_fila(row, columnas)
+        return None
+
+def hash_contenido_anuncio(texto: Texto, contexto: str = "") -> str:
+    """
+    Hash del contenido de un anuncio más lo que condiciona su análisis: el
+    contexto y las correcciones de año vigentes (una corrección nueva invalida)
+    """
+    return hash_texto(f"{VERSION_ANALISIS}|{huella_correcciones()}|{contexto}|{str(texto).strip()}")
+
+def version_referencia(modelo: str, anio: int) -> str:
+    """
+    Identifica el snapshot de precio de referencia usado por el análisis de un
+    modelo/año: si cambia, el ROI y el score guardados ya no son válidos.
+    """
+    ref = get_precio_referencia(modelo, anio)
+    return f"{CURRENT_YEAR}:{ref['precio']}:{ref['muestra']}:{ref['confianza']}"
+
+def obtener_analisis_cache(hash_contenido: str) -> Optional[Anuncio]:
+    """Retorna el resultado guardado si el contenido y la referencia no cambiaron"""
+    try:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT version_referencia, resultado FROM analisis_cache
+                WHERE hash_contenido = ?
+            """, (hash_contenido,))
+            row = cur.fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+    if not row:
         return None
 
+    anuncio = Anuncio.desde_dict(json.loads(row[1]))
+    if version_referencia(anuncio.modelo, anuncio.anio) != row[0]:
+        return None
+    return anuncio
+
+def guardar_analisis_cache(hash_contenido: str, anuncio: Anuncio):
+    """
+    Guarda el resultado del análisis junto con la versión de referencia vigente.
+    Queda una sola fila por link: las de contenidos anteriores ya no se consultan.
+    Los textos sin link (analizar_mensaje) no se desplazan entre sí.
+    """
+    version = version_referencia(anuncio.modelo, anuncio.anio)
+    conn = get_conn()
+    try:
+        if anuncio.link:
+            conn.execute(
+                "DELETE FROM analisis_cache WHERE link = ? AND hash_contenido != ?",
+                (anuncio.link, hash_contenido)
+            )
+        conn.execute("""
+            INSERT OR REPLACE INTO analisis_cache
+            (hash_contenido, link, version_referencia, resultado, fecha)
+            VALUES (?, ?, ?, ?, DATE('now'))
+        """, (hash_contenido, anuncio.link, version, json.dumps(anuncio.a_dict(), ensure_ascii=False)))
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        if DEBUG:
+            print(f"⚠️ No se pudo guardar análisis en caché: {e}")
+
 # NUEVA FUNCIÓN: Extraer datos de Facebook con validación de precio
 def extraer_datos_facebook(post_data: Dict[str, Any]) -> Dict[str, Any]:
     """Extrae datos específicos de Facebook donde precio viene en campo separado"""
@@ -1066,17 +1514,23 @@ def extraer_datos_facebook(post_data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 # FUNCIÓN PRINCIPAL MEJORADA
-def analizar_mensaje_con_asignacion_inteligente(texto: str, precio_oficial: Optional[int] = None, debug: bool = False) -> Optional[Dict[str, Any]]:
+def analizar_mensaje_con_asignacion_inteligente(texto: Texto, precio_oficial: Optional[int] = None, debug: bool = False) -> Optional[Anuncio]:
     """
     Versión mejorada de analizar_mensaje con asignación inteligente de año y detección de modelo más frecuente
     """
-    if not texto or not isinstance(texto, str) or len(texto.strip()) < 10:
+    if not texto or not isinstance(texto, (str, TextoAnuncio)) or len(str(texto).strip()) < 10:
         if debug:
             print("❌ Texto inválido o demasiado corto")
         return None
 
-    texto = limpiar_emojis_numericos(texto) 
-    texto = normalizar_formatos_ano(texto)
+    # Reutilizar el análisis previo si el texto y la referencia no cambiaron
+    hash_contenido = hash_contenido_anuncio(texto, f"mensaje:{precio_oficial or ''}")
+    if not debug:
+        previo = obtener_analisis_cache(hash_contenido)
+        if previo:
+            return previo
+
+    texto = TextoAnuncio.de(texto)
 
     # PASO 1: Detectar modelo más frecuente (MEJORADO)
     modelo = detectar_modelo_mas_frecuente(texto, debug)
@@ -1086,7 +1540,7 @@ def analizar_mensaje_con_asignacion_inteligente(texto: str, precio_oficial: Opti
         return None
 
     # PASO 2: Extraer precio
-    precio = limpiar_precio(texto)
+    precio = extraer_precio(texto)
     if precio_oficial and precio_oficial > 0:
         precio = precio_oficial  # Usar precio oficial de Facebook si está disponible
     
@@ -1096,19 +1550,18 @@ def analizar_mensaje_con_asignacion_inteligente(texto: str, precio_oficial: Opti
         return None
 
     # PASO 3: Asignación inteligente de año (NUEVA FUNCIONALIDAD)
-    anio = asignar_año_inteligente(texto, modelo, precio, precio_oficial, debug)
-    año_asignado_inteligente = False
-    
-    if not anio:
+    resolucion = resolver_año_inteligente(texto, modelo, precio, precio_oficial, debug)
+    if not resolucion:
         if debug:
             print("❌ No se pudo asignar año confiable")
         return None
-    
-    # Verificar si el año fue asignado inteligentemente (no extraído del texto)
-    año_extraido_original = extraer_anio(texto, modelo=modelo, precio=precio, debug=False)
-    if not año_extraido_original:
-        año_asignado_inteligente = True
-        if debug:
+
+    anio = resolucion.anio
+    # La resolución ya indica si el año salió del texto o se infirió de datos históricos
+    año_asignado_inteligente = resolucion.inferido
+    if debug:
+        print(f"📌 Año {anio} (fuente: {resolucion.fuente}, confianza: {resolucion.confianza})")
+        if año_asignado_inteligente:
             print(f"🤖 Año {anio} asignado inteligentemente (no estaba en el texto)")
 
     # PASO 4: Validar coherencia precio-modelo-año
@@ -1120,52 +1573,41 @@ def analizar_mensaje_con_asignacion_inteligente(texto: str, precio_oficial: Opti
     # PASO 5: Calcular métricas
     roi_data = calcular_roi_real(modelo, precio, anio)
     
-    anuncio_dict = {
-        "texto": texto,
-        "modelo": modelo,
-        "anio": anio,
-        "precio": precio,
-        "roi": roi_data.get("roi", 0)
-    }
-    
-    score = puntuar_anuncio(anuncio_dict)
+    anuncio = Anuncio(
+        modelo=modelo,
+        anio=anio,
+        precio=precio,
+        roi=roi_data.get("roi", 0),
+        confianza_precio=roi_data["confianza"],
+        muestra_precio=roi_data["muestra"],
+        año_asignado_inteligente=año_asignado_inteligente,
+        fuente_anio=resolucion.fuente,
+        texto=texto,
+        roi_data=roi_data
+    )
+    anuncio.score = puntuar_anuncio(anuncio)
+    anuncio.relevante = anuncio.score >= SCORE_MIN_TELEGRAM and anuncio.roi >= ROI_MINIMO
 
     # PASO 6: Extraer URL si existe
-    url = ""
-    for palabra in texto.split():
+    for palabra in texto.limpio.split():
         if palabra.startswith("http"):
-            url = limpiar_link(palabra)
+            anuncio.link = limpiar_link(palabra)
             break
 
-    # RESULTADO FINAL
-    resultado = {
-        "url": url,
-        "modelo": modelo,
-        "año": anio,
-        "precio": precio,
-        "roi": roi_data["roi"],
-        "score": score,
-        "relevante": score >= SCORE_MIN_TELEGRAM and roi_data["roi"] >= ROI_MINIMO,
-        "km": "",
-        "confianza_precio": roi_data["confianza"],
-        "muestra_precio": roi_data["muestra"],
-        "año_asignado_inteligente": año_asignado_inteligente,
-        "roi_data": roi_data
-    }
-
     if debug:
         print(f"✅ Análisis completado:")
         print(f"   Modelo: {modelo}")
         print(f"   Año: {anio} {'(asignado inteligentemente)' if año_asignado_inteligente else '(extraído del texto)'}")
         print(f"   Precio: Q{precio:,}")
-        print(f"   ROI: {roi_data['roi']:.1f}%")
-        print(f"   Score: {score}")
-        print(f"   Relevante: {'Sí' if resultado['relevante'] else 'No'}")
+        print(f"   ROI: {anuncio.roi:.1f}%")
+        print(f"   Score: {anuncio.score}")
+        print(f"   Relevante: {'Sí' if anuncio.relevante else 'No'}")
 
-    return resultado
+    guardar_analisis_cache(hash_contenido, anuncio)
+    return anuncio
 
 # FUNCIÓN DE COMPATIBILIDAD: Mantener la función original para compatibilidad
-def analizar_mensaje(texto: str, debug: bool = False) -> Optional[Dict[str, Any]]:
+def analizar_mensaje(texto: Texto, debug: bool = False) -> Optional[Anuncio]:
     """
     Función original mantenida para compatibilidad.
     Redirige a la nueva función con asignación inteligente.
@@ -1173,7 +1615,7 @@ def analizar_mensaje(texto: str, debug: bool = False) -> Optional[Dict[str, Any]
     return analizar_mensaje_con_asignacion_inteligente(texto, debug=debug)
 
 # FUNCIÓN ESPECÍFICA PARA FACEBOOK
-def analizar_post_facebook(post_data: Dict[str, Any], debug: bool = False) -> Optional[Dict[str, Any]]:
+def analizar_post_facebook(post_data: Dict[str, Any], debug: bool = False) -> Optional[Anuncio]:
     """
     Función específica para analizar posts de Facebook con precio en campo separado
     """
@@ -1197,22 +1639,15 @@ def obtener_estadisticas_asignacion_inteligente(dias: int = 30) -> Dict[str, Any
     with get_db_connection() as conn:
         cur = conn.cursor()
         
-        # Verificar si existe la columna
-        cur.execute("PRAGMA table_info(anuncios)")
-        columnas = {row[1] for row in cur.fetchall()}
-        
-        if "año_asignado_inteligente" not in columnas:
-            return {"error": "Columna año_asignado_inteligente no existe"}
-        
-        # Estadísticas generales
+        # Estadísticas generales (resumen_diario: una fila por día y modelo)
         cur.execute("""
             SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN año_asignado_inteligente = 1 THEN 1 ELSE 0 END) as asignados_inteligente,
-                AVG(CASE WHEN año_asignado_inteligente = 1 THEN score ELSE NULL END) as score_promedio_asignados,
-                AVG(CASE WHEN año_asignado_inteligente = 0 THEN score ELSE NULL END) as score_promedio_extraidos
-            FROM anuncios 
-            WHERE fecha_scrape >= date('now', ?)
+                COALESCE(SUM(total), 0) as total,
+                COALESCE(SUM(asignados), 0) as asignados_inteligente,
+                SUM(suma_score_asignados) * 1.0 / NULLIF(SUM(con_score_asignados), 0) as score_promedio_asignados,
+                SUM(suma_score - suma_score_asignados) * 1.0 / NULLIF(SUM(con_score - con_score_asignados), 0) as score_promedio_extraidos
+            FROM resumen_diario 
+            WHERE fecha >= date('now', ?)
         """, (f"-{dias} days",))
         
         stats = cur.fetchone()
@@ -1221,13 +1656,13 @@ def obtener_estadisticas_asignacion_inteligente(dias: int = 30) -> Dict[str, Any
         cur.execute("""
             SELECT 
                 modelo,
-                COUNT(*) as total,
-                SUM(CASE WHEN año_asignado_inteligente = 1 THEN 1 ELSE 0 END) as asignados,
-                ROUND(AVG(CASE WHEN año_asignado_inteligente = 1 THEN roi ELSE NULL END), 1) as roi_promedio_asignados
-            FROM anuncios 
-            WHERE fecha_scrape >= date('now', ?)
+                SUM(total) as total,
+                SUM(asignados) as asignados,
+                ROUND(SUM(suma_roi_asignados) / NULLIF(SUM(con_roi_asignados), 0), 1) as roi_promedio_asignados
+            FROM resumen_diario 
+            WHERE fecha >= date('now', ?)
             GROUP BY modelo
-            HAVING COUNT(*) >= 5
+            HAVING SUM(total) >= 5
             ORDER BY asignados DESC
         """, (f"-{dias} days",))
         
@@ -1254,16 +1689,28 @@ def obtener_estadisticas_asignacion_inteligente(dias: int = 30) -> Dict[str, Any
 
 def obtener_modelos_con_datos_suficientes() -> List[Dict[str, Any]]:
     """Obtiene lista de modelos con suficientes datos para asignación inteligente"""
+    # Conteos con precio por (modelo, año) desde resumen_modelo_anio (anio 0 = sin año)
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT modelo, anio, con_precio FROM resumen_modelo_anio
+            WHERE anio != 0 AND con_precio > 0
+            ORDER BY modelo, anio
+        """)
+        por_modelo: Dict[str, Dict[int, int]] = {}
+        for modelo, anio, cantidad in cur.fetchall():
+            por_modelo.setdefault(modelo, {})[anio] = cantidad
+
     modelos_info = []
-    
     for modelo in MODELOS_INTERES:
-        datos = obtener_datos_historicos_modelo(modelo)
+        años = por_modelo.get(modelo, {})
+        total = sum(años.values())
         modelos_info.append({
             "modelo": modelo,
-            "total_anuncios": datos["total_anuncios"],
-            "años_únicos": datos.get("años_únicos", 0),
-            "suficientes_datos": datos["suficientes_datos"],
-            "año_más_común": datos.get("año_más_común")
+            "total_anuncios": total,
+            "años_únicos": len(años),
+            "suficientes_datos": total >= MUESTRA_MINIMA_ASIGNACION_AÑO,
+            "año_más_común": max(años.items(), key=lambda x: x[1])[0] if años else None
         })
     
     return sorted(modelos_info, key=lambda x: x["total_anuncios"], reverse=True)
@@ -1284,16 +1731,16 @@ def probar_asignacion_inteligente(textos_prueba: List[str], debug: bool = True)
         if resultado:
             resultados.append({
                 "texto": texto,
-                "modelo": resultado["modelo"],
-                "año": resultado["año"],
-                "precio": resultado["precio"],
-                "roi": resultado["roi"],
-                "score": resultado["score"],
-                "año_asignado_inteligente": resultado["año_asignado_inteligente"],
-                "relevante": resultado["relevante"]
+                "modelo": resultado.modelo,
+                "año": resultado.anio,
+                "precio": resultado.precio,
+                "roi": resultado.roi,
+                "score": resultado.score,
+                "año_asignado_inteligente": resultado.año_asignado_inteligente,
+                "relevante": resultado.relevante
             })
-            print(f"✅ ÉXITO: {resultado['modelo']} {resultado['año']} - Q{resultado['precio']:,} (ROI: {resultado['roi']:.1f}%)")
-            if resultado["año_asignado_inteligente"]:
+            print(f"✅ ÉXITO: {resultado.modelo} {resultado.anio} - Q{resultado.precio:,} (ROI: {resultado.roi:.1f}%)")
+            if resultado.año_asignado_inteligente:
                 print("🤖 Año asignado inteligentemente")
         else:
             print("❌ No se pudo analizar")